@@ -0,0 +1,235 @@
+"""Parity and performance comparison of the inference backends.
+
+Runs the same sketches through each backend, in a fresh process per backend so that their
+load times and memory use do not mix, and reports how closely the detections of every backend
+match those of the first one.
+
+Run from the repository root with ``python -m benchmarks.backends``, e.g.
+
+    python -m benchmarks.backends -b tensorflow opencv -i sketches/*.jpg
+"""
+
+import argparse
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+
+from benchmarks.preprocess import synthetic_sketch
+from src.settings import SETTINGS
+from src.utils import decode_sketch, preprocess
+
+
+def resident_memory() -> float:
+    """Current resident memory of this process in MB"""
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def profile_backend(backend: str, model_path: str, images: np.ndarray, repeat: int):
+    """Loads a backend, and times and collects its detections of each image"""
+    from src.backends import create_engine  # pylint: disable=import-outside-toplevel
+
+    memory_before = resident_memory()
+
+    start = time.perf_counter()
+    engine = create_engine(backend, model_path)
+    load_time = time.perf_counter() - start
+    load_memory = resident_memory() - memory_before
+
+    start = time.perf_counter()
+    engine.warmup()
+    warmup_time = time.perf_counter() - start
+
+    latencies = []
+    outputs = []
+    for image in images:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = engine.run_single(image)
+            latencies.append(time.perf_counter() - start)
+        outputs.append(output)
+
+    start = time.perf_counter()
+    engine.run(images)
+    batch_time = time.perf_counter() - start
+
+    engine.close()
+
+    return {
+        "load": load_time,
+        "warmup": warmup_time,
+        "latencies": latencies,
+        "batch": batch_time,
+        "load_memory": load_memory,
+        "peak_memory": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "outputs": outputs,
+    }
+
+
+def box_iou(boxes: np.ndarray, other_boxes: np.ndarray) -> np.ndarray:
+    """Intersection over union of every pair of (ymin, xmin, ymax, xmax) boxes"""
+    top_left = np.maximum(boxes[:, np.newaxis, :2], other_boxes[np.newaxis, :, :2])
+    bottom_right = np.minimum(boxes[:, np.newaxis, 2:], other_boxes[np.newaxis, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=-1)
+
+    area = np.prod(boxes[:, 2:] - boxes[:, :2], axis=-1)
+    other_area = np.prod(other_boxes[:, 2:] - other_boxes[:, :2], axis=-1)
+    union = area[:, np.newaxis] + other_area[np.newaxis, :] - intersection
+
+    return intersection / np.maximum(union, 1e-9)
+
+
+def selected(output: dict, min_prob: float):
+    count = output["num_detections"]
+    keep = output["detection_scores"][:count] >= min_prob
+    return (
+        output["detection_boxes"][:count][keep],
+        output["detection_scores"][:count][keep],
+        output["detection_classes"][:count][keep],
+    )
+
+
+def compare(reference: dict, output: dict, min_prob: float, iou_threshold: float):
+    """Greedily matches the detections of a backend to the reference detections
+
+    Returns:
+        tuple -- Reference and backend detection counts, matches of the same class, and the
+            IoUs and absolute score differences of the matches
+    """
+    boxes, scores, classes = selected(reference, min_prob)
+    other_boxes, other_scores, other_classes = selected(output, min_prob)
+
+    ious = box_iou(boxes, other_boxes)
+    ious[classes[:, np.newaxis] != other_classes[np.newaxis, :]] = 0
+
+    matched_ious, score_differences = [], []
+    for index in range(len(boxes)):
+        if not ious.shape[1]:
+            break
+        match = int(np.argmax(ious[index]))
+        if ious[index, match] < iou_threshold:
+            continue
+        matched_ious.append(ious[index, match])
+        score_differences.append(abs(scores[index] - other_scores[match]))
+        ious[:, match] = 0
+
+    return len(boxes), len(other_boxes), len(matched_ious), matched_ious, score_differences
+
+
+def load_images(paths, count: int) -> np.ndarray:
+    if paths:
+        sketches = []
+        for path in paths:
+            with open(path, "rb") as image_file:
+                image, height, width = decode_sketch(image_file.read())
+            sketches.append(preprocess(image, old_size=(height, width))[0])
+        return np.stack(sketches)
+
+    return np.stack(
+        [preprocess(synthetic_sketch(1600, 1200, seed=seed))[0] for seed in range(count)]
+    )
+
+
+def profile_in_subprocess(backend: str, model_path: str, images: np.ndarray, repeat: int):
+    """Runs ``profile_backend`` in a fresh interpreter, so that load time and memory are
+    measured in isolation"""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(profile_backend, (backend, model_path, images, repeat))
+
+
+def print_performance(results: dict, image_count: int, repeat: int):
+    """Prints the load time, latency, and memory of profiled backends by their labels"""
+    print(f"{image_count} sketches, {repeat} runs each, batch of {image_count} once")
+    print(
+        f"{'model':<12} {'load s':>8} {'warmup s':>9} {'p50 ms':>8} {'p95 ms':>8}"
+        f" {'batch ms/img':>13} {'load MB':>8} {'peak MB':>8}"
+    )
+    for label, result in results.items():
+        latencies = 1000 * np.array(result["latencies"])
+        print(
+            f"{label:<12} {result['load']:8.2f} {result['warmup']:9.2f}"
+            f" {np.percentile(latencies, 50):8.1f} {np.percentile(latencies, 95):8.1f}"
+            f" {1000 * result['batch'] / image_count:13.1f}"
+            f" {result['load_memory']:8.0f} {result['peak_memory']:8.0f}"
+        )
+
+
+def print_parity(results: dict, min_prob: float, iou_threshold: float):
+    """Prints how closely the detections of profiled backends match the first one's"""
+    reference_label, *other_labels = results
+    reference_outputs = results[reference_label]["outputs"]
+
+    print(f"Parity with {reference_label} (probability >= {min_prob}, IoU >= {iou_threshold})")
+    for label in other_labels:
+        totals = np.zeros(3, dtype=np.int64)
+        ious, score_differences = [], []
+        for reference, output in zip(reference_outputs, results[label]["outputs"]):
+            *counts, image_ious, image_score_differences = compare(
+                reference, output, min_prob, iou_threshold
+            )
+            totals += counts
+            ious += image_ious
+            score_differences += image_score_differences
+
+        reference_count, count, matches = totals.tolist()
+        print(
+            f"{label:<12} {matches}/{reference_count} reference detections matched,"
+            f" {count - matches} extra, mean IoU {np.mean(ious) if ious else float('nan'):.3f},"
+            f" max score difference {max(score_differences, default=float('nan')):.4f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "-b",
+        "--backends",
+        nargs="+",
+        default=["tensorflow", "opencv"],
+        help="Backends to compare, the first one is the reference (default: tensorflow opencv)",
+    )
+    parser.add_argument(
+        "-m",
+        "--model",
+        action="append",
+        default=[],
+        metavar="BACKEND=PATH",
+        help=f"Model file of a backend (default: {SETTINGS.model_path})",
+    )
+    parser.add_argument(
+        "-i", "--images", nargs="*", help="Sketches to run (default: synthetic sketches)"
+    )
+    parser.add_argument(
+        "-n", "--count", type=int, default=8, help="Number of synthetic sketches (default: 8)"
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Runs per sketch")
+    parser.add_argument(
+        "-p", "--min-prob", type=float, default=0.8, help="Minimum detection probability"
+    )
+    parser.add_argument(
+        "--iou", type=float, default=0.9, help="Minimum IoU of matching detections (default: 0.9)"
+    )
+    args = parser.parse_args()
+
+    model_paths = dict(model.split("=", 1) for model in args.model)
+    images = load_images(args.images, args.count)
+
+    results = {}
+    for backend in args.backends:
+        model_path = model_paths.get(backend, SETTINGS.model_path)
+        results[backend] = profile_in_subprocess(backend, model_path, images, args.repeat)
+
+    print_performance(results, len(images), args.repeat)
+    print()
+    print_parity(results, args.min_prob, args.iou)
+
+
+if __name__ == "__main__":
+    main()
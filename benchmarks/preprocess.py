@@ -0,0 +1,144 @@
+"""Micro-benchmark of the sketch decoding and preprocessing stages.
+
+Compares each stage of the fused preprocessing path in ``src.utils`` against the original
+implementation on a synthetic sketch, and reports how far their model inputs differ.
+
+Run from the repository root with ``python -m benchmarks.preprocess``.
+"""
+
+import argparse
+import timeit
+
+import cv2
+import numpy as np
+
+from src.utils import decode_bitmap, decode_sketch, letterbox_buffer, preprocess
+
+
+def reference_preprocess(image: np.ndarray):
+    """Preprocessing as originally implemented, one full-size array per step"""
+    grayscale_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    _, thresh_binary_image = cv2.threshold(grayscale_image, 220, 255, cv2.THRESH_BINARY)
+    image = cv2.bitwise_not(thresh_binary_image)
+
+    desired_size = 640
+    old_size = image.shape[:2]
+
+    ratio = float(desired_size) / max(old_size)
+    new_size = tuple([int(x * ratio) for x in old_size])
+
+    im = cv2.resize(image, (new_size[1], new_size[0]))
+
+    delta_w = desired_size - new_size[1]
+    delta_h = desired_size - new_size[0]
+    top, bottom = delta_h // 2, delta_h - (delta_h // 2)
+    left, right = delta_w // 2, delta_w - (delta_w // 2)
+
+    new_im = cv2.copyMakeBorder(im, top, bottom, left, right, cv2.BORDER_CONSTANT, value=[0, 0, 0])
+
+    return cv2.cvtColor(new_im, cv2.COLOR_GRAY2BGR), top, left, ratio
+
+
+def synthetic_sketch(height: int, width: int, seed: int = 0) -> np.ndarray:
+    """Photo-like sketch: off-white paper with dark pen strokes"""
+    rng = np.random.RandomState(seed)
+    image = np.full((height, width, 3), 235, dtype=np.uint8)
+    image += rng.randint(0, 20, size=(height, width, 1), dtype=np.uint8)
+
+    thickness = max(2, width // 500)
+    for _ in range(60):
+        x, y = rng.randint(0, width - width // 5), rng.randint(0, height - height // 10)
+        w, h = rng.randint(width // 20, width // 5), rng.randint(height // 40, height // 10)
+        cv2.rectangle(image, (x, y), (x + w, y + h), (40, 40, 40), thickness)
+
+    return image
+
+
+def measure(statement, repeat: int):
+    timings = timeit.repeat(statement, number=1, repeat=repeat)
+    return 1000 * np.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-s",
+        "--size",
+        default="3024x4032",
+        help="Width x height of the synthetic sketch (default: 3024x4032, a 12 MP photo)",
+    )
+    parser.add_argument(
+        "-f", "--format", default="jpg", choices=["jpg", "png"], help="Upload format"
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=20, help="Runs per stage")
+    args = parser.parse_args()
+
+    width, height = [int(side) for side in args.size.lower().split("x")]
+    sketch = synthetic_sketch(height, width)
+    data = cv2.imencode(f".{args.format}", sketch)[1].tobytes()
+    buffer = np.frombuffer(data, dtype=np.uint8)
+
+    color = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    gray, _, _ = decode_sketch(data)
+    out = letterbox_buffer()
+
+    # The sketch as a client would binarize it at the model input size and send it
+    bitmap = bitmap_upload(preprocess(color)[0][..., 0], height, width)
+
+    stages = [
+        ("decode: color (original)", lambda: cv2.imdecode(buffer, cv2.IMREAD_COLOR)),
+        ("decode: grayscale", lambda: cv2.imdecode(buffer, cv2.IMREAD_GRAYSCALE)),
+        ("decode: grayscale, reduced (fused)", lambda: decode_sketch(data)),
+        ("preprocess: color input (original)", lambda: reference_preprocess(color)),
+        ("preprocess: color input (fused)", lambda: preprocess(color)),
+        (
+            "preprocess: reduced input (fused)",
+            lambda: preprocess(gray, old_size=(height, width), out=out),
+        ),
+        (
+            "total (original)",
+            lambda: reference_preprocess(cv2.imdecode(buffer, cv2.IMREAD_COLOR)),
+        ),
+        ("total (fused)", lambda: preprocess(*fused_args(data), out=out)),
+        (
+            "total (1-bit bitmap)",
+            lambda: preprocess(decode_bitmap(bitmap)[0], out=out, binary=True),
+        ),
+    ]
+
+    print(f"{width}x{height} {args.format}, {len(data) / 1e6:.1f} MB, median of {args.repeat} runs")
+    print(f"1-bit bitmap of the model input: {len(bitmap) / 1e3:.1f} KB")
+    for name, statement in stages:
+        print(f"{name:<40} {measure(statement, args.repeat):8.2f} ms")
+
+    reference, *reference_letterbox = reference_preprocess(color)
+    same_input, *same_letterbox = preprocess(color)
+    fused, *fused_letterbox = preprocess(*fused_args(data))
+
+    print()
+    print(f"fused == original on the same color input: {np.array_equal(reference, same_input)}")
+    print(f"letterbox of fused decode == original: {fused_letterbox == reference_letterbox}")
+    difference = np.abs(reference.astype(np.int16) - fused)
+    print(
+        f"fused decode vs original: {np.mean(difference > 32):.4%} of pixels differ by more than 32,"
+        f" mean absolute difference {difference.mean():.3f}"
+    )
+
+
+def bitmap_upload(model_input: np.ndarray, height: int, width: int) -> bytes:
+    """Crops the letterboxed model input to the sketch and packs it into a 1-bit PBM"""
+    ratio = model_input.shape[0] / max(height, width)
+    new_height, new_width = int(height * ratio), int(width * ratio)
+    top, left = (model_input.shape[0] - new_height) // 2, (model_input.shape[1] - new_width) // 2
+
+    ink = model_input[top : top + new_height, left : left + new_width] > 127
+    return f"P4\n{new_width} {new_height}\n".encode() + np.packbits(ink, axis=1).tobytes()
+
+
+def fused_args(data: bytes):
+    image, height, width = decode_sketch(data)
+    return image, (height, width)
+
+
+if __name__ == "__main__":
+    main()
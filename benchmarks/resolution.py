@@ -0,0 +1,174 @@
+"""Accuracy and latency of the detector at each input resolution.
+
+Runs every sketch of an annotated eval set at each of the given input sizes, and reports the
+precision, recall, and inference latency per size, along with those of the sizes picked
+automatically from the sketch signals. The eval set is a directory of sketches and a labels CSV
+with the columns filename, width, height, class, xmin, ymin, xmax, ymax, as written by
+``syn_datagen.py`` (uisketch_labels.csv).
+
+Run from the repository root with ``python -m benchmarks.resolution``, e.g.
+
+    python -m benchmarks.resolution -l data/uisketch_labels.csv -i data/images -s 320 480 640
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from benchmarks.backends import box_iou
+from src.resolution import choose_input_size, measure_sketch
+from src.settings import SETTINGS
+from src.utils import decode_sketch, postprocess, preprocess
+
+
+def load_annotations(labels_path: str) -> dict:
+    """Ground truth boxes (xmin, ymin, xmax, ymax) and class names by sketch filename"""
+    annotations = defaultdict(lambda: ([], []))
+    with open(labels_path, newline="") as labels_file:
+        for row in csv.DictReader(labels_file):
+            boxes, names = annotations[row["filename"]]
+            boxes.append([int(row[key]) for key in ["xmin", "ymin", "xmax", "ymax"]])
+            names.append(row["class"])
+
+    return {
+        filename: (np.array(boxes, dtype=np.float64).reshape(-1, 4), np.array(names))
+        for filename, (boxes, names) in annotations.items()
+    }
+
+
+def match(detections, truth_boxes: np.ndarray, truth_names: np.ndarray, iou_threshold: float):
+    """Greedily matches detections, by descending probability, to ground truth boxes of the
+    same class
+
+    Returns:
+        tuple -- Numbers of true positives, false positives, and false negatives
+    """
+    order = np.argsort(-detections.probabilities, kind="stable")
+    boxes = detections.boxes[order].astype(np.float64)
+    names = detections.names[order]
+
+    ious = box_iou(boxes, truth_boxes)
+    ious[names[:, np.newaxis] != truth_names[np.newaxis, :]] = 0
+
+    true_positives = 0
+    for index in range(len(boxes)):
+        if not ious.shape[1]:
+            break
+        truth = int(np.argmax(ious[index]))
+        if ious[index, truth] >= iou_threshold:
+            true_positives += 1
+            ious[:, truth] = 0
+
+    return true_positives, len(boxes) - true_positives, len(truth_boxes) - true_positives
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("-l", "--labels", required=True, help="Labels CSV of the eval set")
+    parser.add_argument("-i", "--images", required=True, help="Directory of the eval sketches")
+    parser.add_argument(
+        "-s",
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=SETTINGS.input_sizes,
+        help=f"Input sizes to compare (default: {SETTINGS.input_sizes})",
+    )
+    parser.add_argument(
+        "-b", "--backend", default=SETTINGS.backend, help=f"Backend (default: {SETTINGS.backend})"
+    )
+    parser.add_argument(
+        "-m", "--model", default=SETTINGS.model_path, help="Model file of the backend"
+    )
+    parser.add_argument(
+        "-p", "--min-prob", type=float, default=0.8, help="Minimum detection probability"
+    )
+    parser.add_argument(
+        "--iou", type=float, default=0.5, help="Minimum IoU of a true positive (default: 0.5)"
+    )
+    parser.add_argument("--labelmap", default="models/labels.json", help="Labels JSON of the model")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Timed runs per size")
+    args = parser.parse_args()
+
+    from src.backends import create_engine  # pylint: disable=import-outside-toplevel
+
+    sizes = sorted(set(args.sizes))
+    engine = create_engine(args.backend, args.model, input_size=sizes[-1], input_sizes=sizes)
+    engine.warmup()
+
+    with open(args.labelmap) as labelmap_file:
+        category_index = json.load(labelmap_file)
+    category_names = np.array([category["name"] for category in category_index], dtype=object)
+
+    annotations = load_annotations(args.labels)
+
+    # Counts of true positives, false positives, and false negatives, and latencies, by size
+    counts = {size: np.zeros(3, dtype=np.int64) for size in sizes + ["auto"]}
+    latencies = {size: [] for size in sizes + ["auto"]}
+    picked = Counter()
+
+    for filename, (truth_boxes, truth_names) in annotations.items():
+        with open(os.path.join(args.images, filename), "rb") as image_file:
+            image, height, width = decode_sketch(image_file.read(), sizes[-1])
+
+        auto_size = choose_input_size(
+            measure_sketch(image, (height, width)),
+            sizes,
+            min_element_pixels=SETTINGS.resolution_min_element_pixels,
+            max_components=SETTINGS.resolution_max_components,
+            max_ink_density=SETTINGS.resolution_max_ink_density,
+        )
+        picked[auto_size] += 1
+
+        for size in sizes:
+            preprocessed_image, top, left, ratio = preprocess(
+                image, old_size=(height, width), desired_size=size
+            )
+
+            size_latencies = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                output_dict = engine.run(preprocessed_image[np.newaxis])
+                size_latencies.append(time.perf_counter() - start)
+
+            (detections,) = postprocess(
+                output_dict, args.min_prob, [top], [left], [ratio], category_names, (size, size)
+            )
+            image_counts = match(detections, truth_boxes, truth_names, args.iou)
+
+            for key in [size, "auto"] if size == auto_size else [size]:
+                counts[key] += image_counts
+                latencies[key].append(np.median(size_latencies))
+
+    print(
+        f"{len(annotations)} sketches, {args.backend}, probability >= {args.min_prob},"
+        f" IoU >= {args.iou}"
+    )
+    print(f"{'size':>6} {'precision':>10} {'recall':>8} {'F1':>6} {'p50 ms':>8} {'p95 ms':>8}")
+    for size in sizes + ["auto"]:
+        true_positives, false_positives, false_negatives = counts[size].tolist()
+        precision = true_positives / max(1, true_positives + false_positives)
+        recall = true_positives / max(1, true_positives + false_negatives)
+        f1 = 2 * precision * recall / max(1e-9, precision + recall)
+        size_latencies = 1000 * np.array(latencies[size] or [np.nan])
+        print(
+            f"{size!s:>6} {precision:10.3f} {recall:8.3f} {f1:6.3f}"
+            f" {np.percentile(size_latencies, 50):8.1f} {np.percentile(size_latencies, 95):8.1f}"
+        )
+
+    print(
+        "auto picked "
+        + ", ".join(f"{size}: {picked[size]}" for size in sizes)
+        + f" of {len(annotations)} sketches"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Micro-benchmark of the response serialization of a prediction.
+
+Compares building and validating a ``ResponseSchema`` and encoding it as FastAPI does, as
+originally implemented, against the fast path in ``src.serialization``, in the default and the
+columnar layout, on synthetic detections.
+
+Run from the repository root with ``python -m benchmarks.serialization``.
+"""
+
+import argparse
+import timeit
+
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from starlette.responses import JSONResponse
+
+from src.models import Detections, Prediction, ResponseSchema
+from src.serialization import dumps, orjson, prediction_content
+
+
+def synthetic_prediction(elements: int, seed: int = 0) -> Prediction:
+    """Prediction of ``elements`` random boxes of a 1080x1920 sketch"""
+    rng = np.random.RandomState(seed)
+    top_left = rng.randint(0, 900, size=(elements, 2))
+    boxes = np.concatenate([top_left, top_left + rng.randint(10, 200, size=(elements, 2))], axis=1)
+    names = np.array(["button", "label", "text_field", "checkbox"], dtype=object)
+
+    detections = Detections(
+        names[rng.randint(0, len(names), size=elements)],
+        boxes.astype(np.int64),
+        np.round(rng.uniform(80, 100, size=elements), 2),
+    )
+    return Prediction("d551fed6-cab3-11f1-96da-02fc00000001", "1.0.0", 1080, 1920, detections)
+
+
+def reference_serialize(prediction: Prediction) -> bytes:
+    """Serialization as originally implemented, through the validated response model"""
+    response = ResponseSchema(
+        id=prediction.id,
+        model_version=prediction.model_version,
+        width=prediction.width,
+        height=prediction.height,
+        objects=prediction.detections.to_objects(),
+    )
+    return JSONResponse(content=jsonable_encoder(response, exclude_none=True)).body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-e", "--elements", type=int, nargs="+", default=[10, 100, 500], help="Elements per sketch"
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=200, help="Runs per path")
+    args = parser.parse_args()
+
+    paths = [
+        ("ResponseSchema (original)", reference_serialize),
+        ("fast path", lambda prediction: dumps(prediction_content(prediction))),
+        ("fast path, columnar", lambda prediction: dumps(prediction_content(prediction, True))),
+    ]
+
+    print(
+        f"JSON encoder: {'orjson' if orjson is not None else 'json'}, median of {args.repeat} runs"
+    )
+    print(f"{'path':<28}" + "".join(f"{f'{elements} elements':>16}" for elements in args.elements))
+    for name, serialize in paths:
+        timings = []
+        for elements in args.elements:
+            prediction = synthetic_prediction(elements)
+            runs = timeit.repeat(lambda: serialize(prediction), number=1, repeat=args.repeat)
+            timings.append(f"{1000 * np.median(runs):13.3f} ms")
+        print(f"{name:<28}" + "".join(timings))
+
+    prediction = synthetic_prediction(args.elements[-1])
+    same = ResponseSchema.parse_raw(reference_serialize(prediction)) == ResponseSchema.parse_raw(
+        dumps(prediction_content(prediction))
+    )
+    print()
+    print(f"fast path == original response: {same}")
+
+
+if __name__ == "__main__":
+    main()
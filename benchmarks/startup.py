@@ -0,0 +1,107 @@
+"""Startup benchmark of an API worker.
+
+Measures, in fresh processes, how long importing ``src.app`` takes and whether it imports
+Tensorflow, and how long a uvicorn worker takes until ``/healthz`` (alive) and ``/readyz``
+(model loaded and warmed up) respond with 200.
+
+Run from the repository root with ``python -m benchmarks.startup``.
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import src.app
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "tensorflow": "tensorflow" in sys.modules,
+    "modules": len(sys.modules),
+}))
+"""
+
+
+def measure_import() -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT], stdout=subprocess.PIPE, check=True
+    ).stdout
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def responds(url: str) -> bool:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200
+    except (urllib.error.URLError, ConnectionError, OSError):
+        return False
+
+
+def measure_boot(port: int, timeout: float) -> dict:
+    """Starts a worker and times until it is alive and ready"""
+    base_url = f"http://127.0.0.1:{port}"
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "src.app:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ]
+    )
+
+    timings = {}
+    try:
+        while time.perf_counter() - start < timeout and "ready" not in timings:
+            if server.poll() is not None:
+                raise RuntimeError(f"Worker exited with status {server.returncode}")
+
+            for probe, path in [("alive", "/healthz"), ("ready", "/readyz")]:
+                if probe not in timings and responds(base_url + path):
+                    timings[probe] = time.perf_counter() - start
+
+            time.sleep(0.05)
+    finally:
+        server.terminate()
+        server.wait()
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Runs of each measurement")
+    parser.add_argument("-p", "--port", type=int, default=8765, help="Port of the test worker")
+    parser.add_argument(
+        "-t", "--timeout", type=float, default=300, help="Seconds to wait for readiness"
+    )
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.repeat)]
+    print(
+        f"import src.app: {1000 * np.median([run['seconds'] for run in imports]):.0f} ms,"
+        f" {imports[-1]['modules']} modules, Tensorflow imported: {imports[-1]['tensorflow']}"
+    )
+
+    boots = [measure_boot(args.port, args.timeout) for _ in range(args.repeat)]
+    for probe in ["alive", "ready"]:
+        timings = [boot[probe] for boot in boots if probe in boot]
+        if timings:
+            print(f"worker {probe}: {np.median(timings):.2f} s (median of {len(timings)})")
+        else:
+            print(f"worker {probe}: not within {args.timeout:.0f} s")
+
+
+if __name__ == "__main__":
+    main()
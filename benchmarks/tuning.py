@@ -0,0 +1,157 @@
+"""Thread and CPU affinity sweep of the prediction pipeline.
+
+Runs concurrent requests, each decoding and preprocessing a sketch and then waiting for its
+detections from the micro-batcher, once for every combination of the given intra-op, inter-op,
+and OpenCV thread counts. Every combination runs in a fresh process, optionally pinned to a CPU
+list, and reports its throughput and latency percentiles. Use the best combination as the
+METAMORPH_INTRA_OP_THREADS, METAMORPH_INTER_OP_THREADS, and METAMORPH_OPENCV_THREADS of a
+worker pinned to as many CPUs.
+
+Run from the repository root with ``python -m benchmarks.tuning``, e.g.
+
+    python -m benchmarks.tuning --intra 1 2 4 --inter 1 2 --opencv 1 2 --cpus 0-3
+"""
+
+import argparse
+import itertools
+import multiprocessing
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from benchmarks.preprocess import synthetic_sketch
+from src.settings import SETTINGS
+from src.utils import decode_sketch, preprocess
+
+
+def run_configuration(
+    backend: str,
+    model_path: str,
+    sketches: list,
+    configuration: tuple,
+    cpus: str,
+    concurrency: int,
+    requests: int,
+):
+    """Loads the engine with the thread counts of a configuration and serves requests with it"""
+    # pylint: disable=import-outside-toplevel
+    from src.backends import create_engine
+    from src.batching import MicroBatcher
+    from src.tuning import apply_cpu_settings
+
+    intra_op_threads, inter_op_threads, opencv_threads = configuration
+    apply_cpu_settings(cpus, opencv_threads)
+
+    engine = create_engine(
+        backend,
+        model_path,
+        intra_op_threads=intra_op_threads,
+        inter_op_threads=inter_op_threads,
+    )
+    engine.warmup(SETTINGS.warmup_runs)
+    batcher = MicroBatcher(
+        engine, SETTINGS.max_batch_size, SETTINGS.max_batch_delay_ms, SETTINGS.batch_workers
+    )
+    batcher.start()
+
+    def predict(index: int) -> float:
+        start = time.perf_counter()
+        image, height, width = decode_sketch(sketches[index % len(sketches)])
+        batcher.submit(preprocess(image, old_size=(height, width))[0]).result()
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(concurrency) as executor:
+        # One round untimed, so that every thread and buffer exists before measuring
+        list(executor.map(predict, range(concurrency)))
+
+        start = time.perf_counter()
+        latencies = list(executor.map(predict, range(requests)))
+        duration = time.perf_counter() - start
+
+    batcher.stop()
+    engine.close()
+
+    return {"throughput": requests / duration, "latencies": latencies}
+
+
+def run_in_subprocess(*args):
+    """Runs ``run_configuration`` in a fresh interpreter, so that thread pools of earlier
+    configurations do not linger"""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_configuration, args)
+
+
+def thread_count(count: int) -> str:
+    return "default" if count is None or count == 0 else str(count)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "-b", "--backend", default=SETTINGS.backend, help=f"Backend (default: {SETTINGS.backend})"
+    )
+    parser.add_argument(
+        "-m", "--model", default=SETTINGS.model_path, help="Model file of the backend"
+    )
+    parser.add_argument(
+        "--intra", type=int, nargs="+", default=[0, 1, 2, 4], help="Intra-op thread counts"
+    )
+    parser.add_argument("--inter", type=int, nargs="+", default=[0, 1, 2], help="Inter-op counts")
+    parser.add_argument(
+        "--opencv", type=int, nargs="+", default=[1, 2], help="OpenCV thread counts"
+    )
+    parser.add_argument("--cpus", help="CPU list to pin each run to, e.g. 0-3 (default: all)")
+    parser.add_argument(
+        "-c", "--concurrency", type=int, default=8, help="Concurrent requests (default: 8)"
+    )
+    parser.add_argument("-n", "--requests", type=int, default=64, help="Requests per configuration")
+    parser.add_argument(
+        "-s", "--size", default="1200x1600", help="Width x height of the synthetic sketches"
+    )
+    args = parser.parse_args()
+
+    width, height = [int(side) for side in args.size.lower().split("x")]
+    sketches = [
+        cv2.imencode(".jpg", synthetic_sketch(height, width, seed=seed))[1].tobytes()
+        for seed in range(4)
+    ]
+
+    print(
+        f"{args.backend}, {args.concurrency} concurrent requests, {args.requests} per"
+        f" configuration, CPUs {args.cpus or 'all'}"
+    )
+    print(f"{'intra':>7} {'inter':>7} {'opencv':>7} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+
+    results = []
+    for configuration in itertools.product(args.intra, args.inter, args.opencv):
+        result = run_in_subprocess(
+            args.backend,
+            args.model,
+            sketches,
+            configuration,
+            args.cpus,
+            args.concurrency,
+            args.requests,
+        )
+        results.append((configuration, result))
+
+        latencies = 1000 * np.array(result["latencies"])
+        print(
+            " ".join(f"{thread_count(count):>7}" for count in configuration)
+            + f" {result['throughput']:8.1f} {np.percentile(latencies, 50):8.1f}"
+            f" {np.percentile(latencies, 99):8.1f}"
+        )
+
+    best, result = max(results, key=lambda item: item[1]["throughput"])
+    print(
+        f"\nHighest throughput: intra {thread_count(best[0])}, inter {thread_count(best[1])},"
+        f" opencv {thread_count(best[2])} ({result['throughput']:.1f} req/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Gunicorn configuration of the MetaMorph API.
+
+Gunicorn reads it from the working directory, e.g.
+
+    METAMORPH_CPU_AFFINITY=0-7 gunicorn -w 4 -k uvicorn.workers.UvicornWorker src.app:app
+
+With METAMORPH_CPU_AFFINITY set, every worker is pinned to its own share of the listed CPUs,
+so that the inference threads of different workers do not compete for the same cores. Set
+METAMORPH_INTRA_OP_THREADS to the number of CPUs per worker to match.
+"""
+
+from src.settings import SETTINGS
+from src.tuning import format_cpu_list, parse_cpu_list, pin_cpus, worker_cpus
+
+# Shares of the CPUs held by the running workers, tracked in the master
+_taken_shares = set()
+
+
+def pre_fork(server, worker):
+    if not SETTINGS.cpu_affinity:
+        return
+
+    # A replacement worker takes over the share of the worker it replaces
+    worker.cpu_share = min(set(range(len(_taken_shares) + 1)) - _taken_shares)
+    _taken_shares.add(worker.cpu_share)
+
+
+def child_exit(server, worker):
+    _taken_shares.discard(getattr(worker, "cpu_share", None))
+
+
+def post_fork(server, worker):
+    if not SETTINGS.cpu_affinity:
+        return
+
+    workers = server.num_workers
+    cpus = worker_cpus(parse_cpu_list(SETTINGS.cpu_affinity), worker.cpu_share, workers)
+
+    # The forked worker shares the settings module of the master, the app pins to the share too
+    SETTINGS.cpu_affinity = format_cpu_list(cpus)
+    pin_cpus(cpus)
@@ -0,0 +1,128 @@
+""" Optimize the frozen detection graph for inference and compare it with the original. """
+
+import warnings
+
+warnings.filterwarnings("ignore", message=r"Passing", category=FutureWarning)
+
+
+import argparse
+import os
+
+from benchmarks.backends import load_images, print_parity, print_performance, profile_in_subprocess
+from src.graph_optimization import graph_transforms, optimize_graph
+from src.settings import SETTINGS
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=(
+            "Optimize the frozen detection graph for inference, and report its size, load time,"
+            " latency, and detection parity before and after."
+        )
+    )
+
+    parser.add_argument(
+        "-i",
+        "--input",
+        default="models/frozen_inference_graph.pb",
+        dest="input",
+        help="Frozen inference graph (default: models/frozen_inference_graph.pb)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default="models/optimized_inference_graph.pb",
+        dest="output",
+        help="Optimized inference graph (default: models/optimized_inference_graph.pb)",
+    )
+    parser.add_argument(
+        "-s",
+        "--input-size",
+        type=int,
+        dest="input_size",
+        help=(
+            "Side length of the square input images, which has to be the only size of"
+            " METAMORPH_INPUT_SIZES (default: that size, or open spatial dimensions with several"
+            " input sizes)"
+        ),
+    )
+    parser.add_argument(
+        "-q",
+        "--quantize",
+        action="store_true",
+        dest="quantize",
+        help="Quantize weights to 8 bits",
+    )
+    parser.add_argument(
+        "--sketches",
+        nargs="*",
+        dest="sketches",
+        help="Sample sketches of the parity check (default: synthetic sketches)",
+    )
+    parser.add_argument(
+        "-n",
+        "--count",
+        type=int,
+        default=8,
+        dest="count",
+        help="Number of synthetic sketches (default: 8)",
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=5, dest="repeat", help="Runs per sketch (default: 5)"
+    )
+    parser.add_argument(
+        "-p",
+        "--min-prob",
+        type=float,
+        default=0.8,
+        dest="min_prob",
+        help="Minimum detection probability of the parity check (default: 0.8)",
+    )
+    parser.add_argument(
+        "--iou",
+        type=float,
+        default=0.9,
+        dest="iou",
+        help="Minimum IoU of matching detections (default: 0.9)",
+    )
+    parser.add_argument(
+        "--no-report",
+        action="store_false",
+        dest="report",
+        help="Only write the optimized graph",
+    )
+
+    args = parser.parse_args()
+
+    # A graph fixed to one size fails at the other sizes the engine warms up and runs at
+    input_sizes = sorted(set(SETTINGS.input_sizes))
+    if args.input_size is None:
+        input_size = input_sizes[0] if len(input_sizes) == 1 else None
+    elif input_sizes != [args.input_size]:
+        parser.error(
+            f"a graph fixed to {args.input_size}x{args.input_size} inputs cannot run at the"
+            f" METAMORPH_INPUT_SIZES {input_sizes}, leave out --input-size"
+        )
+    else:
+        input_size = args.input_size
+
+    print("Transforms:", " ".join(graph_transforms(input_size, args.quantize)))
+    outputs = optimize_graph(args.input, args.output, input_size, args.quantize)
+    print("Outputs:", ", ".join(outputs))
+
+    original_size, optimized_size = os.path.getsize(args.input), os.path.getsize(args.output)
+    print(
+        f"Size: {original_size / 1e6:.1f} MB -> {optimized_size / 1e6:.1f} MB"
+        f" ({optimized_size / original_size:.0%})"
+    )
+
+    if args.report:
+        images = load_images(args.sketches, args.count)
+        results = {
+            "original": profile_in_subprocess("tensorflow", args.input, images, args.repeat),
+            "optimized": profile_in_subprocess("tensorflow", args.output, images, args.repeat),
+        }
+
+        print()
+        print_performance(results, len(images), args.repeat)
+        print()
+        print_parity(results, args.min_prob, args.iou)
@@ -0,0 +1,125 @@
+""" Detect UI elements in every sketch of a directory tree, without the web API. """
+
+import warnings
+
+warnings.filterwarnings("ignore", message=r"Passing", category=FutureWarning)
+
+
+import argparse
+
+from src.bulk import CheckpointMismatchError, DecodingPool, ResultWriter, predict_directory
+from src.settings import SETTINGS
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=(
+            "Detect UI elements in every JPG, PNG, and PBM sketch of a directory tree and write the"
+            " predictions to a JSONL or CSV file. Interrupted runs continue from their last"
+            " checkpoint when started again with the same output file."
+        )
+    )
+
+    parser.add_argument(
+        "-d",
+        "--directory",
+        required=True,
+        dest="directory",
+        help="Directory tree of sketches",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        required=True,
+        dest="output",
+        help="Output file, CSV (one row per element) if it ends with .csv, else JSONL",
+    )
+    parser.add_argument(
+        "-p",
+        "--min-prob",
+        type=float,
+        default=0.8,
+        dest="min_prob",
+        help="Minimum detection probability (default: 0.8)",
+    )
+    parser.add_argument(
+        "-b",
+        "--batch-size",
+        type=int,
+        default=SETTINGS.max_batch_size,
+        dest="batch_size",
+        help=f"Sketches submitted to the detector at once (default: {SETTINGS.max_batch_size})",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        dest="workers",
+        help="Decoding processes (default: one per CPU)",
+    )
+    parser.add_argument(
+        "-r",
+        "--resolution",
+        type=int,
+        default=None,
+        dest="resolution",
+        help="Input size to detect at (default: picked from each sketch)",
+    )
+    parser.add_argument(
+        "-c",
+        "--checkpoint-every",
+        type=int,
+        default=1000,
+        dest="checkpoint_every",
+        help="Sketches between checkpoints (default: 1000)",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_false",
+        dest="resume",
+        help="Ignore the checkpoint and start over",
+    )
+
+    args = parser.parse_args()
+
+    # The decoding processes are forked before the model starts its threads
+    pool = DecodingPool(args.directory, args.workers)
+
+    from src.predictor import PATH_TO_LABELS, load_model  # pylint: disable=wrong-import-position
+
+    model = load_model(SETTINGS.model_path, PATH_TO_LABELS)
+    if args.resolution is not None and args.resolution not in model.input_sizes:
+        parser.error(f"--resolution must be one of {list(model.input_sizes)}")
+
+    writer = ResultWriter(args.output, resume=args.resume)
+    if writer.done:
+        print(f"Resuming after {writer.done} sketches, at {writer.last_path}")
+
+    try:
+        stats = predict_directory(
+            model,
+            pool,
+            writer,
+            args.min_prob,
+            args.batch_size,
+            input_size=args.resolution,
+            checkpoint_every=args.checkpoint_every,
+            progress_every=10,
+        )
+    except CheckpointMismatchError as error:
+        parser.exit(1, f"{error}\n")
+    finally:
+        writer.close()
+        pool.close()
+        model.close()
+
+    seconds = stats["seconds"]
+    print(
+        f"{stats['sketches']} sketches in {seconds:.1f} s"
+        f" ({stats['sketches'] / max(seconds, 1e-9):.1f} sketches/s),"
+        f" {stats['errors']} unreadable, {stats['detections']} elements detected"
+    )
+    print(
+        f"Waiting for decoding: {stats['decode_wait']:.1f} s, detecting: {stats['inference']:.1f} s"
+    )
+    print(f"Predictions written to {args.output}")
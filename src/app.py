@@ -1,15 +1,79 @@
+import asyncio
+import logging
 import os
+import time
 import warnings
-from typing import List
+from typing import List, Optional
+from uuid import uuid1
 
-import cv2
-from fastapi import FastAPI, File, HTTPException, Query, UploadFile, status
+from fastapi import (
+    BackgroundTasks,
+    FastAPI,
+    File,
+    HTTPException,
+    Path,
+    Query,
+    Request,
+    UploadFile,
+    WebSocket,
+    status,
+)
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse
+from fastapi.responses import (
+    JSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
+from starlette.requests import HTTPConnection
+
+from src.cache import PredictionCache, content_digest
+from src.concurrency import (
+    ClientDisconnectedError,
+    DeadlineExceededError,
+    InferenceExecutor,
+    ServerBusyError,
+)
+from src.metrics import (
+    DETECTIONS,
+    INPUT_SIZES,
+    SESSION_FRAMES,
+    SESSIONS,
+    CallbackGauge,
+    MetricsMiddleware,
+    StageTimer,
+    render_metrics,
+)
+from src.middleware import CompressionMiddleware, UploadSizeLimitMiddleware, etag_matches
+from src.models import BatchItemSchema, Prediction, ResponseSchema
+from src.predictor import MODELS, LoadedModel
+from src.registry import ModelNotReadyError
+from src.resolution import choose_input_size, measure_sketch
+from src.serialization import (
+    FastJSONResponse,
+    decode_prediction,
+    dumps,
+    encode_prediction,
+    prediction_content,
+)
+from src.sessions import SketchSession
+from src.settings import SETTINGS
+from src.shared_cache import open_shared_cache
+from src.tiling import merge_tiles, tile_sketch
+from src.tuning import apply_cpu_settings
+from src.utils import (
+    InvalidSketchError,
+    archive_sketch,
+    decode_bitmap,
+    decode_sketch,
+    is_bitmap,
+    letterbox_buffer,
+    postprocess,
+    preprocess,
+)
 
-from src.models import ObjectsSchema, ResponseSchema
-from src.predictor import detect_elements
-from src.utils import postprocess, preprocess, store_sketch
+logger = logging.getLogger(__name__)
 
 warnings.filterwarnings("ignore", message=r"Passing", category=FutureWarning)
 
@@ -23,7 +87,8 @@ app = FastAPI(
     version="1.0.0",
 )
 
-os.makedirs("./sketches", exist_ok=True)
+if SETTINGS.archive_sketches:
+    os.makedirs(SETTINGS.sketch_directory, exist_ok=True)
 
 origins = [
     "https://metamorph.designwitheve.com",
@@ -31,14 +96,478 @@ origins = [
     "http://localhost:3000",
 ]
 
+# Middleware added later wraps the middleware added before it, so CORS headers are also added
+# to the responses of rejected uploads
+app.add_middleware(
+    UploadSizeLimitMiddleware,
+    limits={
+        "/predict/": SETTINGS.max_upload_size,
+        "/predict/batch/": SETTINGS.max_batch_upload_size,
+    },
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Sketch-Digest"],
+)
+
+if SETTINGS.compress_responses:
+    app.add_middleware(CompressionMiddleware, minimum_size=SETTINGS.compression_min_size)
+
+# Requests are labelled by the path template of their route, the list also gets the routes
+# declared below. Paths without a route are counted together in the metrics.
+app.add_middleware(MetricsMiddleware, routes=app.routes)
+
+# Runs the blocking prediction pipeline away from the event loop
+EXECUTOR = InferenceExecutor(
+    max_workers=SETTINGS.inference_workers,
+    max_queue_size=SETTINGS.inference_queue_size,
+    shares=SETTINGS.priority_shares,
 )
 
+# Re-uploads of the same sketch are answered from here instead of running the detector again
+PREDICTION_CACHE = PredictionCache(max_size=SETTINGS.cache_size, ttl=SETTINGS.cache_ttl)
+
+# Predictions of the other worker processes, looked up when PREDICTION_CACHE misses
+SHARED_CACHE = (
+    open_shared_cache(SETTINGS.shared_cache_directory, SETTINGS.shared_cache_max_bytes)
+    if SETTINGS.shared_cache_directory
+    else None
+)
+
+CallbackGauge(
+    "metamorph_inference_jobs",
+    "Prediction jobs running on or queued for the inference threads",
+    lambda: {("running",): EXECUTOR.pending - EXECUTOR.queued, ("queued",): EXECUTOR.queued},
+    ["state"],
+)
+CallbackGauge(
+    "metamorph_batch_queue_depth",
+    "Images waiting for an inference batch",
+    lambda: {(): MODELS.active.queue_depth if MODELS.active else 0},
+)
+CallbackGauge(
+    "metamorph_queue_depth",
+    "Jobs waiting for an inference thread and images waiting for a batch, by priority class",
+    lambda: {
+        **{("inference", priority): depth for priority, depth in EXECUTOR.queue_depths().items()},
+        **{
+            ("batch", priority): depth
+            for priority, depth in (MODELS.active.queue_depths() if MODELS.active else {}).items()
+        },
+    },
+    ["queue", "priority"],
+)
+CallbackGauge(
+    "metamorph_cache_lookups_total",
+    "Prediction cache lookups by result",
+    lambda: {
+        ("hit",): PREDICTION_CACHE.hits,
+        ("miss",): PREDICTION_CACHE.misses,
+        ("coalesced",): PREDICTION_CACHE.coalesced,
+    },
+    ["result"],
+    kind="counter",
+)
+CallbackGauge("metamorph_cache_entries", "Cached predictions", lambda: {(): len(PREDICTION_CACHE)})
+
+SUPPORTED_MIME_TYPES = {"image/jpeg": "jpg", "image/png": "png", "image/x-portable-bitmap": "pbm"}
+
+
+def validate_mime_type(image: UploadFile):
+    mime_type = image.content_type
+
+    if mime_type not in SUPPORTED_MIME_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Image is not a JPG, PNG, or PBM. Uploaded file is {mime_type}",
+        )
+
+
+def archive_upload(background_tasks: BackgroundTasks, id_: str, image: UploadFile, data: bytes):
+    if SETTINGS.archive_sketches:
+        extension = SUPPORTED_MIME_TYPES[image.content_type]
+        background_tasks.add_task(archive_sketch, SETTINGS.sketch_directory, id_, data, extension)
+
+
+def request_priority(connection: HTTPConnection) -> str:
+    """Priority class of a request, from its priority header or else its endpoint"""
+    priority = connection.headers.get(SETTINGS.priority_header)
+    if priority not in SETTINGS.priority_shares:
+        priority = SETTINGS.endpoint_priorities.get(connection.url.path)
+
+    return (
+        priority if priority in SETTINGS.priority_shares else next(iter(SETTINGS.priority_shares))
+    )
+
+
+def prediction_key(
+    model_version: str,
+    digest: str,
+    minimum_probability: float,
+    include_masks: bool = False,
+    tiled: bool = False,
+    input_size: Optional[int] = None,
+) -> str:
+    """Cache key of the prediction of a sketch, by the hash of its content"""
+    options = f"{minimum_probability!r}:{include_masks:d}:{tiled:d}:{input_size or 'auto'}"
+    return f"{model_version}:{options}:{digest}"
+
+
+def prediction_etag(key: str, columnar: bool = False) -> str:
+    """Strong entity tag of the response of a prediction"""
+    return f'"{content_digest(f"{key}:{columnar:d}".encode())}"'
+
+
+async def lookup_prediction(key: str) -> Optional[Prediction]:
+    """Cached prediction of a key in this worker or the shared cache, without predicting it"""
+    prediction = PREDICTION_CACHE.get(key)
+
+    if prediction is None and SHARED_CACHE is not None:
+        loop = asyncio.get_event_loop()
+        stored = await loop.run_in_executor(None, SHARED_CACHE.get, key)
+        prediction = decode_prediction(stored) if stored is not None else None
+        if prediction is not None:
+            PREDICTION_CACHE.put(key, prediction)
+
+    return prediction
+
+
+def predict_sketch(
+    model: LoadedModel,
+    id_: str,
+    data: bytes,
+    minimum_probability: float,
+    include_masks: bool = False,
+    tiled: bool = False,
+    input_size: Optional[int] = None,
+    timer: Optional[StageTimer] = None,
+    priority: Optional[str] = None,
+) -> Prediction:
+    """Detect UI elements from an uploaded sketch
+
+    Unless an input size is given, the sketch runs at the smallest input size of the model that
+    its signals (ink density, blob count and size, and original size) allow. In tiled mode, the
+    sketch runs at the largest input size, and the overlapping tiles of a large sketch are run
+    through the detector in the same batch as the letterboxed sketch. The detections of all of
+    them are merged.
+
+    Arguments:
+        model {LoadedModel} -- Model version to detect the elements with
+        id_ {str} -- ID of the sketch
+        data {bytes} -- Uploaded image (jpg, png, or 1-bit pbm)
+        minimum_probability {float} -- Minimum probability of predictions
+        include_masks {bool} -- Include the mask of each element, if the model predicts masks
+        tiled {bool} -- Also detect on overlapping tiles of large sketches (default: False)
+        input_size {int} -- Input size of the model to run at (default: picked from the sketch)
+        timer {StageTimer} -- Timer of the pipeline stages (default: {None})
+        priority {str} -- Priority class of the inference (default: the highest)
+
+    Returns:
+        Prediction -- Predicted UI elements of the sketch
+    """
+    timer = timer or StageTimer()
+    input_sizes = model.input_sizes
+
+    with timer.stage("decode"):
+        # Pre-binarized bitmaps skip the image codec and the thresholding
+        binary = is_bitmap(data)
+        if binary:
+            img, height, width = decode_bitmap(data)
+        else:
+            img, height, width = decode_sketch(
+                data, SETTINGS.tile_max_size if tiled else input_sizes[-1]
+            )
+
+    with timer.stage("preprocess"):
+        if tiled:
+            # The sketch and its tiles run at the same size, the largest one
+            input_size = input_sizes[-1]
+        elif input_size is None:
+            input_size = choose_input_size(
+                measure_sketch(img, (height, width), binary),
+                input_sizes,
+                min_element_pixels=SETTINGS.resolution_min_element_pixels,
+                max_components=SETTINGS.resolution_max_components,
+                max_ink_density=SETTINGS.resolution_max_ink_density,
+            )
+        INPUT_SIZES.labels(str(input_size)).inc()
+
+        # The thread's buffer can be reused, as the thread waits until its batch has been run
+        preprocessed_image, top, left, ratio = preprocess(
+            image=img,
+            old_size=(height, width),
+            desired_size=input_size,
+            out=letterbox_buffer(input_size),
+            binary=binary,
+        )
+        images, tops, lefts, ratios = [preprocessed_image], [top], [left], [ratio]
+
+        if tiled:
+            tiles = tile_sketch(
+                img,
+                (height, width),
+                tile_size=input_size,
+                max_size=SETTINGS.tile_max_size,
+                overlap=SETTINGS.tile_overlap,
+                min_ink=SETTINGS.tile_min_ink,
+                binary=binary,
+            )
+            # Tiles are moved to their place in the scaled sketch, instead of out of a letterbox
+            images += list(tiles.images)
+            tops += (-tiles.origins[:, 0]).tolist()
+            lefts += (-tiles.origins[:, 1]).tolist()
+            ratios += [tiles.ratio] * len(tiles.origins)
+
+    # The caller holds the model open until this job is done, even if the request was dropped
+    with timer.stage("inference"):
+        output_dict = model.detect_elements(images, include_masks, priority)
+
+    with timer.stage("postprocess"):
+        detections = postprocess(
+            output_dict,
+            minimum_probability,
+            tops,
+            lefts,
+            ratios,
+            model.category_names,
+            input_shape=preprocessed_image.shape[:2],
+        )
+        if tiled:
+            detections = merge_tiles(detections, tiles, SETTINGS.tile_iou_threshold)
+        else:
+            (detections,) = detections
+
+    DETECTIONS.observe(len(detections.names))
+
+    # Kept as arrays, the response is built from them when it is serialized
+    return Prediction(id_, model.version, width, height, detections)
+
+
+async def predict_sketch_cached(
+    request: Request,
+    id_: str,
+    data: bytes,
+    minimum_probability: float,
+    include_masks: bool = False,
+    tiled: bool = False,
+    input_size: Optional[int] = None,
+    timer: Optional[StageTimer] = None,
+    digest: Optional[str] = None,
+) -> Prediction:
+    """Detect UI elements from an uploaded sketch, reusing earlier predictions of the same image
+
+    The sketch is predicted by the model version that is active when the request arrives, which
+    stays open until the prediction is done, even if a new version is swapped in meanwhile. It
+    is queued for the inference threads and the batcher in the priority class of the request.
+
+    Arguments:
+        request {Request} -- Request of the upload
+        id_ {str} -- ID of the sketch
+        data {bytes} -- Uploaded image (jpg, png, or 1-bit pbm)
+        minimum_probability {float} -- Minimum probability of predictions
+        include_masks {bool} -- Include the mask of each element, if the model predicts masks
+        tiled {bool} -- Also detect on overlapping tiles of large sketches (default: False)
+        input_size {int} -- Input size of the model to run at (default: picked from the sketch)
+        timer {StageTimer} -- Timer of the pipeline stages (default: {None})
+        digest {str} -- Content hash of the sketch, if it is already known (default: {None})
+
+    Returns:
+        Prediction -- Predicted UI elements of the sketch
+    """
+    if not MODELS.ready:
+        raise ModelNotReadyError()
+
+    loop = asyncio.get_event_loop()
+    priority = request_priority(request)
+
+    with MODELS.use() as model:
+        if input_size is not None and input_size not in model.input_sizes:
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                detail=f"Resolution must be one of {list(model.input_sizes)}",
+            )
+
+        # A model of the inference server only knows the version of its latest reply, so the
+        # key is a guess until the server reports the version that predicted the sketch
+        version = model.version
+        options = (digest or content_digest(data), minimum_probability, include_masks, tiled)
+        key = prediction_key(version, *options, input_size)
+
+        async def predict() -> Prediction:
+            if SHARED_CACHE is not None:
+                stored = await loop.run_in_executor(None, SHARED_CACHE.get, key)
+                # Entries stored in an older format are predicted again
+                prediction = decode_prediction(stored) if stored is not None else None
+                if prediction is not None:
+                    return prediction
+
+            # Held by the job, and released once it is done, even if the request is dropped first
+            model.acquire()
+            prediction = await EXECUTOR.run(
+                predict_sketch,
+                model,
+                id_,
+                data,
+                minimum_probability,
+                include_masks,
+                tiled,
+                input_size,
+                timer,
+                priority,
+                timeout=SETTINGS.request_timeout,
+                is_disconnected=request.is_disconnected,
+                priority=priority,
+                release=model.release,
+            )
+
+            if SHARED_CACHE is not None:
+                # Other workers can wait for the write, this request does not have to
+                value = encode_prediction(prediction)
+                stored_key = prediction_key(prediction.model_version, *options, input_size)
+                loop.run_in_executor(None, SHARED_CACHE.put, stored_key, value)
+
+            return prediction
+
+        prediction: Prediction = await PREDICTION_CACHE.get_or_compute(key, predict)
+
+    if prediction.model_version != version:
+        PREDICTION_CACHE.discard(key)
+        PREDICTION_CACHE.put(
+            prediction_key(prediction.model_version, *options, input_size), prediction
+        )
+
+    return prediction._replace(id=id_)
+
+
+def detect_frame(
+    model: LoadedModel,
+    session: SketchSession,
+    data: bytes,
+    minimum_probability: float,
+    input_size: int,
+    priority: Optional[str] = None,
+):
+    """Detect UI elements of a frame of a live session, unless its ink barely changed
+
+    Only reads the session, which is updated with the detections on the event loop, so that a
+    frame that missed its deadline cannot change the session later.
+
+    Arguments:
+        model {LoadedModel} -- Model version to detect the elements with
+        session {SketchSession} -- Session of the frame
+        data {bytes} -- Uploaded image (jpg, png, or 1-bit pbm)
+        minimum_probability {float} -- Minimum probability of predictions
+        input_size {int} -- Input size of the model to run at
+        priority {str} -- Priority class of the inference (default: the highest)
+
+    Returns:
+        tuple -- Model input of the frame, its ink change, its width and height, and its
+            detections, or None if the ink change is below the threshold of the session
+    """
+    binary = is_bitmap(data)
+    if binary:
+        img, height, width = decode_bitmap(data)
+    else:
+        img, height, width = decode_sketch(data, input_size)
+
+    # Not written into the thread's buffer, as the session keeps the frame
+    frame, top, left, ratio = preprocess(
+        image=img, old_size=(height, width), desired_size=input_size, binary=binary
+    )
+
+    change = session.ink_change(frame, model.version)
+    if change < session.min_ink_change:
+        return frame, change, width, height, None
+
+    # The caller holds the model open until this job is done
+    output_dict = model.detect_elements([frame], priority=priority)
+
+    (detections,) = postprocess(
+        output_dict,
+        minimum_probability,
+        [top],
+        [left],
+        [ratio],
+        model.category_names,
+        input_shape=frame.shape[:2],
+    )
+    DETECTIONS.observe(len(detections.names))
+
+    return frame, change, width, height, detections
+
+
+def service_unavailable(detail: str):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": detail},
+        headers={"Retry-After": str(SETTINGS.retry_after)},
+    )
+
+
+@app.exception_handler(InvalidSketchError)
+async def handle_invalid_sketch(_request: Request, error: InvalidSketchError):
+    return JSONResponse(
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, content={"detail": str(error)}
+    )
+
+
+@app.exception_handler(ServerBusyError)
+async def handle_server_busy(_request: Request, _error: ServerBusyError):
+    return service_unavailable("Server is busy. Retry later")
+
+
+@app.exception_handler(DeadlineExceededError)
+async def handle_deadline_exceeded(_request: Request, _error: DeadlineExceededError):
+    return service_unavailable("Prediction did not finish in time. Retry later")
+
+
+@app.exception_handler(ModelNotReadyError)
+async def handle_model_not_ready(_request: Request, _error: ModelNotReadyError):
+    return service_unavailable("Model is loading. Retry later")
+
+
+@app.exception_handler(ClientDisconnectedError)
+async def handle_client_disconnected(_request: Request, _error: ClientDisconnectedError):
+    # Nobody is listening anymore, nginx's "client closed request" status is used for the logs
+    return Response(status_code=499)
+
+
+def sketch_error(error: Exception) -> str:
+    """Message of the error of one sketch of a batch or one frame of a session, as its exception
+    handler words it"""
+    if isinstance(error, InvalidSketchError):
+        return str(error)
+    if isinstance(error, HTTPException):
+        return str(error.detail)
+    if isinstance(error, ServerBusyError):
+        return "Server is busy. Retry later"
+    if isinstance(error, DeadlineExceededError):
+        return "Prediction did not finish in time. Retry later"
+    if isinstance(error, ModelNotReadyError):
+        return "Model is loading. Retry later"
+
+    logger.error("Prediction of a sketch failed", exc_info=error)
+    return "Internal server error"
+
+
+@app.on_event("startup")
+def load_model_in_background():
+    apply_cpu_settings()
+
+    # The worker accepts connections right away, /readyz reports when the model is warmed up
+    MODELS.start()
+
+
+@app.on_event("shutdown")
+def stop_inference():
+    EXECUTOR.shutdown()
+    MODELS.stop()
+
 
 @app.get("/", include_in_schema=False)
 async def redirect_to_home():
@@ -54,17 +583,122 @@ async def redirect_to_home():
         " with their location, and their prediction certainty in JSON format. This JSON file"
         " contains a list of predicted UI element categories as JSON objects. Each JSON object"
         " contains predicted bounding box position (top left x,y coordinates) and its dimensions"
-        " (width, height)"
+        " (width, height). With `include_masks` enabled, objects of mask-capable models also"
+        " contain the run-length encoded mask of the element within its bounding box. With"
+        " `columnar` enabled, the elements are given as parallel arrays instead. The `ETag` of"
+        " the response identifies the sketch, model version, and options, and `X-Sketch-Digest`"
+        " the content hash of the sketch. Re-uploads of a sketch are answered from the cache of"
+        " earlier predictions, and `GET /predict/{digest}` looks them up without uploading"
     ),
     tags=["Predict UI Elements"],
     description="Detect UI elements from low fidelity sketch",
 )
 async def predict_user_interface_elements(
+    request: Request,
+    background_tasks: BackgroundTasks,
     image: UploadFile = File(
         ...,
         description=(
             "An image file (jpg or png) of low fidelity prototype sketch and a minimum detection"
-            " threshold value"
+            " threshold value. Already binarized sketches can be sent as a raw 1-bit PBM"
+            " (image/x-portable-bitmap, ink as set bits), which skips decoding and thresholding"
+        ),
+    ),
+    minimum_probability: float = Query(
+        0.8,
+        gt=0,
+        lt=1,
+        description="Minimum detection probability. Filters elements below this probability",
+    ),
+    include_masks: bool = Query(
+        False,
+        description=(
+            "Include a run-length encoded mask of each element, cropped to its bounding box."
+            " Only models that predict masks return them"
+        ),
+    ),
+    tiled: bool = Query(
+        False,
+        description=(
+            "Also detect on overlapping tiles of large sketches, which finds small elements such"
+            " as checkboxes more reliably at the cost of more inference. The sketch and its tiles"
+            " run at the largest input size of the model, whatever the `resolution`"
+        ),
+    ),
+    resolution: Optional[int] = Query(
+        None,
+        description=(
+            "Side length of the model input to detect at, one of the model's input sizes."
+            " Picked from the complexity of the sketch by default"
+        ),
+    ),
+    columnar: bool = Query(
+        False,
+        description=(
+            "Respond with parallel `names`, `boxes` ([x, y, width, height]), and `probabilities`"
+            " arrays, and `masks` if requested, instead of a list of `objects`"
+        ),
+    ),
+):
+
+    validate_mime_type(image)
+
+    timer = StageTimer()
+
+    id_ = str(uuid1())
+    data = await image.read()
+
+    # Receiving and parsing the upload happens before the handler is called
+    timer.record("upload", time.perf_counter() - request.scope["metamorph.start"])
+
+    digest = content_digest(data)
+    options = (minimum_probability, include_masks, tiled, resolution)
+
+    prediction = await predict_sketch_cached(request, id_, data, *options, timer, digest)
+
+    archive_upload(background_tasks, id_, image, data)
+
+    # The content is built from the detection arrays, bypassing the validation of ResponseSchema
+    with timer.stage("serialize"):
+        json_response = FastJSONResponse(
+            content=prediction_content(prediction, columnar),
+            headers={
+                "ETag": prediction_etag(
+                    prediction_key(prediction.model_version, digest, *options), columnar
+                ),
+                "X-Sketch-Digest": digest,
+            },
+        )
+
+    if SETTINGS.server_timing:
+        json_response.headers["Server-Timing"] = timer.server_timing()
+
+    return json_response
+
+
+@app.get(
+    "/predict/{digest}",
+    response_model=ResponseSchema,
+    status_code=status.HTTP_200_OK,
+    responses={
+        304: {"description": "The prediction matching `If-None-Match` is still current"},
+        404: {"description": "The sketch has no cached prediction, upload it to `/predict/`"},
+    },
+    response_description=(
+        "Responds with the cached prediction of an earlier upload, in the same format as the"
+        " `/predict/` response, or with 304 if it matches `If-None-Match`"
+    ),
+    tags=["Predict UI Elements"],
+    description="Look up the prediction of an already uploaded sketch by its content hash",
+)
+async def lookup_user_interface_elements(
+    request: Request,
+    digest: str = Path(
+        ...,
+        regex=r"^[0-9a-f]{32}$",
+        description=(
+            "Content hash of the sketch, as given by `X-Sketch-Digest` (the hex BLAKE2b digest"
+            " of its bytes, 16 bytes long)"
         ),
     ),
     minimum_probability: float = Query(
@@ -73,31 +707,336 @@ async def predict_user_interface_elements(
         lt=1,
         description="Minimum detection probability. Filters elements below this probability",
     ),
+    include_masks: bool = Query(
+        False,
+        description=(
+            "Include a run-length encoded mask of each element, cropped to its bounding box."
+            " Only models that predict masks return them"
+        ),
+    ),
+    tiled: bool = Query(
+        False,
+        description=(
+            "Also detect on overlapping tiles of large sketches, which finds small elements such"
+            " as checkboxes more reliably at the cost of more inference. The sketch and its tiles"
+            " run at the largest input size of the model, whatever the `resolution`"
+        ),
+    ),
+    resolution: Optional[int] = Query(
+        None,
+        description=(
+            "Side length of the model input to detect at, one of the model's input sizes."
+            " Picked from the complexity of the sketch by default"
+        ),
+    ),
+    columnar: bool = Query(
+        False,
+        description=(
+            "Respond with parallel `names`, `boxes` ([x, y, width, height]), and `probabilities`"
+            " arrays, and `masks` if requested, instead of a list of `objects`"
+        ),
+    ),
 ):
+    if not MODELS.ready:
+        raise ModelNotReadyError()
 
-    mime_type = image.content_type
+    # Nothing is uploaded or predicted, so no model needs to be held
+    key = prediction_key(
+        MODELS.active.version, digest, minimum_probability, include_masks, tiled, resolution
+    )
+    etag = prediction_etag(key, columnar)
+    headers = {"ETag": etag, "X-Sketch-Digest": digest}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
 
-    if mime_type not in ["image/jpeg", "image/png"]:
+    prediction = await lookup_prediction(key)
+    if prediction is None:
         raise HTTPException(
-            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-            detail=f"Image is not a JPG or PNG. Uploaded file is {mime_type}",
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="No cached prediction of this sketch, upload it to /predict/",
+        )
+
+    return FastJSONResponse(
+        content=prediction_content(prediction._replace(id=str(uuid1())), columnar),
+        headers=headers,
+    )
+
+
+@app.post(
+    "/predict/batch/",
+    response_model=List[BatchItemSchema],
+    response_model_exclude_none=True,
+    status_code=status.HTTP_200_OK,
+    response_description=(
+        "Responds with one prediction per uploaded sketch, in upload order. Each prediction has"
+        " the same format as the `/predict/` response, along with the index and filename of its"
+        " sketch. With `stream` enabled, each prediction is sent as a line of NDJSON as soon as"
+        " it is ready, in completion order. A sketch that fails is answered with its index,"
+        " filename, and `error` instead of a prediction, and does not fail the others"
+    ),
+    tags=["Predict UI Elements"],
+    description="Detect UI elements from multiple low fidelity sketches",
+)
+async def predict_user_interface_elements_batch(
+    request: Request,
+    background_tasks: BackgroundTasks,
+    images: List[UploadFile] = File(
+        ...,
+        description="Image files (jpg, png, or 1-bit pbm) of low fidelity prototype sketches",
+    ),
+    minimum_probability: float = Query(
+        0.8,
+        gt=0,
+        lt=1,
+        description="Minimum detection probability. Filters elements below this probability",
+    ),
+    include_masks: bool = Query(
+        False,
+        description=(
+            "Include a run-length encoded mask of each element, cropped to its bounding box."
+            " Only models that predict masks return them"
+        ),
+    ),
+    tiled: bool = Query(
+        False,
+        description=(
+            "Also detect on overlapping tiles of large sketches, which finds small elements such"
+            " as checkboxes more reliably at the cost of more inference. The sketch and its tiles"
+            " run at the largest input size of the model, whatever the `resolution`"
+        ),
+    ),
+    resolution: Optional[int] = Query(
+        None,
+        description=(
+            "Side length of the model input to detect at, one of the model's input sizes."
+            " Picked from the complexity of the sketch by default"
+        ),
+    ),
+    columnar: bool = Query(
+        False,
+        description=(
+            "Respond with parallel `names`, `boxes` ([x, y, width, height]), and `probabilities`"
+            " arrays, and `masks` if requested, instead of a list of `objects`"
+        ),
+    ),
+    stream: bool = Query(False, description="Stream each prediction as NDJSON when it is ready"),
+):
+
+    for image in images:
+        validate_mime_type(image)
+
+    if not EXECUTOR.has_capacity(min(len(images), EXECUTOR.max_workers), request_priority(request)):
+        raise ServerBusyError()
+
+    # A batch request keeps at most one job per inference thread in the executor at a time, so
+    # that it does not fill up the wait queue on its own
+    slots = asyncio.Semaphore(EXECUTOR.max_workers)
+
+    # Uploads are read before responding, as they are not readable once streaming starts
+    sketches = [(str(uuid1()), await image.read()) for image in images]
+
+    for image, (id_, data) in zip(images, sketches):
+        archive_upload(background_tasks, id_, image, data)
+
+    async def predict(index: int) -> dict:
+        id_, data = sketches[index]
+
+        # Sketches are preprocessed in parallel threads and the batcher groups their inferences
+        async with slots:
+            prediction = await predict_sketch_cached(
+                request, id_, data, minimum_probability, include_masks, tiled, resolution
+            )
+
+        return prediction_content(
+            prediction, columnar, index=index, filename=images[index].filename
         )
 
-    id_, image_path = store_sketch(image)
+    # A sketch that fails is answered with its error, the others are still predicted
+    async def predict_or_error(index: int) -> dict:
+        try:
+            return await predict(index)
+        except asyncio.CancelledError:
+            raise
+        except Exception as error:  # pylint: disable=broad-except
+            return {
+                "index": index,
+                "filename": images[index].filename,
+                "error": sketch_error(error),
+            }
+
+    tasks = [asyncio.ensure_future(predict_or_error(index)) for index in range(len(images))]
 
-    img = cv2.imread(image_path)
+    if not stream:
+        try:
+            return FastJSONResponse(content=await asyncio.gather(*tasks))
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
 
-    height, width, _ = img.shape
+    async def stream_predictions():
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield dumps(await task) + b"\n"
+        finally:
+            # Nothing is left to wait for if the client went away or the stream broke off
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(
+        stream_predictions(), media_type="application/x-ndjson", background=background_tasks
+    )
+
+
+@app.websocket("/sessions/")
+async def live_sketching_session(
+    websocket: WebSocket,
+    minimum_probability: float = Query(0.8, gt=0, lt=1),
+    resolution: Optional[int] = Query(None),
+):
+    """Detect UI elements of a sketch while it is drawn
 
-    preprocessed_image, top, left, ratio = preprocess(image=img)
+    Every binary message is a frame of the whole sketch (jpg, png, or 1-bit pbm). Each frame is
+    answered with a JSON message. Frames whose ink changed by less than
+    METAMORPH_SESSION_MIN_INK_CHANGE since the last detected frame are not run through the
+    detector. Otherwise the answer holds the elements that were added, moved, or removed since
+    then, identified by IDs that stay the same for the whole session.
+    """
+    await websocket.accept()
+    SESSIONS.inc()
 
-    result: List[ObjectsSchema] = detect_elements(
-        image=preprocessed_image, min_prob=minimum_probability
+    session = SketchSession(
+        SETTINGS.session_min_ink_change,
+        SETTINGS.session_iou_threshold,
+        SETTINGS.session_max_distance,
     )
+    priority = request_priority(websocket)
+    frame_number = 0
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+
+            data = message.get("bytes")
+            frame_number += 1
+            answer = {"frame": frame_number}
+
+            if data is None:
+                answer["error"] = "Frames are sent as binary messages of jpg, png, or pbm images"
+            elif len(data) > SETTINGS.max_upload_size:
+                answer["error"] = f"Frame is larger than {SETTINGS.max_upload_size} bytes"
+            else:
+                try:
+                    if not MODELS.ready:
+                        raise ModelNotReadyError()
+
+                    with MODELS.use() as model:
+                        input_size = resolution or model.input_sizes[-1]
+                        if input_size not in model.input_sizes:
+                            raise InvalidSketchError(
+                                f"Resolution must be one of {list(model.input_sizes)}"
+                            )
+
+                        # Held by the job, even if the frame misses its deadline
+                        model.acquire()
+                        frame, change, width, height, detections = await EXECUTOR.run(
+                            detect_frame,
+                            model,
+                            session,
+                            data,
+                            minimum_probability,
+                            input_size,
+                            priority,
+                            timeout=SETTINGS.request_timeout,
+                            priority=priority,
+                            release=model.release,
+                        )
+                except asyncio.CancelledError:
+                    raise
+                except Exception as error:  # pylint: disable=broad-except
+                    # A failed frame is answered with its error, the session goes on
+                    answer["error"] = sketch_error(error)
+                else:
+                    answer["ink_change"] = change
+                    answer["detected"] = detections is not None
+                    SESSION_FRAMES.labels("detected" if detections is not None else "skipped").inc()
+
+                    if detections is not None:
+                        answer.update(
+                            model_version=model.version,
+                            width=width,
+                            height=height,
+                            **session.update(frame, model.version, detections),
+                        )
+
+            await websocket.send_text(dumps(answer).decode())
+    finally:
+        SESSIONS.dec()
+
+
+@app.get(
+    "/stats/cache",
+    status_code=status.HTTP_200_OK,
+    response_description=(
+        "Size, hit, miss, coalesced, and eviction counts of the in-memory prediction cache, and"
+        " the size of the shared on-disk cache when it is enabled"
+    ),
+    tags=["Monitoring"],
+    description="Prediction cache statistics",
+)
+async def prediction_cache_stats():
+    stats = PREDICTION_CACHE.stats()
+
+    if SHARED_CACHE is not None:
+        loop = asyncio.get_event_loop()
+        stats["shared"] = await loop.run_in_executor(None, SHARED_CACHE.stats)
+
+    return stats
+
+
+@app.get(
+    "/healthz",
+    status_code=status.HTTP_200_OK,
+    response_description=(
+        "Responds with 200 while the worker is alive, and with 503 if its model failed to load"
+    ),
+    tags=["Monitoring"],
+    description="Liveness probe",
+)
+async def liveness():
+    if not MODELS.ready and MODELS.load_error is not None:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "failed", "detail": f"Model failed to load: {MODELS.load_error}"},
+        )
+
+    return {"status": "alive"}
+
+
+@app.get(
+    "/readyz",
+    status_code=status.HTTP_200_OK,
+    response_description=(
+        "Responds with 200 and the served model version once the model is loaded and warmed up,"
+        " and with 503 before"
+    ),
+    tags=["Monitoring"],
+    description="Readiness probe",
+)
+async def readiness():
+    model = MODELS.active
+    if model is None:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"status": "loading"}
+        )
 
-    objects: List[ObjectsSchema] = postprocess(result, top, left, ratio)
+    return {"status": "ready", "model_version": model.version}
 
-    response: ResponseSchema = ResponseSchema(id=id_, width=width, height=height, objects=objects)
 
-    
-    return response
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,55 @@
+import importlib
+from typing import Optional, Sequence
+
+from src.engine import InferenceEngine
+
+# Inference backends by name, as module and class. Modules are only imported when their backend
+# is chosen, so that e.g. OpenCV workers never load Tensorflow.
+BACKENDS = {
+    "tensorflow": ("src.backends.tf_session", "TensorflowEngine"),
+    "opencv": ("src.backends.opencv_dnn", "OpenCVEngine"),
+    "onnxruntime": ("src.backends.onnx_runtime", "OnnxRuntimeEngine"),
+}
+
+
+def create_engine(
+    backend: str,
+    model_path: str,
+    input_size: int = 640,
+    input_sizes: Optional[Sequence[int]] = None,
+    intra_op_threads: int = 0,
+    inter_op_threads: int = 0,
+) -> InferenceEngine:
+    """Loads a model with an inference backend
+
+    Arguments:
+        backend {str} -- Name of the backend, one of ``BACKENDS``
+        model_path {str} -- Path to the model file of the backend
+        input_size {int} -- Side length of the square images fed to the model (default: 640)
+        input_sizes {Sequence[int]} -- Side lengths the model can run at (default: input_size)
+        intra_op_threads {int} -- Threads running a single operation (default: 0, the backend's
+            default)
+        inter_op_threads {int} -- Threads running independent operations (default: 0, the
+            backend's default)
+
+    Returns:
+        InferenceEngine -- Engine serving the model
+    """
+    if backend not in BACKENDS:
+        raise ValueError(
+            f"Unknown inference backend {backend!r}, expected one of {', '.join(BACKENDS)}"
+        )
+
+    module_name, class_name = BACKENDS[backend]
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as error:
+        raise ImportError(f"The {backend} inference backend is not installed ({error})") from error
+
+    return getattr(module, class_name)(
+        model_path,
+        input_size=input_size,
+        input_sizes=input_sizes,
+        intra_op_threads=intra_op_threads,
+        inter_op_threads=inter_op_threads,
+    )
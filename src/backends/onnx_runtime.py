@@ -0,0 +1,56 @@
+from typing import Optional, Sequence
+
+import numpy as np
+import onnxruntime
+
+from src.engine import OUTPUT_TENSOR_KEYS, InferenceEngine
+
+
+class OnnxRuntimeEngine(InferenceEngine):
+    """Serves detections of the detection graph converted to ONNX, with ONNX Runtime
+
+    The model is expected to keep the inputs and outputs of the frozen Tensorflow graph, as
+    converted by ``tf2onnx`` (``--inputs image_tensor:0 --outputs num_detections:0,...``).
+    Inference sessions of ONNX Runtime are thread-safe.
+
+    Arguments:
+        model_path {str} -- Path to the ONNX model (.onnx)
+        input_size {int} -- Side length of the square images fed to the model (default: 640)
+        input_sizes {Sequence[int]} -- Side lengths of the images fed to the model, which
+            needs dynamic spatial input dimensions for more than one (default: input_size)
+        intra_op_threads {int} -- Threads running a single operator (default: 0, one per core)
+        inter_op_threads {int} -- Threads running independent operators (default: 0)
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        input_size: int = 640,
+        input_sizes: Optional[Sequence[int]] = None,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 0,
+    ):
+        super().__init__(input_size, input_sizes)
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+
+        self.session = onnxruntime.InferenceSession(model_path, options)
+        self.input_name = self.session.get_inputs()[0].name
+
+        output_names = {
+            output.name.split(":")[0]: output.name for output in self.session.get_outputs()
+        }
+        self.output_names = {
+            key: output_names[key] for key in OUTPUT_TENSOR_KEYS if key in output_names
+        }
+
+    def run(self, images: np.ndarray):
+        outputs = self.session.run(list(self.output_names.values()), {self.input_name: images})
+        output_dict = dict(zip(self.output_names, outputs))
+
+        output_dict["num_detections"] = output_dict["num_detections"].astype(np.int32)
+        output_dict["detection_classes"] = output_dict["detection_classes"].astype(np.uint8)
+
+        return output_dict
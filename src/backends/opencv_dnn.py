@@ -0,0 +1,97 @@
+import os
+import threading
+from typing import Optional, Sequence
+
+import cv2
+import numpy as np
+
+from src.engine import InferenceEngine
+
+
+class OpenCVEngine(InferenceEngine):
+    """Serves detections of a frozen Tensorflow SSD graph with the OpenCV DNN module
+
+    OpenCV needs a text graph description of the SSD model next to the frozen graph, as
+    generated by ``tf_text_graph_ssd.py`` of the OpenCV samples from the model's pipeline config.
+    The description leaves out the preprocessing of the Tensorflow graph, so images are resized,
+    scaled, and mean subtracted here. The defaults match the ResNet feature extractor of
+    ``configs/metamorph_ssd_resnet.config``.
+
+    Arguments:
+        model_path {str} -- Path to the frozen inference graph (.pb)
+        input_size {int} -- Side length of the square images fed to the network (default: 640)
+        input_sizes {Sequence[int]} -- Side lengths of the images fed to the network, which is
+            reshaped to the size of each batch (default: input_size)
+        config_path {str} -- Path to the text graph description (default: model path with .pbtxt)
+        mean {Sequence[float]} -- Channel means subtracted from the RGB images
+        scale {float} -- Factor the mean subtracted images are multiplied with (default: 1.0)
+        max_detections {int} -- Detections per image in the output arrays (default: 100)
+        intra_op_threads {int} -- Unused, the network runs on the threads of OpenCV, which are
+            set once for the process by the ``opencv_threads`` setting
+        inter_op_threads {int} -- Unused, the layers of a network run one after another
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        input_size: int = 640,
+        input_sizes: Optional[Sequence[int]] = None,
+        config_path: Optional[str] = None,
+        mean: Sequence[float] = (123.68, 116.779, 103.939),
+        scale: float = 1.0,
+        max_detections: int = 100,
+        intra_op_threads: int = 0,  # pylint: disable=unused-argument
+        inter_op_threads: int = 0,  # pylint: disable=unused-argument
+    ):
+        super().__init__(input_size, input_sizes)
+
+        if config_path is None:
+            config_path = os.path.splitext(model_path)[0] + ".pbtxt"
+
+        self.net = cv2.dnn.readNetFromTensorflow(model_path, config_path)
+        self.mean = tuple(mean)
+        self.scale = scale
+        self.max_detections = max_detections
+
+        # A network keeps the state of its last forward pass, so it runs one batch at a time
+        self._run_lock = threading.Lock()
+
+    def run(self, images: np.ndarray):
+        # The network runs at the size of the batch, one of the input sizes
+        size = images.shape[1]
+        blob = cv2.dnn.blobFromImages(
+            list(images), self.scale, (size, size), self.mean, swapRB=True
+        )
+
+        with self._run_lock:
+            self.net.setInput(blob)
+            # Rows of (image index, class, score, xmin, ymin, xmax, ymax), boxes normalized
+            detections = self.net.forward().reshape(-1, 7)
+
+        batch_size = len(images)
+        detections = detections[(detections[:, 0] >= 0) & (detections[:, 2] > 0)]
+
+        # Order the detections by image, then by descending score like the Tensorflow graph
+        detections = detections[np.lexsort((-detections[:, 2], detections[:, 0]))]
+        image_index = detections[:, 0].astype(np.int64)
+
+        counts = np.bincount(image_index, minlength=batch_size)
+        rank = np.arange(len(detections)) - np.repeat(np.cumsum(counts) - counts, counts)
+        kept = rank < self.max_detections
+        image_index, rank, detections = image_index[kept], rank[kept], detections[kept]
+
+        shape = (batch_size, self.max_detections)
+        boxes = np.zeros(shape + (4,), dtype=np.float32)
+        scores = np.zeros(shape, dtype=np.float32)
+        classes = np.zeros(shape, dtype=np.uint8)
+
+        boxes[image_index, rank] = np.clip(detections[:, [4, 3, 6, 5]], 0, 1)
+        scores[image_index, rank] = detections[:, 2]
+        classes[image_index, rank] = detections[:, 1]
+
+        return {
+            "num_detections": np.minimum(counts, self.max_detections).astype(np.int32),
+            "detection_boxes": boxes,
+            "detection_scores": scores,
+            "detection_classes": classes,
+        }
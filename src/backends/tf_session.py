@@ -0,0 +1,94 @@
+from typing import Optional, Sequence
+
+import numpy as np
+import tensorflow as tf
+
+from src.engine import OUTPUT_TENSOR_KEYS, InferenceEngine
+
+
+class TensorflowEngine(InferenceEngine):
+    """Serves detections of a frozen Tensorflow graph from a single, long-lived session
+
+    The session and the handles to the input and output tensors are created once, when the
+    engine is built. ``tf.Session.run`` is thread-safe, so the session needs no locking.
+
+    Arguments:
+        model_path {str} -- Path to the frozen inference graph (.pb)
+        input_size {int} -- Side length of the square images fed to the graph (default: 640)
+        input_sizes {Sequence[int]} -- Side lengths of the images fed to the graph. A graph
+            exported with a fixed_shape_resizer scales every image to that shape, so only graphs
+            exported with a shape-preserving resizer run faster on smaller images
+            (default: input_size)
+        intra_op_threads {int} -- Threads running a single op (default: 0, one per core)
+        inter_op_threads {int} -- Threads running independent ops (default: 0, one per core)
+    """
+
+    def __init__(
+        self,
+        model_path: str,
+        input_size: int = 640,
+        input_sizes: Optional[Sequence[int]] = None,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 0,
+    ):
+        super().__init__(input_size, input_sizes)
+
+        # Load a (frozen) Tensorflow model into memory until server dies.
+        graph = tf.Graph()
+        with graph.as_default():
+            od_graph_def = tf.GraphDef()
+            with tf.gfile.GFile(model_path, "rb") as fid:
+                od_graph_def.ParseFromString(fid.read())
+                tf.import_graph_def(od_graph_def, name="")
+
+            self.image_tensor = graph.get_tensor_by_name("image_tensor:0")
+            self.tensor_dict = self._build_output_tensors(graph)
+
+        # Every op the engine needs exists now, so freeze the graph to make sure that
+        # nothing grows it while requests are served from the session.
+        graph.finalize()
+
+        self.graph = graph
+        # By default a session assumes that it owns every core, which oversubscribes the CPU
+        # when several workers or sessions run on one host
+        config = tf.ConfigProto(
+            intra_op_parallelism_threads=intra_op_threads,
+            inter_op_parallelism_threads=inter_op_threads,
+        )
+        self.session = tf.Session(graph=graph, config=config)
+
+    @staticmethod
+    def _build_output_tensors(graph: tf.Graph):
+        """Resolves the output tensor handles of the graph
+
+        Arguments:
+            graph {Graph} -- Tensorflow inference graph object
+
+        Returns:
+            dict -- Output tensor handles by output name
+        """
+        all_tensor_names = {output.name for op in graph.get_operations() for output in op.outputs}
+
+        tensor_dict = {}
+        for key in OUTPUT_TENSOR_KEYS:
+            tensor_name = key + ":0"
+            if tensor_name in all_tensor_names:
+                tensor_dict[key] = graph.get_tensor_by_name(tensor_name)
+
+        # Masks are left in box coordinates ([batch, detections, mask_height, mask_width]). They
+        # are only fit to their boxes on request, for the detections that are kept, instead of
+        # reframing every detection to a full image mask.
+        return tensor_dict
+
+    def run(self, images: np.ndarray):
+        output_dict = self.session.run(self.tensor_dict, feed_dict={self.image_tensor: images})
+
+        # all outputs are float32 numpy arrays, so convert types as appropriate
+        output_dict["num_detections"] = output_dict["num_detections"].astype(np.int32)
+        output_dict["detection_classes"] = output_dict["detection_classes"].astype(np.uint8)
+
+        return output_dict
+
+    def close(self):
+        with self._lock:
+            self.session.close()
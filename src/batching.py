@@ -0,0 +1,166 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Optional
+
+import numpy as np
+
+from src.metrics import BATCH_DURATION, BATCH_SIZE
+from src.scheduling import WeightedFairQueue
+
+
+class _BatchItem:
+    __slots__ = ("image", "future")
+
+    def __init__(self, image: np.ndarray):
+        self.image = image
+        self.future = Future()
+
+
+class MicroBatcher:
+    """Collects concurrent inference requests into batches for the inference engine
+
+    A batch is run as soon as it holds ``max_batch_size`` images or when its first image has
+    waited ``max_batch_delay_ms`` milliseconds, whichever comes first. Each caller receives a
+    future that resolves to the output dictionary of its own image. Images of several priority
+    classes share the batches by the share of their class.
+
+    Arguments:
+        engine {InferenceEngine} -- Engine that runs the batches
+        max_batch_size {int} -- Maximum number of images per batch
+        max_batch_delay_ms {float} -- Maximum time to wait for a batch to fill up
+        workers {int} -- Number of threads that run batches (default: 1)
+        shares {Dict[str, float]} -- Share of the batches of each priority class, highest
+            priority first (default: one class)
+    """
+
+    def __init__(
+        self,
+        engine,
+        max_batch_size: int,
+        max_batch_delay_ms: float,
+        workers: int = 1,
+        shares: Optional[Dict[str, float]] = None,
+    ):
+        self.engine = engine
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_delay = max(0.0, max_batch_delay_ms) / 1000
+        self.workers = max(1, workers)
+
+        self._queue = WeightedFairQueue("batch", shares or {"default": 1.0})
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts the batching threads if they are not running yet"""
+        with self._lock:
+            if self._threads:
+                return
+
+            for index in range(self.workers):
+                thread = threading.Thread(
+                    target=self._serve, name=f"micro-batcher-{index}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self):
+        """Stops the batching threads once the queued requests are served"""
+        with self._lock:
+            for _ in self._threads:
+                self._queue.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+
+    def submit(self, image: np.ndarray, priority: Optional[str] = None) -> Future:
+        """Queues an image for inference
+
+        Arguments:
+            image {np.ndarray} -- Preprocessed image of shape [height, width, 3]
+            priority {str} -- Priority class of the image (default: the highest)
+
+        Returns:
+            Future -- Future resolving to the output dictionary of the image
+        """
+        self.start()
+
+        item = _BatchItem(image)
+        self._queue.put(item, priority)
+
+        return item.future
+
+    @property
+    def queue_depth(self):
+        """Number of images waiting for a batch"""
+        return self._queue.qsize()
+
+    def queue_depths(self) -> Dict[str, int]:
+        """Number of images of each priority class waiting for a batch"""
+        return self._queue.depths()
+
+    def _collect(self):
+        """Blocks until a batch is ready and returns its items, or None when stopping"""
+        first = self._queue.get()
+        if first is None:
+            return None
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_batch_delay
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if item is None:
+                # Hand the stop signal back so that this thread exits after the batch
+                self._queue.put(None)
+                break
+
+            batch.append(item)
+
+        return batch
+
+    def _serve(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            # Images of different sizes cannot be stacked into one tensor
+            groups = OrderedDict()
+            for item in batch:
+                groups.setdefault(item.image.shape, []).append(item)
+
+            for items in groups.values():
+                self._run(items)
+
+    def _run(self, items):
+        # Skip requests that were cancelled while they were waiting in the queue
+        items = [item for item in items if item.future.set_running_or_notify_cancel()]
+        if not items:
+            return
+
+        BATCH_SIZE.observe(len(items))
+        start = time.perf_counter()
+
+        try:
+            images = np.stack([item.image for item in items])
+            outputs = self.engine.split_batch(self.engine.run(images))
+        except Exception as error:  # pylint: disable=broad-except
+            for item in items:
+                item.future.set_exception(error)
+            return
+        finally:
+            BATCH_DURATION.observe(time.perf_counter() - start)
+
+        for item, output_dict in zip(items, outputs):
+            item.future.set_result(output_dict)
@@ -0,0 +1,360 @@
+import csv
+import io
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from typing import Iterator, List, Optional, Sequence
+
+import cv2
+
+from src.resolution import choose_input_size, measure_sketch
+from src.settings import SETTINGS
+from src.utils import decode_bitmap, decode_sketch, is_bitmap, postprocess, preprocess
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".pbm")
+
+# Columns of the CSV output, one row per detected element, like the labels CSV of the dataset
+CSV_COLUMNS = [
+    "filename",
+    "width",
+    "height",
+    "class",
+    "xmin",
+    "ymin",
+    "xmax",
+    "ymax",
+    "probability",
+]
+
+
+class CheckpointMismatchError(RuntimeError):
+    """Raised when the sketches of a directory changed since its checkpoint was written"""
+
+
+def walk_sketches(directory: str) -> Iterator[str]:
+    """Yields the paths of the sketches in a directory tree, relative to it, in a stable order
+
+    Arguments:
+        directory {str} -- Root directory of the sketches
+
+    Yields:
+        str -- Path of a sketch
+    """
+    for root, directories, files in os.walk(directory):
+        directories.sort()
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.relpath(os.path.join(root, name), directory)
+
+
+def load_sketch(directory: str, path: str, input_sizes: Sequence[int], input_size: Optional[int]):
+    """Reads, decodes, and preprocesses a sketch, in a worker process of the decoding pool
+
+    Returns:
+        tuple -- Path, and either the model input, its letterbox and size, or the error message
+    """
+    try:
+        with open(os.path.join(directory, path), "rb") as image_file:
+            data = image_file.read()
+
+        binary = is_bitmap(data)
+        if binary:
+            image, height, width = decode_bitmap(data)
+        else:
+            image, height, width = decode_sketch(data, max(input_sizes))
+
+        if input_size is None:
+            input_size = choose_input_size(
+                measure_sketch(image, (height, width), binary),
+                input_sizes,
+                min_element_pixels=SETTINGS.resolution_min_element_pixels,
+                max_components=SETTINGS.resolution_max_components,
+                max_ink_density=SETTINGS.resolution_max_ink_density,
+            )
+
+        preprocessed_image, top, left, ratio = preprocess(
+            image, old_size=(height, width), desired_size=input_size, binary=binary
+        )
+    except Exception as error:  # pylint: disable=broad-except
+        return path, None, f"{type(error).__name__}: {error}"
+
+    return path, (preprocessed_image, top, left, ratio, width, height), None
+
+
+def _initialize_worker():
+    # Decoding runs in one process per core already
+    cv2.setNumThreads(1)
+
+
+class DecodingPool:
+    """Process pool that decodes and preprocesses sketches ahead of the detector
+
+    At most ``window`` sketches are decoded ahead, so that a slow detector does not pile up
+    decoded images in memory. Results are returned in the order of the paths.
+
+    Arguments:
+        directory {str} -- Root directory of the sketches
+        processes {int} -- Number of decoding processes (default: one per CPU)
+        window {int} -- Maximum number of sketches decoded ahead (default: 4 per process)
+    """
+
+    def __init__(self, directory: str, processes: Optional[int] = None, window: int = 0):
+        self.directory = directory
+        self.processes = processes or os.cpu_count() or 1
+        self.window = window or 4 * self.processes
+
+        # Created before the model is loaded, as forking a process with running inference
+        # threads is unsafe
+        self._pool = multiprocessing.Pool(self.processes, initializer=_initialize_worker)
+
+    def imap(self, paths: Iterator[str], input_sizes: Sequence[int], input_size: Optional[int]):
+        pending = deque()
+        for path in paths:
+            pending.append(
+                self._pool.apply_async(load_sketch, (self.directory, path, input_sizes, input_size))
+            )
+            if len(pending) >= self.window:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
+    def close(self):
+        self._pool.terminate()
+        self._pool.join()
+
+
+class ResultWriter:
+    """Appends predictions to a JSONL or CSV file, and checkpoints how far it got
+
+    The checkpoint holds the number of sketches written, the last of them, and the size of the
+    output file at that point. Resuming truncates the output to that size, which drops the
+    predictions written after the checkpoint, and skips the sketches it covers.
+
+    Arguments:
+        path {str} -- Output file, CSV if it ends with .csv, else JSONL
+        checkpoint_path {str} -- Checkpoint file (default: output file with .checkpoint)
+        resume {bool} -- Continue from the checkpoint if there is one (default: True)
+    """
+
+    def __init__(self, path: str, checkpoint_path: Optional[str] = None, resume: bool = True):
+        self.path = path
+        self.checkpoint_path = checkpoint_path or path + ".checkpoint"
+        self.format = "csv" if path.lower().endswith(".csv") else "jsonl"
+
+        self.done = 0
+        self.last_path = None
+
+        offset = 0
+        if resume and os.path.exists(self.checkpoint_path) and os.path.exists(path):
+            with open(self.checkpoint_path) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+            self.done, self.last_path, offset = (
+                checkpoint["done"],
+                checkpoint["last_path"],
+                checkpoint["output_bytes"],
+            )
+
+        self._file = open(path, "r+b" if offset else "wb")
+        self._file.truncate(offset)
+        self._file.seek(offset)
+
+        if self.format == "csv" and offset == 0:
+            self._write_csv([CSV_COLUMNS])
+
+    def skip(self, paths: Iterator[str]) -> Iterator[str]:
+        """Skips the sketches covered by the checkpoint
+
+        Raises:
+            CheckpointMismatchError: If the sketches before the checkpoint changed
+        """
+        # Taken before writing moves them on
+        done, checkpoint_path = self.done, self.last_path
+
+        skipped, last_path = 0, None
+        for path in paths:
+            if skipped < done:
+                skipped, last_path = skipped + 1, path
+                continue
+
+            if last_path != checkpoint_path:
+                break
+            yield path
+
+        if skipped < done or last_path != checkpoint_path:
+            raise CheckpointMismatchError(
+                f"The sketches of the directory no longer match the checkpoint at"
+                f" {checkpoint_path}. Start over with a new output file."
+            )
+
+    def _write_csv(self, rows: List[list]):
+        text = io.StringIO()
+        csv.writer(text, lineterminator="\n").writerows(rows)
+        self._file.write(text.getvalue().encode())
+
+    def write(self, path: str, width: int, height: int, objects: List[dict], version: str):
+        if self.format == "csv":
+            self._write_csv(
+                [
+                    [
+                        path,
+                        width,
+                        height,
+                        element["name"],
+                        element["position"]["x"],
+                        element["position"]["y"],
+                        element["position"]["x"] + element["dimension"]["width"],
+                        element["position"]["y"] + element["dimension"]["height"],
+                        element["probability"],
+                    ]
+                    for element in objects
+                ]
+            )
+        else:
+            record = {
+                "filename": path,
+                "model_version": version,
+                "width": width,
+                "height": height,
+                "objects": objects,
+            }
+            self._file.write((json.dumps(record) + "\n").encode())
+
+        self.done += 1
+        self.last_path = path
+
+    def write_error(self, path: str, error: str):
+        # The CSV has no place for errors, they are only counted
+        if self.format == "jsonl":
+            self._file.write((json.dumps({"filename": path, "error": error}) + "\n").encode())
+
+        self.done += 1
+        self.last_path = path
+
+    def checkpoint(self):
+        """Makes the written predictions durable and records them in the checkpoint"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        checkpoint = {
+            "done": self.done,
+            "last_path": self.last_path,
+            "output_bytes": self._file.tell(),
+        }
+        temporary_path = self.checkpoint_path + ".tmp"
+        with open(temporary_path, "w") as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.replace(temporary_path, self.checkpoint_path)
+
+    def close(self):
+        self.checkpoint()
+        self._file.close()
+
+
+def predict_directory(
+    model,
+    pool: DecodingPool,
+    writer: ResultWriter,
+    minimum_probability: float,
+    batch_size: int,
+    input_size: Optional[int] = None,
+    checkpoint_every: int = 1000,
+    progress_every: float = 0,
+) -> dict:
+    """Detects UI elements in every sketch of a directory tree and writes them out
+
+    Sketches are decoded in the process pool while the model detects the elements of earlier
+    ones. Each chunk of ``batch_size`` sketches is submitted to the model at once, so that its
+    batcher can fill whole batches, and written out in order.
+
+    Arguments:
+        model {LoadedModel} -- Model to detect the elements with
+        pool {DecodingPool} -- Decoding pool of the directory of sketches
+        writer {ResultWriter} -- Writer of the predictions
+        minimum_probability {float} -- Minimum probability of predictions
+        batch_size {int} -- Number of sketches submitted to the model at once
+        input_size {int} -- Input size to run at (default: picked from each sketch)
+        checkpoint_every {int} -- Sketches between checkpoints (default: 1000)
+        progress_every {float} -- Seconds between progress reports, 0 for none (default: 0)
+
+    Returns:
+        dict -- Counts of sketches, errors, and detections, and the seconds spent in total,
+            waiting for decoded sketches, and detecting
+    """
+    stats = {"sketches": 0, "errors": 0, "detections": 0, "decode_wait": 0.0, "inference": 0.0}
+    start = last_progress = time.perf_counter()
+    last_checkpoint = writer.done
+
+    def write_chunk(chunk):
+        # Sketches of the same input size are run together, as they stack into one batch
+        outputs = {}
+        sizes = {loaded[0].shape[0] for _, loaded, _ in chunk if loaded is not None}
+        for size in sizes:
+            indices = [
+                index
+                for index, (_, loaded, _) in enumerate(chunk)
+                if loaded is not None and loaded[0].shape[0] == size
+            ]
+            inference_start = time.perf_counter()
+            output_dict = model.detect_elements([chunk[index][1][0] for index in indices])
+            stats["inference"] += time.perf_counter() - inference_start
+
+            detections = postprocess(
+                output_dict,
+                minimum_probability,
+                [chunk[index][1][1] for index in indices],
+                [chunk[index][1][2] for index in indices],
+                [chunk[index][1][3] for index in indices],
+                model.category_names,
+                input_shape=(size, size),
+            )
+            outputs.update(zip(indices, detections))
+
+        for index, (path, loaded, error) in enumerate(chunk):
+            if loaded is None:
+                stats["errors"] += 1
+                writer.write_error(path, error)
+                continue
+
+            objects = outputs[index].to_objects()
+            stats["detections"] += len(objects)
+            writer.write(path, loaded[4], loaded[5], objects, model.version)
+
+        stats["sketches"] += len(chunk)
+
+    paths = writer.skip(walk_sketches(pool.directory))
+    results = pool.imap(paths, model.input_sizes, input_size)
+
+    chunk = []
+    while True:
+        wait_start = time.perf_counter()
+        result = next(results, None)
+        stats["decode_wait"] += time.perf_counter() - wait_start
+
+        if result is not None:
+            chunk.append(result)
+        if chunk and (result is None or len(chunk) >= batch_size):
+            write_chunk(chunk)
+            chunk = []
+
+            if writer.done - last_checkpoint >= checkpoint_every:
+                writer.checkpoint()
+                last_checkpoint = writer.done
+
+            now = time.perf_counter()
+            if progress_every and now - last_progress >= progress_every:
+                last_progress = now
+                print(
+                    f"{writer.done} sketches done, {stats['sketches'] / (now - start):.1f}/s",
+                    flush=True,
+                )
+
+        if result is None:
+            break
+
+    writer.checkpoint()
+    stats["seconds"] = time.perf_counter() - start
+
+    return stats
@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+from src.concurrency import ClientDisconnectedError
+
+
+def content_digest(data: bytes) -> str:
+    """Hash of an uploaded file, used to recognise re-uploads of the same sketch"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _retrieve_exception(future: asyncio.Future):
+    # Computations nobody else waited for would otherwise be logged as unhandled
+    if not future.cancelled():
+        future.exception()
+
+
+class PredictionCache:
+    """Bounded LRU cache of predictions with a time-to-live and single-flight computation
+
+    Concurrent lookups of a key that is being computed wait for that computation instead of
+    starting their own. The cache is only used from the event loop, so it needs no locking.
+
+    Arguments:
+        max_size {int} -- Maximum number of cached predictions
+        ttl {float} -- Seconds a prediction stays cached
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._entries = OrderedDict()
+        self._in_flight = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: str):
+        """Returns the cached value of the key, or None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def put(self, key: str, value: Any):
+        if self.max_size <= 0:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, key: str):
+        """Removes the cached value of the key, if any"""
+        self._entries.pop(key, None)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]):
+        """Returns the cached value of the key, computing it once when it is missing
+
+        Arguments:
+            key {str} -- Cache key
+            compute {Callable} -- Coroutine function computing the value
+
+        Returns:
+            Any -- Cached or computed value
+        """
+        while True:
+            value = self.get(key)
+            if value is not None:
+                return value
+
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                break
+
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                if not in_flight.cancelled():
+                    raise
+            except ClientDisconnectedError:
+                pass
+            # The computation was abandoned by the client that started it, so try again
+
+        self.misses += 1
+
+        future = asyncio.get_event_loop().create_future()
+        future.add_done_callback(_retrieve_exception)
+        self._in_flight[key] = future
+
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            raise
+        finally:
+            del self._in_flight[key]
+
+        self.put(key, value)
+        future.set_result(value)
+
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,196 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, Optional
+
+from src.scheduling import WeightedFairQueue, class_limits
+
+
+class ServerBusyError(Exception):
+    """Raised when the wait queue of the inference executor is full"""
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a prediction does not finish within the request deadline"""
+
+
+class ClientDisconnectedError(Exception):
+    """Raised when the client disconnects while its prediction is pending"""
+
+
+def _discard_result(future: asyncio.Future):
+    # Retrieve the outcome of abandoned work, so that asyncio does not log it as unhandled
+    if not future.cancelled():
+        future.exception()
+
+
+class InferenceExecutor:
+    """Size-limited thread pool for the blocking, CPU-bound prediction pipeline
+
+    At most ``max_workers`` jobs run at once and at most ``max_queue_size`` jobs wait for a free
+    thread. Jobs beyond that are rejected with ``ServerBusyError`` instead of being queued, so
+    that bursts of traffic are shed instead of inflating the latency of every request.
+
+    Jobs belong to priority classes. Free threads take the waiting jobs of each class by its
+    share, and each class may only fill its share of the wait queue, so that a burst of one
+    class neither delays nor rejects the jobs of the others.
+
+    Arguments:
+        max_workers {int} -- Number of threads running jobs
+        max_queue_size {int} -- Number of jobs that may wait for a free thread
+        poll_interval {float} -- Seconds between client disconnection checks (default: 0.1)
+        shares {Dict[str, float]} -- Share of the threads and the wait queue of each priority
+            class, highest priority first (default: one class)
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        max_queue_size: int,
+        poll_interval: float = 0.1,
+        shares: Optional[Dict[str, float]] = None,
+    ):
+        self.max_workers = max(1, max_workers)
+        self.capacity = self.max_workers + max(0, max_queue_size)
+        self.poll_interval = poll_interval
+
+        shares = shares or {"default": 1.0}
+        self.limits = class_limits(shares, self.max_workers, max(0, max_queue_size))
+
+        self._queue = WeightedFairQueue("inference", shares)
+        self._threads = []
+        self._lock = threading.Lock()
+        self._pending = dict.fromkeys(shares, 0)
+
+    @property
+    def pending(self):
+        """Number of jobs that are running or waiting for a thread"""
+        return sum(self._pending.values())
+
+    @property
+    def queued(self):
+        """Number of jobs that are waiting for a thread"""
+        return self._queue.qsize()
+
+    def queue_depths(self) -> Dict[str, int]:
+        """Number of jobs of each priority class that are waiting for a thread"""
+        return self._queue.depths()
+
+    def has_capacity(self, jobs: int = 1, priority: Optional[str] = None):
+        priority = self._queue.priority_class(priority)
+        return self._pending[priority] + jobs <= self.limits[priority]
+
+    def _release(self, priority: str):
+        with self._lock:
+            self._pending[priority] -= 1
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+
+            future, fn, args, priority = job
+            # Jobs that were dropped while they were waiting are skipped
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as error:  # pylint: disable=broad-except
+                    future.set_exception(error)
+            self._release(priority)
+
+    def submit(self, fn: Callable, *args, priority: Optional[str] = None) -> Future:
+        """Schedules a job, or raises ServerBusyError when the wait queue of its class is full"""
+        priority = self._queue.priority_class(priority)
+
+        with self._lock:
+            if self._pending[priority] >= self.limits[priority]:
+                raise ServerBusyError()
+            self._pending[priority] += 1
+
+            # Threads are started on the first job, as the executor is created on import
+            while len(self._threads) < self.max_workers:
+                thread = threading.Thread(
+                    target=self._work, name=f"inference_{len(self._threads)}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+        future = Future()
+        self._queue.put((future, fn, args, priority), priority)
+
+        return future
+
+    async def run(
+        self,
+        fn: Callable,
+        *args,
+        timeout: Optional[float] = None,
+        is_disconnected: Optional[Callable[[], Awaitable[bool]]] = None,
+        priority: Optional[str] = None,
+        release: Optional[Callable[[], None]] = None,
+    ):
+        """Runs a job on the executor without blocking the event loop
+
+        Jobs that are still waiting for a thread are dropped when the deadline passes or when
+        the client disconnects. Jobs that already run are left to finish in the background.
+
+        Arguments:
+            fn {Callable} -- Blocking function to run
+            *args -- Arguments of the function
+            timeout {float} -- Seconds to wait for the job to finish (default: {None})
+            is_disconnected {Callable} -- Coroutine function checking whether the client is gone
+            priority {str} -- Priority class of the job (default: the highest)
+            release {Callable} -- Called once the job is done or dropped, or if it is rejected,
+                to release what the job holds (default: {None})
+
+        Returns:
+            Any -- Return value of the function
+        """
+        loop = asyncio.get_event_loop()
+
+        try:
+            future = self.submit(fn, *args, priority=priority)
+        except Exception:
+            if release is not None:
+                release()
+            raise
+
+        if release is not None:
+            # Runs in the thread that finishes the job, even after this coroutine gave up on it
+            future.add_done_callback(lambda _future: release())
+
+        waiter = asyncio.wrap_future(future, loop=loop)
+
+        deadline = None if timeout is None else loop.time() + timeout
+
+        while True:
+            wait_time = self.poll_interval if is_disconnected is not None else None
+            if deadline is not None:
+                remaining = deadline - loop.time()
+                wait_time = remaining if wait_time is None else min(wait_time, remaining)
+
+            if wait_time is None or wait_time > 0:
+                done, _ = await asyncio.wait({waiter}, timeout=wait_time)
+                if done:
+                    return waiter.result()
+
+            if deadline is not None and loop.time() >= deadline:
+                error = DeadlineExceededError()
+            elif is_disconnected is not None and await is_disconnected():
+                error = ClientDisconnectedError()
+            else:
+                continue
+
+            future.cancel()
+            waiter.add_done_callback(_discard_result)
+            raise error
+
+    def shutdown(self):
+        """Stops the threads once the queued jobs are done"""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        for _ in threads:
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
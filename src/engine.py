@@ -0,0 +1,123 @@
+import threading
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+# Outputs of the Tensorflow Object Detection API, which every backend returns
+OUTPUT_TENSOR_KEYS = [
+    "num_detections",
+    "detection_boxes",
+    "detection_scores",
+    "detection_classes",
+    "detection_masks",
+]
+
+# Outputs of the detection graph used to build predictions
+DETECTION_KEYS = ["num_detections", "detection_boxes", "detection_scores", "detection_classes"]
+
+# Box masks of each detection, predicted by mask-capable models only
+MASK_KEY = "detection_masks"
+
+
+def stack_outputs(outputs: List[dict], include_masks: bool = False) -> dict:
+    """Stacks the output dictionaries of single images into one batched output dictionary
+
+    Arguments:
+        outputs {List[dict]} -- Output dictionaries of images of the same size
+        include_masks {bool} -- Keep the box masks, if the model predicts them (default: False)
+
+    Returns:
+        dict -- Output dictionary of batched detection boxes, scores, classes, and counts
+    """
+    keys = DETECTION_KEYS
+    if include_masks and MASK_KEY in outputs[0]:
+        keys = DETECTION_KEYS + [MASK_KEY]
+
+    return {key: np.stack([output[key] for output in outputs]) for key in keys}
+
+
+class InferenceEngine:
+    """Base class of the inference backends, which serve detections from a loaded model
+
+    A backend loads its model once, when it is built, and implements ``run`` on batches of
+    preprocessed images. ``run`` must be safe to call from several threads, so that one engine
+    can be shared by all request handlers of a worker.
+
+    Arguments:
+        input_size {int} -- Side length of the square images fed to the model (default: 640)
+        input_sizes {Sequence[int]} -- Side lengths of the square images the model can run at,
+            smaller ones for simpler sketches (default: only input_size)
+    """
+
+    def __init__(self, input_size: int = 640, input_sizes: Optional[Sequence[int]] = None):
+        self.input_size = input_size
+        self.input_sizes = tuple(sorted(set(input_sizes or [input_size])))
+
+        self._lock = threading.Lock()
+        self._warmed_up = False
+
+    def run(self, images: np.ndarray):
+        """Run inference on a batch of images
+
+        Arguments:
+            images {ndarray} -- Batch of images with shape [batch, size, size, 3], of one of the
+                ``input_sizes``
+
+        Returns:
+            dict -- Output dictionary of batched detection counts (int32), normalized boxes
+                (ymin, xmin, ymax, xmax), scores, classes (uint8), and masks if the model has them
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def split_batch(output_dict):
+        """Splits the batched output of ``run`` into one output dictionary per image
+
+        Arguments:
+            output_dict {dict} -- Output dictionary returned by ``run``
+
+        Returns:
+            list -- Output dictionaries of detected element boxes, scores, classes, and masks
+        """
+        outputs = []
+        for index, num_detections in enumerate(output_dict["num_detections"]):
+            image_output = {key: value[index] for key, value in output_dict.items()}
+            image_output["num_detections"] = int(num_detections)
+            outputs.append(image_output)
+
+        return outputs
+
+    def run_single(self, image: np.ndarray):
+        """Run inference on a given image
+
+        Arguments:
+            image {ndarray} -- Image as numpy ndarray
+
+        Returns:
+            dict -- Output dictionary of detected element boxes, scores, and classes
+        """
+        return self.split_batch(self.run(np.expand_dims(image, 0)))[0]
+
+    def warmup(self, runs: int = 1):
+        """Runs blank images through the model so that the first request is not slow
+
+        Arguments:
+            runs {int} -- Number of warm-up inferences (default: 1)
+        """
+        with self._lock:
+            if self._warmed_up:
+                return
+
+            for size in self.input_sizes:
+                blank_image = np.zeros((size, size, 3), dtype=np.uint8)
+                for _ in range(runs):
+                    self.run_single(blank_image)
+
+            self._warmed_up = True
+
+    @property
+    def warmed_up(self):
+        return self._warmed_up
+
+    def close(self):
+        """Releases the resources of the loaded model"""
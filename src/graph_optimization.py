@@ -0,0 +1,79 @@
+from typing import List, Optional
+
+import tensorflow as tf
+from tensorflow.tools.graph_transforms import TransformGraph
+
+from src.engine import OUTPUT_TENSOR_KEYS
+
+# Input placeholder of the Tensorflow Object Detection API graphs
+INPUT_NODE = "image_tensor"
+
+
+def graph_transforms(input_size: Optional[int] = 640, quantize: bool = False) -> List[str]:
+    """Graph Transform Tool steps that optimize a frozen detection graph for inference
+
+    The input is fixed to batches of ``input_size`` x ``input_size`` images, the size that
+    ``preprocess`` produces with a single input size, so that the shape computations of the
+    graph's own preprocessing fold into constants. Without an input size, the spatial
+    dimensions are left open, so that the graph runs at each of several input sizes. The batch
+    dimension is left open for batching.
+
+    Arguments:
+        input_size {int} -- Side length of the square input images, None to leave it open
+            (default: 640)
+        quantize {bool} -- Store weights as 8-bit values (default: False)
+
+    Returns:
+        List[str] -- Transforms in the syntax of ``TransformGraph``
+    """
+    side = input_size if input_size is not None else -1
+    transforms = [
+        f'strip_unused_nodes(type=uint8, shape="-1,{side},{side},3")',
+        "remove_nodes(op=CheckNumerics)",
+        "remove_device",
+        "fold_constants(ignore_errors=true)",
+        "fold_batch_norms",
+        "fold_old_batch_norms",
+    ]
+
+    if quantize:
+        transforms.append("quantize_weights")
+
+    transforms.append("sort_by_execution_order")
+
+    return transforms
+
+
+def optimize_graph(
+    input_path: str, output_path: str, input_size: Optional[int] = 640, quantize: bool = False
+) -> List[str]:
+    """Writes an inference-optimized copy of a frozen detection graph
+
+    Nodes that none of the detection outputs depend on are removed, which also drops the mask
+    branch of graphs that do not output masks.
+
+    Arguments:
+        input_path {str} -- Path to the frozen inference graph (.pb)
+        output_path {str} -- Path to write the optimized graph to
+        input_size {int} -- Side length of the square input images, None to leave it open
+            (default: 640)
+        quantize {bool} -- Store weights as 8-bit values (default: False)
+
+    Returns:
+        List[str] -- Detection outputs kept in the optimized graph
+    """
+    graph_def = tf.GraphDef()
+    with tf.gfile.GFile(input_path, "rb") as fid:
+        graph_def.ParseFromString(fid.read())
+
+    node_names = {node.name for node in graph_def.node}
+    outputs = [key for key in OUTPUT_TENSOR_KEYS if key in node_names]
+
+    optimized_graph_def = TransformGraph(
+        graph_def, [INPUT_NODE], outputs, graph_transforms(input_size, quantize)
+    )
+
+    with tf.gfile.GFile(output_path, "wb") as fid:
+        fid.write(optimized_graph_def.SerializeToString())
+
+    return outputs
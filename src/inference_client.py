@@ -0,0 +1,363 @@
+import itertools
+import logging
+import mmap
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from contextlib import contextmanager
+from multiprocessing.connection import Client
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.engine import stack_outputs
+
+logger = logging.getLogger(__name__)
+
+# Bytes of one preprocessed 640x640 image
+IMAGE_SLOT_BYTES = 640 * 640 * 3
+
+
+class SharedRing:
+    """Fixed-size image slots in a memory-mapped file, shared by an HTTP worker and the
+    inference server
+
+    Arguments:
+        path {str} -- Path to the file backing the slots
+        slots {int} -- Number of slots
+        slot_bytes {int} -- Size of each slot in bytes
+        create {bool} -- Create the file instead of opening an existing one (default: False)
+    """
+
+    def __init__(self, path: str, slots: int, slot_bytes: int, create: bool = False):
+        self.path = path
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+
+        with open(path, "w+b" if create else "r+b") as ring_file:
+            if create:
+                ring_file.truncate(slots * slot_bytes)
+            self._mmap = mmap.mmap(ring_file.fileno(), slots * slot_bytes)
+
+    @classmethod
+    def create(cls, slots: int, slot_bytes: int) -> "SharedRing":
+        """Creates a ring in a new file, in memory-backed /dev/shm when available"""
+        directory = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        descriptor, path = tempfile.mkstemp(prefix="metamorph-", suffix=".ring", dir=directory)
+        os.close(descriptor)
+
+        return cls(path, slots, slot_bytes, create=True)
+
+    def view(self, slot: int, shape: Tuple[int, ...]) -> np.ndarray:
+        """Image array stored in a slot"""
+        if int(np.prod(shape)) > self.slot_bytes:
+            raise ValueError(f"Image of shape {shape} does not fit into {self.slot_bytes} bytes")
+
+        return np.ndarray(shape, dtype=np.uint8, buffer=self._mmap, offset=slot * self.slot_bytes)
+
+    def unlink(self):
+        """Removes the backing file, the mapping stays valid until it is closed"""
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        try:
+            self._mmap.close()
+        except BufferError:
+            # Arrays still refer to the slots, the mapping is released along with them
+            pass
+
+
+class InferenceClient:
+    """Connection of an HTTP worker to the local inference server
+
+    Images are copied into a slot of a shared ring and only their slot is sent to the server,
+    which answers with the output dictionary of the image. Requests of all threads of the worker
+    share the connection. If the server goes away, pending requests and those waiting for a slot
+    fail, and the next request reconnects.
+
+    Arguments:
+        address {str} -- Unix socket of the inference server
+        slots {int} -- Number of images that can be in flight at once
+        slot_bytes {int} -- Maximum size of an image in bytes (default: a 640x640 image)
+        connect_timeout {float} -- Seconds to wait for the server to accept (default: 60.0)
+        slot_timeout {float} -- Seconds to wait for a free slot (default: 30.0)
+    """
+
+    def __init__(
+        self,
+        address: str,
+        slots: int,
+        slot_bytes: int = IMAGE_SLOT_BYTES,
+        connect_timeout: float = 60.0,
+        slot_timeout: float = 30.0,
+    ):
+        self.address = address
+        self.slots = max(1, slots)
+        self.slot_bytes = slot_bytes
+        self.connect_timeout = connect_timeout
+        self.slot_timeout = slot_timeout
+
+        self.version = None
+        self.category_index = None
+        self.category_names = None
+        self.input_sizes = None
+
+        self._connection = None
+        self._ring = None
+        self._free_slots = None
+        self._pending = {}
+        self._request_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """Number of images waiting for their output"""
+        return len(self._pending)
+
+    def connect(self):
+        """Connects to the server if not connected, retrying until the server is up"""
+        with self._lock:
+            if self._connection is not None:
+                return
+
+            deadline = time.monotonic() + self.connect_timeout
+            while True:
+                try:
+                    connection = Client(self.address, family="AF_UNIX")
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.5)
+
+            ring = SharedRing.create(self.slots, self.slot_bytes)
+            try:
+                connection.send(("hello", ring.path, self.slots, self.slot_bytes))
+                _, version, category_index, input_sizes = connection.recv()
+            except BaseException:
+                connection.close()
+                ring.close()
+                raise
+            finally:
+                # Both processes have mapped the ring by now
+                ring.unlink()
+
+            self._update_model(version, category_index)
+            self.input_sizes = tuple(input_sizes)
+
+            self._ring = ring
+            self._free_slots = queue.Queue()
+            for slot in range(self.slots):
+                self._free_slots.put(slot)
+            self._connection = connection
+
+            threading.Thread(
+                target=self._read, args=(connection, ring), name="inference-client", daemon=True
+            ).start()
+
+    def _update_model(self, version: str, category_index: Optional[list]):
+        if category_index is not None:
+            self.category_index = category_index
+            self.category_names = np.array(
+                [category["name"] for category in category_index], dtype=object
+            )
+        self.version = version
+
+    def queue_depths(self) -> Dict[str, int]:
+        """Number of images of each priority class waiting for the server"""
+        return dict(Counter(pending[3] for pending in list(self._pending.values())))
+
+    def submit(
+        self, image: np.ndarray, include_masks: bool = False, priority: Optional[str] = None
+    ) -> Future:
+        """Sends an image to the server
+
+        Arguments:
+            image {np.ndarray} -- Preprocessed image of shape [height, width, 3]
+            include_masks {bool} -- Return the box masks, if the model predicts them
+            priority {str} -- Priority class of the image (default: the highest)
+
+        Returns:
+            Future -- Future resolving to the output dictionary of the image
+        """
+        self.connect()
+
+        with self._lock:
+            connection, ring, free_slots = self._connection, self._ring, self._free_slots
+        if connection is None:
+            raise ConnectionError("Lost the connection to the inference server")
+
+        try:
+            slot = free_slots.get(timeout=self.slot_timeout)
+        except queue.Empty:
+            raise TimeoutError("No free slot for the inference server") from None
+        if slot is None or self._connection is not connection:
+            # Passes the wake-up on to the next request waiting for a slot of this connection
+            free_slots.put(None)
+            raise ConnectionError("Lost the connection to the inference server")
+
+        ring.view(slot, image.shape)[...] = image
+
+        future = Future()
+        request_id = next(self._request_ids)
+        self._pending[request_id] = (future, slot, free_slots, priority)
+
+        try:
+            with self._send_lock:
+                connection.send(("detect", request_id, slot, image.shape, include_masks, priority))
+        except OSError as error:
+            self._disconnect(connection, error)
+
+        return future
+
+    def _read(self, connection, ring: SharedRing):
+        try:
+            while True:
+                message = connection.recv()
+                kind, request_id = message[:2]
+
+                pending = self._pending.pop(request_id, None)
+                if pending is None:
+                    continue
+                future, slot, free_slots, _ = pending
+                free_slots.put(slot)
+
+                if kind == "result":
+                    _, _, version, category_index, output_dict = message
+                    self._update_model(version, category_index)
+                    future.set_result(output_dict)
+                else:
+                    future.set_exception(RuntimeError(message[2]))
+        except (EOFError, OSError) as error:
+            self._disconnect(connection, error)
+        finally:
+            ring.close()
+
+    def _disconnect(self, connection, error: Exception):
+        with self._lock:
+            if self._connection is not connection:
+                return
+            self._connection = None
+            free_slots = self._free_slots
+
+        logger.warning("Lost the connection to the inference server: %s", error)
+        connection.close()
+
+        # Wakes the requests waiting for a slot of this connection, which then fail
+        free_slots.put(None)
+
+        for request_id in list(self._pending):
+            pending = self._pending.pop(request_id, None)
+            if pending is not None:
+                pending[0].set_exception(
+                    ConnectionError("Lost the connection to the inference server")
+                )
+
+    def close(self):
+        with self._lock:
+            connection, self._connection = self._connection, None
+        if connection is not None:
+            connection.close()
+            self._free_slots.put(None)
+
+
+class RemoteModel:
+    """Model served by the local inference server, used like a ``LoadedModel``
+
+    The server swaps model versions on its own, so ``version`` and the labels follow the model
+    that served the latest request.
+
+    Arguments:
+        client {InferenceClient} -- Connected client of the inference server
+    """
+
+    def __init__(self, client: InferenceClient):
+        self.client = client
+
+    @property
+    def version(self):
+        return self.client.version
+
+    @property
+    def category_index(self):
+        return self.client.category_index
+
+    @property
+    def category_names(self):
+        return self.client.category_names
+
+    @property
+    def queue_depth(self):
+        """Number of images waiting for the server"""
+        return self.client.pending
+
+    def queue_depths(self):
+        """Number of images of each priority class waiting for the server"""
+        return self.client.queue_depths()
+
+    @property
+    def input_sizes(self):
+        return self.client.input_sizes
+
+    def acquire(self):
+        pass
+
+    def release(self):
+        pass
+
+    def retire(self):
+        self.close()
+
+    @contextmanager
+    def use(self):
+        yield self
+
+    def close(self):
+        self.client.close()
+
+    def detect_elements(
+        self, images: List[np.ndarray], include_masks: bool = False, priority: Optional[str] = None
+    ):
+        """Detect UI elements from the given images on the inference server
+
+        Arguments:
+            images {List[np.ndarray]} -- Preprocessed CV2 image objects of the same size
+            include_masks {bool} -- Return the box masks, if the model predicts them
+                (default: False)
+            priority {str} -- Priority class of the images, shared with the other workers
+                (default: the highest)
+
+        Returns:
+            dict -- Output dictionary of batched detection boxes, scores, classes, and counts
+        """
+        futures = [self.client.submit(image, include_masks, priority) for image in images]
+
+        return stack_outputs([future.result() for future in futures], include_masks)
+
+
+def connect_model(
+    address: str, slots: int, slot_bytes: int = IMAGE_SLOT_BYTES, slot_timeout: float = 30.0
+) -> RemoteModel:
+    """Connects to the local inference server and returns its model
+
+    Arguments:
+        address {str} -- Unix socket of the inference server
+        slots {int} -- Number of images that can be in flight at once
+        slot_bytes {int} -- Maximum size of an image in bytes (default: a 640x640 image)
+        slot_timeout {float} -- Seconds to wait for a free slot (default: 30.0)
+
+    Returns:
+        RemoteModel -- Model served by the inference server
+    """
+    client = InferenceClient(address, slots, slot_bytes, slot_timeout=slot_timeout)
+    client.connect()
+
+    return RemoteModel(client)
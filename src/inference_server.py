@@ -0,0 +1,166 @@
+"""Local inference server, which runs the model for every HTTP worker of a host.
+
+HTTP workers configured with ``METAMORPH_INFERENCE_SERVER`` only decode and preprocess
+sketches. They pass the preprocessed images through shared memory to this process, which owns
+the only copy of the model and batches the images of all workers together.
+
+Run with ``python -m src.inference_server --socket /tmp/metamorph-inference.sock``.
+"""
+
+import argparse
+import logging
+import os
+import threading
+from functools import partial
+from multiprocessing.connection import Listener
+from typing import Optional
+
+from src.engine import MASK_KEY
+from src.inference_client import SharedRing
+from src.predictor import PATH_TO_LABELS, load_model
+from src.registry import ModelRegistry
+from src.settings import SETTINGS
+from src.tuning import apply_cpu_settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADDRESS = "/tmp/metamorph-inference.sock"
+
+
+class _WorkerConnection:
+    """Connection of one HTTP worker, with the shared ring of its images"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.ring = None
+        self.sent_version = None
+        self._send_lock = threading.Lock()
+
+    def send(self, message):
+        try:
+            with self._send_lock:
+                self.connection.send(message)
+        except OSError:
+            # The worker went away, its reader stops on the closed connection
+            pass
+
+
+class InferenceServer:
+    """Serves the model of a registry to HTTP workers over a Unix socket
+
+    Arguments:
+        address {str} -- Unix socket to listen on
+        registry {ModelRegistry} -- Registry of the served model
+    """
+
+    def __init__(self, address: str, registry: ModelRegistry):
+        self.address = address
+        self.registry = registry
+
+    def serve_forever(self):
+        self.registry.start()
+
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+
+        with Listener(self.address, family="AF_UNIX") as listener:
+            logger.info("Inference server listening on %s", self.address)
+            while True:
+                connection = listener.accept()
+                threading.Thread(
+                    target=self._serve_worker, args=(connection,), name="worker", daemon=True
+                ).start()
+
+    def _serve_worker(self, connection):
+        worker = _WorkerConnection(connection)
+        try:
+            while True:
+                message = connection.recv()
+                if message[0] == "hello":
+                    self._hello(worker, *message[1:])
+                else:
+                    self._detect(worker, *message[1:])
+        except (EOFError, OSError):
+            pass
+        finally:
+            connection.close()
+            if worker.ring is not None:
+                worker.ring.close()
+
+    def _hello(self, worker: _WorkerConnection, path: str, slots: int, slot_bytes: int):
+        worker.ring = SharedRing(path, slots, slot_bytes)
+
+        with self.registry.use() as model:
+            worker.sent_version = model.version
+            worker.send(("hello", model.version, model.category_index, model.input_sizes))
+
+    def _detect(
+        self,
+        worker: _WorkerConnection,
+        request_id: int,
+        slot,
+        shape,
+        include_masks: bool,
+        priority: Optional[str] = None,
+    ):
+        try:
+            image = worker.ring.view(slot, shape)
+        except ValueError as error:
+            worker.send(("error", request_id, str(error)))
+            return
+
+        with self.registry.use() as model:
+            # Held until the image is done, even if a new version is swapped in meanwhile
+            model.acquire()
+
+        # The batcher shares the batches of all workers among the priority classes
+        future = model.batcher.submit(image, priority)
+        future.add_done_callback(partial(self._reply, worker, model, request_id, include_masks))
+
+    @staticmethod
+    def _reply(worker: _WorkerConnection, model, request_id: int, include_masks: bool, future):
+        try:
+            output_dict = future.result()
+            if not include_masks:
+                output_dict.pop(MASK_KEY, None)
+
+            # Labels are only sent along when the worker has not seen this version yet
+            category_index = None
+            if worker.sent_version != model.version:
+                worker.sent_version = model.version
+                category_index = model.category_index
+
+            message = ("result", request_id, model.version, category_index, output_dict)
+        except Exception as error:  # pylint: disable=broad-except
+            message = ("error", request_id, f"{type(error).__name__}: {error}")
+        finally:
+            model.release()
+
+        worker.send(message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "-s",
+        "--socket",
+        default=SETTINGS.inference_server or DEFAULT_ADDRESS,
+        help=f"Unix socket to listen on (default: {DEFAULT_ADDRESS})",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    apply_cpu_settings()
+
+    registry = ModelRegistry(
+        load_model,
+        SETTINGS.model_path,
+        PATH_TO_LABELS,
+        directory=SETTINGS.model_registry,
+        poll_interval=SETTINGS.model_poll_interval,
+    )
+    InferenceServer(args.socket, registry).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
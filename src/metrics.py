@@ -0,0 +1,327 @@
+import bisect
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+from starlette.routing import BaseRoute, Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Latency buckets (in seconds), from cache hits to slow inferences on large batches
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+# Metrics rendered by the /metrics endpoint, in registration order
+METRICS = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    """Base class of metrics with optional labels, rendered in Prometheus text format"""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        self._children = OrderedDict()
+        self._lock = threading.Lock()
+
+        METRICS.append(self)
+
+    def labels(self, *values):
+        """Returns the child metric of the label values"""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}{labels} {_format_value(child.value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class CallbackGauge(_Metric):
+    """Gauge (or counter) whose samples are read from other objects when rendered
+
+    Arguments:
+        name {str} -- Metric name
+        documentation {str} -- Metric help text
+        callback {Callable} -- Returns the value by label values tuple
+        labelnames {Sequence[str]} -- Label names (default: no labels)
+        kind {str} -- Prometheus metric type (default: "gauge")
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Dict[tuple, float]],
+        labelnames: Sequence[str] = (),
+        kind: str = "gauge",
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self):
+        for values, value in self.callback().items():
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}{labels} {_format_value(value)}"
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            with child._lock:  # pylint: disable=protected-access
+                counts, total = list(child.counts), child.sum
+
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames + ("le",), values + (_format_value(bound),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+
+            labels = _format_labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+def render_metrics() -> str:
+    """Renders every registered metric in Prometheus text format"""
+    return "\n".join(metric.render() for metric in METRICS) + "\n"
+
+
+REQUESTS = Counter(
+    "metamorph_requests_total", "HTTP requests by endpoint and status", ["endpoint", "status"]
+)
+REQUEST_DURATION = Histogram(
+    "metamorph_request_duration_seconds", "HTTP request duration by endpoint", ["endpoint"]
+)
+REQUESTS_IN_FLIGHT = Gauge("metamorph_requests_in_flight", "HTTP requests being served")
+STAGE_DURATION = Histogram(
+    "metamorph_stage_duration_seconds", "Duration of the prediction pipeline stages", ["stage"]
+)
+BATCH_SIZE = Histogram(
+    "metamorph_batch_size",
+    "Number of images per inference batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+BATCH_DURATION = Histogram("metamorph_batch_duration_seconds", "Duration of inference batches")
+INPUT_SIZES = Counter(
+    "metamorph_input_size_total", "Sketches predicted by model input size", ["size"]
+)
+QUEUE_WAIT = Histogram(
+    "metamorph_queue_wait_seconds",
+    "Time jobs and images wait in the inference queues, by queue and priority class",
+    ["queue", "priority"],
+)
+SESSION_FRAMES = Counter(
+    "metamorph_session_frames_total",
+    "Frames of live sketching sessions, by whether the detector was run on them",
+    ["result"],
+)
+SESSIONS = Gauge("metamorph_sessions", "Open live sketching sessions")
+DETECTIONS = Histogram(
+    "metamorph_detections",
+    "Number of UI elements detected per sketch",
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100),
+)
+
+
+class StageTimer:
+    """Times the stages of one prediction
+
+    Durations are recorded in the stage histogram and kept for the ``Server-Timing`` header.
+    """
+
+    def __init__(self):
+        self.durations = OrderedDict()
+
+    def record(self, stage: str, seconds: float):
+        self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+        STAGE_DURATION.labels(stage).observe(seconds)
+
+    @contextmanager
+    def stage(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def server_timing(self) -> str:
+        return ", ".join(
+            f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in self.durations.items()
+        )
+
+
+class MetricsMiddleware:
+    """Counts HTTP requests by endpoint and status, and times them
+
+    The start time of each request is stored in its scope under ``metamorph.start``, so that
+    handlers can tell how long receiving the request took.
+
+    Arguments:
+        app {ASGIApp} -- Wrapped application
+        routes {List[BaseRoute]} -- Routes whose requests are labelled by the path template of
+            the route, such as ``/predict/{digest}``, others are labelled "other"
+    """
+
+    def __init__(self, app: ASGIApp, routes: Optional[List[BaseRoute]] = None):
+        self.app = app
+        self.routes = routes if routes is not None else []
+
+    def endpoint(self, scope: Scope) -> str:
+        """Path template of the route the router picks for a request, or 'other' if none"""
+        endpoint = "other"
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+            # Requests with a method the route does not allow are answered with 405 by it
+            if match == Match.PARTIAL and endpoint == "other":
+                endpoint = route.path
+        return endpoint
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self.endpoint(scope)
+        start = scope["metamorph.start"] = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            REQUESTS.labels(endpoint, str(status_code)).inc()
+            REQUEST_DURATION.labels(endpoint).observe(time.perf_counter() - start)
@@ -0,0 +1,252 @@
+import zlib
+from typing import Dict, Optional, Sequence
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+# Content types worth compressing, others (such as images) are already compressed
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+class UploadSizeLimitMiddleware:
+    """Rejects request bodies above a size limit before they are fully read
+
+    Requests announcing a larger ``Content-Length`` are rejected right away. Bodies without a
+    length (chunked uploads) are counted while they are received, and the request is rejected as
+    soon as the limit is crossed.
+
+    Arguments:
+        app {ASGIApp} -- Wrapped application
+        limits {Dict[str, int]} -- Maximum body size in bytes by request path
+    """
+
+    def __init__(self, app: ASGIApp, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            await self.reject(limit, scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Stop reading and let the application abort as if the client had left
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+
+            return message
+
+        async def guarded_send(message: Message):
+            nonlocal response_started
+            if exceeded and not response_started:
+                # The application's response to the truncated body is replaced below
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:  # pylint: disable=broad-except
+            if not exceeded or response_started:
+                raise
+
+        if exceeded and not response_started:
+            await self.reject(limit, scope, receive, send)
+
+    @staticmethod
+    async def reject(limit: int, scope: Scope, receive: Receive, send: Send):
+        response = JSONResponse(
+            status_code=413, content={"detail": f"Upload is larger than {limit} bytes"}
+        )
+        await response(scope, receive, send)
+
+
+class GzipStream:
+    """Incremental gzip encoder of a response body"""
+
+    def __init__(self, level: int = 6):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes, finish: bool) -> bytes:
+        # Flushing each chunk lets streamed lines reach the client without waiting for more
+        return self._compressor.compress(data) + self._compressor.flush(
+            zlib.Z_FINISH if finish else zlib.Z_SYNC_FLUSH
+        )
+
+
+class BrotliStream:
+    """Incremental Brotli encoder of a response body"""
+
+    def __init__(self, quality: int = 4):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes, finish: bool) -> bytes:
+        compressed = self._compressor.process(data)
+        return compressed + (self._compressor.finish() if finish else self._compressor.flush())
+
+
+# Available encodings, by order of preference
+ENCODINGS = {"br": BrotliStream, "gzip": GzipStream} if brotli is not None else {"gzip": GzipStream}
+
+
+def negotiate_encoding(accept_encoding: str, encodings: Sequence[str]) -> Optional[str]:
+    """Picks the encoding of a response from an ``Accept-Encoding`` header
+
+    Arguments:
+        accept_encoding {str} -- Value of the header
+        encodings {Sequence[str]} -- Available encodings, by order of preference
+
+    Returns:
+        Optional[str] -- Acceptable encoding with the highest quality value, or None
+    """
+    qualities = {}
+    for part in accept_encoding.lower().split(","):
+        name, *parameters = [item.strip() for item in part.split(";")]
+        quality = 1.0
+        for parameter in parameters:
+            key, _, value = parameter.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            qualities[name] = quality
+
+    wildcard = qualities.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = qualities.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+
+    return best
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Whether an ``If-None-Match`` header matches an entity tag
+
+    Tags are compared weakly, and tags of compressed responses match their uncompressed tag.
+    """
+    if if_none_match.strip() == "*":
+        return True
+
+    opaque_tag = etag[2:] if etag.startswith("W/") else etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        tag = tag[2:] if tag.startswith("W/") else tag
+        for encoding in ENCODINGS:
+            suffix = f'-{encoding}"'
+            if tag.endswith(suffix):
+                tag = tag[: -len(suffix)] + '"'
+        if tag == opaque_tag:
+            return True
+
+    return False
+
+
+class CompressionMiddleware:
+    """Compresses JSON and NDJSON responses with Brotli or gzip, as the client accepts
+
+    Brotli is only offered if the ``brotli`` package is installed. Complete responses smaller
+    than ``minimum_size`` are sent as they are, streamed responses are compressed chunk by
+    chunk. Strong entity tags of compressed responses get the encoding appended, as the bytes
+    differ from those of the uncompressed response.
+
+    Arguments:
+        app {ASGIApp} -- Wrapped application
+        minimum_size {int} -- Minimum size in bytes of compressed responses (default: 1024)
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = Headers(scope=scope).get("accept-encoding", "")
+        encoding = negotiate_encoding(accept_encoding, list(ENCODINGS))
+
+        start_message = None
+        stream = None
+
+        async def compressing_send(message: Message):
+            nonlocal start_message, stream
+            if message["type"] == "http.response.start":
+                # Held back until the first body tells whether the response is compressed
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start_message is not None:
+                headers = MutableHeaders(scope=start_message)
+                content_type = headers.get("content-type", "")
+                compressible = (
+                    content_type.startswith(COMPRESSIBLE_TYPES)
+                    and "content-encoding" not in headers
+                )
+                if compressible:
+                    # Also uncompressed, as the response depends on the header
+                    headers.add_vary_header("Accept-Encoding")
+
+                large = more_body or len(body) >= self.minimum_size
+                if compressible and encoding is not None and large:
+                    stream = ENCODINGS[encoding]()
+                    headers["content-encoding"] = encoding
+                    del headers["content-length"]
+
+                    etag = headers.get("etag")
+                    if etag is not None and etag.startswith('"'):
+                        headers["etag"] = f'{etag[:-1]}-{encoding}"'
+
+                    body = stream.compress(body, finish=not more_body)
+                    if not more_body:
+                        headers["content-length"] = str(len(body))
+                    message = {"type": "http.response.body", "body": body, "more_body": more_body}
+
+                await send(start_message)
+                start_message = None
+                await send(message)
+                return
+
+            if stream is not None:
+                body = stream.compress(body, finish=not more_body)
+                message = {"type": "http.response.body", "body": body, "more_body": more_body}
+
+            await send(message)
+
+        await self.app(scope, receive, compressing_send)
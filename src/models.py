@@ -1,5 +1,6 @@
-from typing import List
+from typing import List, NamedTuple, Optional, Union
 
+import numpy as np
 from pydantic import BaseModel
 
 
@@ -13,15 +14,122 @@ class DimensionSchema(BaseModel):
     height: int
 
 
+class MaskSchema(BaseModel):
+    width: int
+    height: int
+    counts: List[int]
+
+
 class ObjectsSchema(BaseModel):
     name: str
     position: PositionSchema
     dimension: DimensionSchema
     probability: float
+    mask: Optional[MaskSchema] = None
 
 
 class ResponseSchema(BaseModel):
     id: str
+    model_version: str
     width: int
     height: int
     objects: List[ObjectsSchema]
+
+
+class BatchResponseSchema(ResponseSchema):
+    index: int
+    filename: str
+
+
+class BatchErrorSchema(BaseModel):
+    index: int
+    filename: str
+    error: str
+
+
+BatchItemSchema = Union[BatchResponseSchema, BatchErrorSchema]
+
+
+class Detections(NamedTuple):
+    """Detected UI elements of an image as parallel arrays
+
+    Arguments:
+        names {np.ndarray} -- Class name of each element
+        boxes {np.ndarray} -- Bounding box (xmin, ymin, xmax, ymax) of each element in pixels
+        probabilities {np.ndarray} -- Prediction probability (in %) of each element
+        masks {Optional[List[dict]]} -- MaskSchema dictionary of each element, if requested
+    """
+
+    names: np.ndarray
+    boxes: np.ndarray
+    probabilities: np.ndarray
+    masks: Optional[List[dict]] = None
+
+    def to_objects(self) -> List[dict]:
+        """Builds the ObjectsSchema dictionaries of the elements"""
+        objects = [
+            {
+                "name": name,
+                "position": {"x": xmin, "y": ymin},
+                "dimension": {"width": xmax - xmin, "height": ymax - ymin},
+                "probability": probability,
+            }
+            for name, (xmin, ymin, xmax, ymax), probability in zip(
+                self.names.tolist(), self.boxes.tolist(), self.probabilities.tolist()
+            )
+        ]
+
+        if self.masks is not None:
+            for element, mask in zip(objects, self.masks):
+                element["mask"] = mask
+
+        return objects
+
+    def to_columns(self) -> dict:
+        """Builds the parallel name, box (x, y, width, height), and probability arrays of the
+        elements, and their masks if requested"""
+        boxes = np.concatenate([self.boxes[:, :2], self.boxes[:, 2:] - self.boxes[:, :2]], axis=1)
+        columns = {
+            "names": self.names.tolist(),
+            "boxes": boxes.tolist(),
+            "probabilities": self.probabilities.tolist(),
+        }
+
+        if self.masks is not None:
+            columns["masks"] = self.masks
+
+        return columns
+
+    @classmethod
+    def from_columns(cls, columns: dict) -> "Detections":
+        """Rebuilds the detections from the arrays of ``to_columns``"""
+        boxes = np.array(columns["boxes"], dtype=np.int64).reshape(-1, 4)
+        boxes[:, 2:] += boxes[:, :2]
+
+        return cls(
+            np.array(columns["names"], dtype=object),
+            boxes,
+            np.array(columns["probabilities"], dtype=np.float64),
+            columns.get("masks"),
+        )
+
+
+class Prediction(NamedTuple):
+    """Predicted UI elements of a sketch, kept as arrays until they are serialized
+
+    Responses are built from it directly instead of through ``ResponseSchema``, which only
+    documents them.
+
+    Arguments:
+        id {str} -- ID of the sketch
+        model_version {str} -- Version of the model that made the prediction
+        width {int} -- Width of the sketch
+        height {int} -- Height of the sketch
+        detections {Detections} -- Detected UI elements of the sketch
+    """
+
+    id: str
+    model_version: str
+    width: int
+    height: int
+    detections: Detections
@@ -1,13 +1,18 @@
+import hashlib
 import json
 import os
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
 
 import numpy as np
-import tensorflow as tf
 
-from src.utils import reframe_box_masks_to_image_masks
-
-# Path to object detection inference model
-PATH_TO_FROZEN_GRAPH = "models/frozen_inference_graph.pb"
+from src.backends import create_engine
+from src.batching import MicroBatcher
+from src.engine import InferenceEngine, stack_outputs
+from src.inference_client import IMAGE_SLOT_BYTES, RemoteModel, connect_model
+from src.registry import ModelRegistry
+from src.settings import SETTINGS
 
 # Path to labels JSON.
 PATH_TO_LABELS = "models/labels.json"
@@ -15,15 +20,6 @@ PATH_TO_LABELS = "models/labels.json"
 # Creates sketches folder to store entered sketches
 os.makedirs("api/sketches", exist_ok=True)
 
-# Load a (frozen) Tensorflow model into memory until server dies.
-DETECTION_GRAPH = tf.Graph()
-with DETECTION_GRAPH.as_default():
-    od_graph_def = tf.GraphDef()
-    with tf.gfile.GFile(PATH_TO_FROZEN_GRAPH, "rb") as fid:
-        serialized_graph = fid.read()
-        od_graph_def.ParseFromString(serialized_graph)
-        tf.import_graph_def(od_graph_def, name="")
-
 
 def create_category_index_from_labelmap(path):
     with open(path, "r") as f:
@@ -32,122 +28,188 @@ def create_category_index_from_labelmap(path):
     return data
 
 
-# Loading label map
-CATEGORY_INDEX = create_category_index_from_labelmap(PATH_TO_LABELS)
+def model_digest(backend: str, path: str, labels: list) -> str:
+    """Identifies a model file and its labels served by a backend"""
+    digest = hashlib.blake2b(backend.encode(), digest_size=8)
+    with open(path, "rb") as model_file:
+        for chunk in iter(lambda: model_file.read(1 << 20), b""):
+            digest.update(chunk)
+    digest.update(json.dumps(labels).encode())
 
+    return digest.hexdigest()
 
-# Detection code
-def run_inference_for_single_image(image, graph):
-    """Run Tensorflow inference on a given image
 
-    Arguments:
-        image {ndarray} -- Image as numpy ndarray
-        graph {Graph} -- Tensorflow inference graph object
+class LoadedModel:
+    """A loaded model version, served by its own inference engine and batcher
 
-    Returns:
-        dict -- Output dictionary of detected element boxes, scores, and classes
-    """
-    with graph.as_default():
-        with tf.Session() as session:
-            # Get handles to input and output tensors
-            ops = tf.get_default_graph().get_operations()
-            all_tensor_names = {output.name for op in ops for output in op.outputs}
-            tensor_dict = {}
-            for key in [
-                "num_detections",
-                "detection_boxes",
-                "detection_scores",
-                "detection_classes",
-                "detection_masks",
-            ]:
-                tensor_name = key + ":0"
-                if tensor_name in all_tensor_names:
-                    tensor_dict[key] = tf.get_default_graph().get_tensor_by_name(tensor_name)
-            if "detection_masks" in tensor_dict:
-                # The following processing is only for single image
-                detection_boxes = tf.squeeze(tensor_dict["detection_boxes"], [0])
-                detection_masks = tf.squeeze(tensor_dict["detection_masks"], [0])
-                # Reframe is required to translate mask from box coordinates to
-                # image coordinates and fit the image size.
-                real_num_detection = tf.cast(tensor_dict["num_detections"][0], tf.int32)
-                detection_boxes = tf.slice(detection_boxes, [0, 0], [real_num_detection, -1])
-                detection_masks = tf.slice(detection_masks, [0, 0, 0], [real_num_detection, -1, -1])
-                detection_masks_reframed = reframe_box_masks_to_image_masks(
-                    detection_masks, detection_boxes, image.shape[0], image.shape[1]
-                )
-                detection_masks_reframed = tf.cast(
-                    tf.greater(detection_masks_reframed, 0.5), tf.uint8
-                )
-                # Follow the convention by adding back the batch dimension
-                tensor_dict["detection_masks"] = tf.expand_dims(detection_masks_reframed, 0)
-            image_tensor = tf.get_default_graph().get_tensor_by_name("image_tensor:0")
-
-            # Run inference
-            output_dict = session.run(
-                tensor_dict, feed_dict={image_tensor: np.expand_dims(image, 0)}
-            )
-
-            # all outputs are float32 numpy arrays, so convert types as appropriate
-            output_dict["num_detections"] = int(output_dict["num_detections"][0])
-            output_dict["detection_classes"] = output_dict["detection_classes"][0].astype(np.uint8)
-            output_dict["detection_boxes"] = output_dict["detection_boxes"][0]
-            output_dict["detection_scores"] = output_dict["detection_scores"][0]
-            if "detection_masks" in output_dict:
-                output_dict["detection_masks"] = output_dict["detection_masks"][0]
-    return output_dict
-
-
-def detect_elements(image: np.ndarray, min_prob: float):
-    """Detect UI elements from the given image
+    Requests hold a reference to the model while they use it. A model that was replaced by
+    another version is retired, and closed once the last request using it releases it.
 
     Arguments:
-        image {np.ndarray} -- CV2 image object
-        min_prob {float} -- Minimum probability of predictions
-
-    Returns:
-        result {dict} -- python dict of predicted result
+        version {str} -- Version of the model, reported with its predictions
+        engine {InferenceEngine} -- Long-lived inference engine of the model
+        category_index {list} -- Labels of the model
     """
 
-    height, width, _ = image.shape
-
-    # # Expand dimensions since the model expects images to have shape: [1, None, None, 3]
-    # image_np_expanded = np.expand_dims(image_np, axis=0)
-
-    # Actual detection.
-    output_dict = run_inference_for_single_image(image, DETECTION_GRAPH)
+    def __init__(self, version: str, engine: InferenceEngine, category_index: list):
+        self.version = version
+        self.engine = engine
+        self.category_index = category_index
 
-    result = []
-
-    detected_elements = output_dict["num_detections"]
-
-    boxes = output_dict["detection_boxes"]
-    scores = output_dict["detection_scores"]
-    classes = output_dict["detection_classes"]
-
-    for i in range(detected_elements):
-
-        if float(scores[i]) < min_prob:
-            continue
+        # Class names indexed by class ID, to look up the names of many detections at once
+        self.category_names = np.array(
+            [category["name"] for category in category_index], dtype=object
+        )
 
-        ymin, xmin, ymax, xmax = boxes[i]
-        # Get real coordinates from normalized coordinates
-        (left, right, top, bottom) = (
-            int(xmin * width),
-            int(xmax * width),
-            int(ymin * height),
-            int(ymax * height),
+        # Batches concurrent requests into single engine calls
+        self.batcher = MicroBatcher(
+            engine,
+            max_batch_size=SETTINGS.max_batch_size,
+            max_batch_delay_ms=SETTINGS.max_batch_delay_ms,
+            workers=SETTINGS.batch_workers,
+            shares=SETTINGS.priority_shares,
         )
 
-        probability_score = round(scores[i] * 100, 4)
-        ui_element_name = CATEGORY_INDEX[classes[i]]["name"]
+        self._references = 0
+        self._retired = False
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Holds the model open
+
+        Raises:
+            RuntimeError: If the model was already closed
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"Model version {self.version} is closed")
+            self._references += 1
+
+    def release(self):
+        with self._lock:
+            self._references -= 1
+            close = self._retired and self._references == 0 and not self._closed
+            self._closed = self._closed or close
+        if close:
+            # Releases can happen on the event loop, which must not wait for the batcher to stop
+            threading.Thread(target=self._shutdown, name="model-close", daemon=True).start()
+
+    def retire(self):
+        """Closes the model once no request uses it anymore"""
+        with self._lock:
+            self._retired = True
+            close = self._references == 0 and not self._closed
+            self._closed = self._closed or close
+        if close:
+            self._shutdown()
+
+    @contextmanager
+    def use(self):
+        """Holds the model, which stays open until the block exits"""
+        self.acquire()
+        try:
+            yield self
+        finally:
+            self.release()
+
+    @property
+    def queue_depth(self):
+        """Number of images waiting for a batch"""
+        return self.batcher.queue_depth
+
+    def queue_depths(self):
+        """Number of images of each priority class waiting for a batch"""
+        return self.batcher.queue_depths()
+
+    @property
+    def input_sizes(self):
+        """Side lengths of the square images the model runs at, in ascending order"""
+        return self.engine.input_sizes
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+        self._shutdown()
+
+    def _shutdown(self):
+        self.batcher.stop()
+        self.engine.close()
+
+    def detect_elements(
+        self, images: List[np.ndarray], include_masks: bool = False, priority: Optional[str] = None
+    ):
+        """Detect UI elements from the given images
+
+        Images are queued individually, so that they can share batches with other requests.
+
+        Arguments:
+            images {List[np.ndarray]} -- Preprocessed CV2 image objects of the same size
+            include_masks {bool} -- Return the box masks, if the model predicts them
+                (default: False)
+            priority {str} -- Priority class of the images (default: the highest)
+
+        Returns:
+            dict -- Output dictionary of batched detection boxes, scores, classes, and counts
+        """
+        futures = [self.batcher.submit(image, priority) for image in images]
+
+        return stack_outputs([future.result() for future in futures], include_masks)
+
+
+def load_model(model_path: str, labels_path: str, version: Optional[str] = None) -> LoadedModel:
+    """Loads a model with the configured backend, and warms it up
 
-        result.append(
-            {
-                "name": ui_element_name,
-                "position": {"x": top, "y": left},
-                "dimension": {"width": bottom - top, "height": right - left},
-                "probability": probability_score,
-            }
-        )
+    Arguments:
+        model_path {str} -- Model file of the backend
+        labels_path {str} -- Labels JSON of the model
+        version {str} -- Version of the model (default: digest of the model and labels)
 
-    return result
+    Returns:
+        LoadedModel -- Model ready to serve requests
+    """
+    category_index = create_category_index_from_labelmap(labels_path)
+    if version is None:
+        version = model_digest(SETTINGS.backend, model_path, category_index)
+
+    engine = create_engine(
+        SETTINGS.backend,
+        model_path,
+        input_size=max(SETTINGS.input_sizes),
+        input_sizes=SETTINGS.input_sizes,
+        intra_op_threads=SETTINGS.intra_op_threads,
+        inter_op_threads=SETTINGS.inter_op_threads,
+    )
+    model = LoadedModel(version, engine, category_index)
+    model.engine.warmup(SETTINGS.warmup_runs)
+    model.batcher.start()
+
+    return model
+
+
+def connect_inference_server(*_args) -> RemoteModel:
+    """Connects to the inference server instead of loading a model into this worker"""
+    input_size = max(SETTINGS.input_sizes)
+    return connect_model(
+        SETTINGS.inference_server,
+        slots=SETTINGS.inference_workers,
+        slot_bytes=max(IMAGE_SLOT_BYTES, input_size * input_size * 3),
+        slot_timeout=SETTINGS.request_timeout,
+    )
+
+
+# Serves the active model version of this worker and swaps in new versions of the registry.
+# With an inference server, the server loads and swaps the model for all workers instead.
+if SETTINGS.inference_server:
+    MODELS = ModelRegistry(connect_inference_server, SETTINGS.model_path, PATH_TO_LABELS)
+else:
+    MODELS = ModelRegistry(
+        load_model,
+        SETTINGS.model_path,
+        PATH_TO_LABELS,
+        directory=SETTINGS.model_registry,
+        poll_interval=SETTINGS.model_poll_interval,
+    )
@@ -0,0 +1,213 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# File in the registry directory naming the version to serve
+CURRENT_VERSION_FILE = "CURRENT"
+
+
+class ModelNotReadyError(Exception):
+    """Raised when a request arrives before the first model is loaded and warmed up"""
+
+
+class ModelRegistry:
+    """Serves the active version of a model and swaps in new versions without downtime
+
+    The registry directory holds one subdirectory per model version, each with a model file
+    and a labels file. The version named in the ``CURRENT`` file of the directory is served, or
+    the last version by name if there is no such file. The directory is checked every
+    ``poll_interval`` seconds, and a new version is loaded and warmed up in the background
+    before it replaces the active one. Without a directory, the single model at
+    ``model_path`` and ``labels_path`` is served.
+
+    The first model is loaded in the background by ``start``, or on first use. Models are
+    reference counted: ``use`` holds the active model for the duration of a request, and a
+    replaced model is retired, to be closed by its last request. Models implement ``version``,
+    ``acquire``, ``release``, and ``retire``.
+
+    Arguments:
+        loader {Callable} -- Loads and warms up a model from a model path, a labels path, and a
+            version name (None for the single model)
+        model_path {str} -- Model file, whose name is also looked up in the version directories
+        labels_path {str} -- Labels file, whose name is also looked up in the version directories
+        directory {str} -- Registry directory of model versions (default: None)
+        poll_interval {float} -- Seconds between checks for a new version (default: 30.0)
+    """
+
+    def __init__(
+        self,
+        loader: Callable,
+        model_path: str,
+        labels_path: str,
+        directory: Optional[str] = None,
+        poll_interval: float = 30.0,
+    ):
+        self.loader = loader
+        self.model_path = model_path
+        self.labels_path = labels_path
+        self.directory = directory
+        self.poll_interval = poll_interval
+
+        self._active = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._poller = None
+        self._failed_version = None
+        self._load_error = None
+
+    @property
+    def active(self):
+        """Model serving new requests, or None before the first one is loaded"""
+        return self._active
+
+    @property
+    def ready(self) -> bool:
+        """Whether a loaded and warmed up model is serving requests"""
+        return self._active is not None
+
+    @property
+    def load_error(self) -> Optional[Exception]:
+        """Error of loading the first model in the background, if it failed"""
+        return self._load_error
+
+    def versions(self) -> List[str]:
+        """Names of the complete model versions in the registry directory, in order"""
+        if self.directory is None:
+            return []
+
+        model_filename = os.path.basename(self.model_path)
+        labels_filename = os.path.basename(self.labels_path)
+
+        return sorted(
+            name
+            for name in os.listdir(self.directory)
+            if os.path.isfile(os.path.join(self.directory, name, model_filename))
+            and os.path.isfile(os.path.join(self.directory, name, labels_filename))
+        )
+
+    def target_version(self) -> Optional[str]:
+        """Version that should be served, or None if the registry has none"""
+        current_path = os.path.join(self.directory, CURRENT_VERSION_FILE)
+        if os.path.isfile(current_path):
+            with open(current_path) as current_file:
+                return current_file.read().strip()
+
+        versions = self.versions()
+        return versions[-1] if versions else None
+
+    def load(self, version: Optional[str] = None):
+        """Loads a model version and swaps it in once it is ready
+
+        Arguments:
+            version {str} -- Version in the registry directory, or None for the single model
+        """
+        with self._load_lock:
+            if version is None:
+                model_path, labels_path = self.model_path, self.labels_path
+            else:
+                version_directory = os.path.join(self.directory, version)
+                model_path = os.path.join(version_directory, os.path.basename(self.model_path))
+                labels_path = os.path.join(version_directory, os.path.basename(self.labels_path))
+
+            self.swap(self.loader(model_path, labels_path, version))
+
+    def swap(self, model):
+        """Makes the model serve new requests and retires the previous one"""
+        with self._lock:
+            previous, self._active = self._active, model
+
+        logger.info("Serving model version %s", model.version)
+
+        if previous is not None:
+            previous.retire()
+
+    def refresh(self):
+        """Loads the target version of the registry directory if it is not served yet
+
+        A version that fails to load is not retried until another version is targeted.
+        """
+        version = None
+        try:
+            version = self.target_version()
+            active = self._active
+            if version in (None, self._failed_version) or (active and version == active.version):
+                return
+            self.load(version)
+        except Exception:  # pylint: disable=broad-except
+            # The active model keeps serving until a loadable version shows up
+            logger.exception("Loading model version %s failed", version)
+            self._failed_version = version
+
+    def ensure_loaded(self):
+        """Loads the model to serve if none is loaded yet"""
+        if self._active is not None:
+            return
+
+        with self._load_lock:
+            if self._active is not None:
+                return
+
+            if self.directory is None:
+                self.load()
+                return
+
+            version = self.target_version()
+            if version is None:
+                raise FileNotFoundError(f"No model versions found in {self.directory}")
+            self.load(version)
+
+    def start(self):
+        """Loads the model to serve in the background and watches the registry for new versions
+
+        ``ready`` tells when the model is served, and ``load_error`` when it failed to load.
+        """
+        if self._poller is None:
+            self._stopped.clear()
+            self._poller = threading.Thread(target=self._poll, name="model-registry", daemon=True)
+            self._poller.start()
+
+    def stop(self):
+        """Stops watching for new versions and retires the active model"""
+        self._stopped.set()
+        if self._poller is not None:
+            self._poller.join()
+            self._poller = None
+
+        with self._lock:
+            active, self._active = self._active, None
+
+        if active is not None:
+            active.retire()
+
+    def _poll(self):
+        try:
+            self.ensure_loaded()
+        except Exception as error:  # pylint: disable=broad-except
+            logger.exception("Loading the model failed")
+            self._load_error = error
+            return
+
+        if self.directory is None:
+            return
+
+        while not self._stopped.wait(self.poll_interval):
+            self.refresh()
+
+    @contextmanager
+    def use(self):
+        """Holds the active model, which stays open until the block exits"""
+        self.ensure_loaded()
+
+        with self._lock:
+            model = self._active
+            model.acquire()
+
+        try:
+            yield model
+        finally:
+            model.release()
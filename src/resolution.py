@@ -0,0 +1,102 @@
+from typing import NamedTuple, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# Longer side of the thumbnail the signals of a sketch are measured on
+ANALYSIS_SIZE = 320
+
+# Joins the strokes of an element, and the letters of a word, into one blob
+_DILATION_KERNEL = np.ones((3, 3), dtype=np.uint8)
+
+
+class SketchSignals(NamedTuple):
+    """Cheap measures of how much detail a sketch needs to be detected
+
+    Arguments:
+        ink_density {float} -- Fraction of ink pixels
+        components {int} -- Number of connected blobs of ink
+        element_size {float} -- Extent of the small blobs (10th percentile) as a fraction of the
+            longer side of the sketch
+        long_side {int} -- Longer side of the sketch in pixels
+    """
+
+    ink_density: float
+    components: int
+    element_size: float
+    long_side: int
+
+
+def measure_sketch(
+    image: np.ndarray, old_size: Tuple[int, int], binary: bool = False
+) -> SketchSignals:
+    """Measures the signals of a sketch on a small thumbnail
+
+    Arguments:
+        image {np.ndarray} -- CV2 image object in grayscale, or a binary image
+        old_size {Tuple[int, int]} -- Height and width of the sketch, if the image was decoded
+                                      at a reduced size
+        binary {bool} -- The image is already binarized, with ink as 255 (default: False)
+
+    Returns:
+        SketchSignals -- Signals of the sketch
+    """
+    ratio = min(1.0, float(ANALYSIS_SIZE) / max(image.shape[:2]))
+    if ratio < 1.0:
+        height, width = [max(1, int(side * ratio)) for side in image.shape[:2]]
+        image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+
+    if binary:
+        _, binary_image = cv2.threshold(image, 35, 255, cv2.THRESH_BINARY)
+    else:
+        _, binary_image = cv2.threshold(image, 220, 255, cv2.THRESH_BINARY_INV)
+    ink_density = np.count_nonzero(binary_image) / binary_image.size
+
+    binary_image = cv2.dilate(binary_image, _DILATION_KERNEL)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary_image, connectivity=8)
+
+    # Label 0 is the background, and single pixels are noise
+    extents = stats[1:, [cv2.CC_STAT_WIDTH, cv2.CC_STAT_HEIGHT]].max(axis=1)
+    extents = extents[extents > 3]
+
+    element_size = np.percentile(extents, 10) / max(image.shape[:2]) if len(extents) else 1.0
+
+    return SketchSignals(float(ink_density), len(extents), float(element_size), max(old_size))
+
+
+def choose_input_size(
+    signals: SketchSignals,
+    input_sizes: Sequence[int],
+    min_element_pixels: int = 12,
+    max_components: int = 150,
+    max_ink_density: float = 0.15,
+) -> int:
+    """Picks the smallest input size at which the elements of a sketch stay detectable
+
+    Busy sketches, with many blobs or much ink, run at the largest size. Other sketches run at
+    the smallest size at which their small elements span ``min_element_pixels``, or which
+    already holds the sketch at its original size.
+
+    Arguments:
+        signals {SketchSignals} -- Signals of the sketch
+        input_sizes {Sequence[int]} -- Side lengths the model can run at
+        min_element_pixels {int} -- Minimum extent of small elements in the model input
+            (default: 12)
+        max_components {int} -- Number of blobs from which the largest size is used
+            (default: 150)
+        max_ink_density {float} -- Fraction of ink from which the largest size is used
+            (default: 0.15)
+
+    Returns:
+        int -- Side length of the model input
+    """
+    input_sizes = sorted(input_sizes)
+
+    if signals.components > max_components or signals.ink_density > max_ink_density:
+        return input_sizes[-1]
+
+    for size in input_sizes:
+        if size >= signals.long_side or signals.element_size * size >= min_element_pixels:
+            return size
+
+    return input_sizes[-1]
@@ -0,0 +1,115 @@
+import math
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from src.metrics import QUEUE_WAIT
+
+
+class WeightedFairQueue:
+    """Thread-safe queue that shares its consumers among priority classes
+
+    Each class is served in proportion to its share while several classes have items waiting,
+    and a class alone gets all of the capacity. An item of a class that has received less than
+    its share is taken before the items queued earlier by other classes, so interactive
+    requests overtake queued bulk work. Ties go to the class listed first. Classes that were
+    idle do not catch up on the capacity they did not use.
+
+    ``None`` is a stop signal, returned by ``get`` once every queued item has been taken.
+
+    Arguments:
+        name {str} -- Name of the queue in the metrics
+        shares {Dict[str, float]} -- Share of each priority class, highest priority first
+    """
+
+    def __init__(self, name: str, shares: Dict[str, float]):
+        if not shares or min(shares.values()) <= 0:
+            raise ValueError("Every priority class needs a positive share")
+
+        self.name = name
+        self.classes = list(shares)
+        self.shares = dict(shares)
+
+        self._queues = {priority: deque() for priority in self.classes}
+        self._finish_times = dict.fromkeys(self.classes, 0.0)
+        self._clock = 0.0
+        self._size = 0
+        self._stops = 0
+        self._condition = threading.Condition()
+
+    def priority_class(self, priority: Optional[str]) -> str:
+        """Class of a priority, the first class for unknown priorities"""
+        return priority if priority in self._queues else self.classes[0]
+
+    def put(self, item: Any, priority: Optional[str] = None):
+        with self._condition:
+            if item is None:
+                self._stops += 1
+            else:
+                priority = self.priority_class(priority)
+                items = self._queues[priority]
+                if not items:
+                    # The class starts where the others are, instead of where it stopped
+                    self._finish_times[priority] = max(self._finish_times[priority], self._clock)
+                items.append((time.monotonic(), item))
+                self._size += 1
+
+            self._condition.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """Takes the next item, blocking for at most ``timeout`` seconds
+
+        Raises:
+            queue.Empty: If no item arrived in time
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._size or self._stops, timeout):
+                raise queue.Empty()
+
+            if not self._size:
+                self._stops -= 1
+                return None
+
+            priority = min(
+                (priority for priority in self.classes if self._queues[priority]),
+                key=lambda priority: self._finish_times[priority],
+            )
+            enqueued_at, item = self._queues[priority].popleft()
+            self._size -= 1
+
+            self._clock = self._finish_times[priority]
+            self._finish_times[priority] += 1 / self.shares[priority]
+
+        QUEUE_WAIT.labels(self.name, priority).observe(time.monotonic() - enqueued_at)
+
+        return item
+
+    def get_nowait(self) -> Any:
+        return self.get(timeout=0)
+
+    def qsize(self) -> int:
+        return self._size
+
+    def depths(self) -> Dict[str, int]:
+        """Number of queued items of each class"""
+        with self._condition:
+            return {priority: len(items) for priority, items in self._queues.items()}
+
+
+def class_limits(shares: Dict[str, float], reserved: int, shared: int) -> Dict[str, int]:
+    """Splits a wait queue among priority classes
+
+    Arguments:
+        shares {Dict[str, float]} -- Share of each priority class
+        reserved {int} -- Places every class gets, such as the running jobs
+        shared {int} -- Places split among the classes by their share
+
+    Returns:
+        Dict[str, int] -- Maximum number of places of each class
+    """
+    total = sum(shares.values())
+    return {
+        priority: reserved + math.ceil(shared * share / total) for priority, share in shares.items()
+    }
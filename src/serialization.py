@@ -0,0 +1,79 @@
+import json
+from typing import Optional
+
+from starlette.responses import Response
+
+from src.models import Detections, Prediction
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+def dumps(content) -> bytes:
+    """Serializes plain Python content to compact UTF-8 JSON, with orjson if it is installed"""
+    if orjson is not None:
+        return orjson.dumps(content)
+
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+def prediction_content(prediction: Prediction, columnar: bool = False, **extra) -> dict:
+    """Builds the response content of a prediction straight from its detection arrays
+
+    The default layout matches ``ResponseSchema``, with one object per element. The columnar
+    layout holds parallel ``names``, ``boxes`` (x, y, width, height), and ``probabilities``
+    arrays, and ``masks`` if they were requested, instead of ``objects``.
+
+    Arguments:
+        prediction {Prediction} -- Predicted UI elements of a sketch
+        columnar {bool} -- Use the columnar layout (default: False)
+        extra -- Further fields, appended after those of the prediction
+
+    Returns:
+        dict -- Content of the response
+    """
+    content = {
+        "id": prediction.id,
+        "model_version": prediction.model_version,
+        "width": prediction.width,
+        "height": prediction.height,
+    }
+
+    if columnar:
+        content.update(prediction.detections.to_columns())
+    else:
+        content["objects"] = prediction.detections.to_objects()
+
+    content.update(extra)
+    return content
+
+
+def encode_prediction(prediction: Prediction) -> bytes:
+    """Serializes a prediction for the shared result cache"""
+    return dumps(prediction_content(prediction, columnar=True))
+
+
+def decode_prediction(value: bytes) -> Optional[Prediction]:
+    """Deserializes a prediction of the shared result cache, or None if it is not readable"""
+    try:
+        content = json.loads(value) if orjson is None else orjson.loads(value)
+        return Prediction(
+            content["id"],
+            content["model_version"],
+            content["width"],
+            content["height"],
+            Detections.from_columns(content),
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class FastJSONResponse(Response):
+    """JSON response of content that is already plain Python, serialized without validation"""
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
@@ -0,0 +1,171 @@
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from src.models import Detections
+from src.tiling import box_iou_matrix
+
+NO_DETECTIONS = Detections(
+    np.empty(0, dtype=object), np.empty((0, 4), dtype=np.int64), np.empty(0, dtype=np.float64)
+)
+
+
+def ink_change(previous: np.ndarray, current: np.ndarray) -> float:
+    """Fraction of the ink of two model inputs that is only in one of them
+
+    Arguments:
+        previous {np.ndarray} -- Earlier model input, with ink as 255
+        current {np.ndarray} -- Later model input of the same shape
+
+    Returns:
+        float -- Changed ink pixels over the ink pixels of both inputs, 1.0 if the shapes differ
+    """
+    if previous.shape != current.shape:
+        return 1.0
+
+    # The channels of the model input are copies of each other
+    previous_ink = previous[..., 0] > 127
+    current_ink = current[..., 0] > 127
+
+    ink = np.count_nonzero(previous_ink | current_ink)
+    if not ink:
+        return 0.0
+
+    return float(np.count_nonzero(previous_ink ^ current_ink) / ink)
+
+
+def _pair_greedily(candidates: np.ndarray, pairs: List[Tuple[int, int]]):
+    """Adds the candidate pairs, best first, whose detections are not paired yet"""
+    previous_used = {previous_index for previous_index, _ in pairs}
+    current_used = {current_index for _, current_index in pairs}
+    for previous_index, current_index in candidates.tolist():
+        if previous_index in previous_used or current_index in current_used:
+            continue
+        previous_used.add(previous_index)
+        current_used.add(current_index)
+        pairs.append((previous_index, current_index))
+
+
+def match_detections(
+    previous: Detections,
+    current: Detections,
+    iou_threshold: float = 0.5,
+    max_distance: float = 2.0,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Pairs up the detections of the same elements in two frames
+
+    Detections of the same class are paired greedily, by descending overlap, as long as they
+    overlap by at least ``iou_threshold``. The detections left over, of elements that were moved
+    clear of where they were, are then paired by ascending distance of their centres, as long as
+    they are at most ``max_distance`` times the longer side of the earlier box apart.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray] -- Indices of the paired previous and current detections
+    """
+    same_class = previous.names[:, np.newaxis] == current.names[np.newaxis, :]
+    pairs = []
+
+    overlaps = box_iou_matrix(previous.boxes, current.boxes)
+    candidates = np.argwhere(same_class & (overlaps >= iou_threshold))
+    order = np.argsort(-overlaps[candidates[:, 0], candidates[:, 1]], kind="stable")
+    _pair_greedily(candidates[order], pairs)
+
+    previous_centres = (previous.boxes[:, :2] + previous.boxes[:, 2:]) / 2
+    current_centres = (current.boxes[:, :2] + current.boxes[:, 2:]) / 2
+    distances = np.linalg.norm(
+        previous_centres[:, np.newaxis] - current_centres[np.newaxis, :], axis=-1
+    )
+    sizes = (previous.boxes[:, 2:] - previous.boxes[:, :2]).max(axis=1, initial=0)
+    candidates = np.argwhere(same_class & (distances <= max_distance * sizes[:, np.newaxis]))
+    order = np.argsort(distances[candidates[:, 0], candidates[:, 1]], kind="stable")
+    _pair_greedily(candidates[order], pairs)
+
+    indices = np.array(pairs, dtype=np.int64).reshape(-1, 2)
+    return indices[:, 0], indices[:, 1]
+
+
+class SketchSession:
+    """State of a live sketching session
+
+    Holds the last frame the detector ran on, its detections, and the ID of each detected
+    element. Later frames are compared against that frame rather than the one just before
+    them, so that many small strokes add up until they are worth detecting again.
+
+    Arguments:
+        min_ink_change {float} -- Fraction of changed ink from which a frame is detected again
+            (default: 0.01)
+        iou_threshold {float} -- Minimum overlap of the detections of the same element in two
+            frames (default: 0.5)
+        max_distance {float} -- Maximum distance an element that no longer overlaps itself may
+            move between two frames, in multiples of its longer side (default: 2.0)
+        move_tolerance {int} -- Pixels a box may shift before its element counts as moved
+            (default: 2)
+    """
+
+    def __init__(
+        self,
+        min_ink_change: float = 0.01,
+        iou_threshold: float = 0.5,
+        max_distance: float = 2.0,
+        move_tolerance: int = 2,
+    ):
+        self.min_ink_change = min_ink_change
+        self.iou_threshold = iou_threshold
+        self.max_distance = max_distance
+        self.move_tolerance = move_tolerance
+
+        self.frame: Optional[np.ndarray] = None
+        self.model_version: Optional[str] = None
+        self.detections = NO_DETECTIONS
+        self.element_ids = np.empty(0, dtype=np.int64)
+        self._next_id = 0
+
+    def ink_change(self, frame: np.ndarray, model_version: str) -> float:
+        """Ink change of a frame since the last detected frame, 1.0 if it has to be detected
+        anyway"""
+        if self.frame is None or model_version != self.model_version:
+            return 1.0
+
+        return ink_change(self.frame, frame)
+
+    def update(self, frame: np.ndarray, model_version: str, detections: Detections) -> dict:
+        """Replaces the detections of the session with those of a newly detected frame
+
+        Arguments:
+            frame {np.ndarray} -- Model input of the frame
+            model_version {str} -- Version of the model that detected the elements
+            detections {Detections} -- Detected UI elements of the frame
+
+        Returns:
+            dict -- Elements that were ``added`` and ``moved``, as objects with their ``id``, and
+                the IDs of the elements that were ``removed``
+        """
+        previous_indices, current_indices = match_detections(
+            self.detections, detections, self.iou_threshold, self.max_distance
+        )
+
+        element_ids = np.empty(len(detections.names), dtype=np.int64)
+        element_ids[current_indices] = self.element_ids[previous_indices]
+
+        added = np.setdiff1d(np.arange(len(detections.names)), current_indices)
+        element_ids[added] = np.arange(self._next_id, self._next_id + len(added))
+        self._next_id += len(added)
+
+        removed = np.setdiff1d(np.arange(len(self.detections.names)), previous_indices)
+
+        shifts = np.abs(detections.boxes[current_indices] - self.detections.boxes[previous_indices])
+        moved = current_indices[shifts.max(axis=1, initial=0) > self.move_tolerance]
+
+        objects, ids = detections.to_objects(), element_ids.tolist()
+        changes = {
+            "added": [{"id": ids[index], **objects[index]} for index in added.tolist()],
+            "removed": self.element_ids[removed].tolist(),
+            "moved": [{"id": ids[index], **objects[index]} for index in moved.tolist()],
+        }
+
+        self.frame = frame
+        self.model_version = model_version
+        self.detections = detections
+        self.element_ids = element_ids
+
+        return changes
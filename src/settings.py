@@ -0,0 +1,121 @@
+from typing import Dict, List, Optional
+
+from pydantic import BaseSettings
+
+
+class Settings(BaseSettings):
+    """Serving configuration, read from ``METAMORPH_*`` environment variables"""
+
+    # Inference backend: "tensorflow", "opencv" (OpenCV DNN), or "onnxruntime"
+    backend: str = "tensorflow"
+    # Model file of the backend. The opencv backend also reads the text graph description next
+    # to it (same name with .pbtxt), and the onnxruntime backend needs the graph converted to ONNX.
+    model_path: str = "models/frozen_inference_graph.pb"
+    # Directory of versioned models, served instead of model_path (unset disables it). Each
+    # version is a subdirectory holding a model file named like model_path's and labels.json.
+    # The version named in its CURRENT file is served, or else the last version by name.
+    model_registry: Optional[str] = None
+    # Seconds between checks of the model registry for a new version
+    model_poll_interval: float = 30.0
+    # Side lengths of the square images the model runs at, e.g. [320, 480, 640]. Each sketch
+    # runs at the smallest size that keeps its elements detectable, unless a size is requested.
+    input_sizes: List[int] = [640]
+    # Minimum extent (in pixels) of the small elements of a sketch at its chosen input size
+    resolution_min_element_pixels: int = 12
+    # Sketches with more blobs of ink, or a higher fraction of ink, run at the largest size
+    resolution_max_components: int = 150
+    resolution_max_ink_density: float = 0.15
+    # Number of blank inferences run at each input size of a model before it serves requests
+    warmup_runs: int = 3
+    # Unix socket of the local inference server (python -m src.inference_server) that runs the
+    # model for every worker of the host. Unset runs the model in each worker.
+    inference_server: Optional[str] = None
+
+    # Threads of the inference engine within one operation and across independent operations.
+    # 0 leaves the choice to the backend, which assumes it owns every core of the host.
+    intra_op_threads: int = 0
+    inter_op_threads: int = 0
+    # Threads of OpenCV, used to decode and preprocess sketches and by the opencv backend to run
+    # the model (unset leaves OpenCV's default)
+    opencv_threads: Optional[int] = None
+    # CPUs the server runs on, as a list like "0-3,8" (unset runs on every CPU). Gunicorn
+    # workers started with gunicorn.conf.py each get their own share of these CPUs.
+    cpu_affinity: Optional[str] = None
+
+    # Maximum number of images that are run through the detector in one engine call
+    max_batch_size: int = 8
+    # Maximum time (in milliseconds) a request waits for other requests to fill its batch
+    max_batch_delay_ms: float = 5.0
+    # Number of threads that run batches through the inference engine
+    batch_workers: int = 1
+
+    # Number of threads running the blocking prediction pipeline. A batch can only fill up with
+    # requests whose threads are waiting on it, so keep it at least max_batch_size.
+    inference_workers: int = 8
+    # Number of predictions that may wait for a free thread before requests are rejected
+    inference_queue_size: int = 32
+    # Share of the inference threads, wait queue, and batches of each priority class, highest
+    # priority first. Waiting jobs of a higher class overtake those of lower classes until
+    # these fall behind their share, and each class may only fill its share of the wait queue.
+    priority_shares: Dict[str, float] = {"interactive": 0.8, "bulk": 0.2}
+    # Request header choosing the priority class of a request
+    priority_header: str = "X-Priority"
+    # Priority class of the requests to each endpoint that do not choose one. Other endpoints
+    # get the first class of priority_shares.
+    endpoint_priorities: Dict[str, str] = {"/predict/batch/": "bulk"}
+    # Seconds a request may wait for its prediction before it is dropped
+    request_timeout: float = 30.0
+    # Seconds that rejected clients are asked to wait before retrying
+    retry_after: int = 1
+
+    # Longer side (in pixels) that sketches are scaled to before they are cut into 640x640 tiles,
+    # when tiled predictions are requested. Sketches that fit into one tile are not tiled.
+    tile_max_size: int = 1920
+    # Minimum overlap (in pixels) of neighbouring tiles
+    tile_overlap: int = 128
+    # Fraction of ink pixels below which a tile is skipped as blank
+    tile_min_ink: float = 0.002
+    # Maximum overlap (IoU) of elements of the same class found by different tiles
+    tile_iou_threshold: float = 0.5
+
+    # Fraction of the ink of a live session frame that has to change since the last detected
+    # frame before the detector runs again
+    session_min_ink_change: float = 0.01
+    # Minimum overlap (IoU) of the detections of the same element in two frames of a session
+    session_iou_threshold: float = 0.5
+    # Maximum distance an element may move between two frames of a session and keep its ID once
+    # it no longer overlaps where it was, in multiples of the longer side of its box
+    session_max_distance: float = 2.0
+
+    # Maximum size (in bytes) of a /predict/ request body
+    max_upload_size: int = 10 * 1024 * 1024
+    # Maximum size (in bytes) of a /predict/batch/ request body
+    max_batch_upload_size: int = 200 * 1024 * 1024
+
+    # Keep a copy of every uploaded sketch. Sketches are written after the response is sent.
+    archive_sketches: bool = True
+    sketch_directory: str = "./sketches"
+
+    # Maximum number of cached predictions (0 disables the cache)
+    cache_size: int = 1024
+    # Seconds a prediction stays cached
+    cache_ttl: float = 600.0
+    # Directory of the prediction cache shared by all worker processes (unset disables it)
+    shared_cache_directory: Optional[str] = None
+    # Maximum size (in bytes) of the predictions stored in the shared cache
+    shared_cache_max_bytes: int = 256 * 1024 * 1024
+
+    # Compress JSON responses with Brotli (if the brotli package is installed) or gzip, as the
+    # client accepts
+    compress_responses: bool = True
+    # Minimum size (in bytes) of compressed responses. Streamed responses are always compressed.
+    compression_min_size: int = 1024
+
+    # Report the duration of each /predict/ stage in a Server-Timing response header
+    server_timing: bool = False
+
+    class Config:
+        env_prefix = "METAMORPH_"
+
+
+SETTINGS = Settings()
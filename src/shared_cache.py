@@ -0,0 +1,168 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS predictions_accessed_at ON predictions (accessed_at);
+
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    total_size INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO usage (id, total_size) VALUES (0, 0);
+
+CREATE TRIGGER IF NOT EXISTS predictions_insert AFTER INSERT ON predictions
+BEGIN
+    UPDATE usage SET total_size = total_size + NEW.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS predictions_delete AFTER DELETE ON predictions
+BEGIN
+    UPDATE usage SET total_size = total_size - OLD.size WHERE id = 0;
+END;
+"""
+
+
+class SharedResultCache:
+    """On-disk prediction cache shared by every worker process of a host
+
+    Predictions are stored in a SQLite database in write-ahead-log mode, which lets several
+    processes read and write it at once. Once the stored predictions exceed ``max_bytes``, the
+    least recently used ones are evicted. Errors of the database are logged and treated as cache
+    misses, so that a broken cache never fails a request.
+
+    Arguments:
+        directory {str} -- Directory of the cache database
+        max_bytes {int} -- Maximum total size of the stored predictions
+        timeout {float} -- Seconds to wait for a lock held by another process (default: 5.0)
+    """
+
+    def __init__(self, directory: str, max_bytes: int, timeout: float = 5.0):
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = os.path.join(directory, "predictions.sqlite3")
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+
+        # sqlite3 connections cannot be shared between threads
+        self._local = threading.local()
+
+        self._create_schema()
+
+    def _create_schema(self):
+        # Workers starting at the same time race to set up the database, and switching to WAL
+        # mode does not wait for the locks of the others, so the setup is retried until the
+        # timeout
+        deadline = time.monotonic() + self.timeout
+        while True:
+            connection = self._connection()
+            try:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.executescript(f"BEGIN IMMEDIATE;{SCHEMA}COMMIT;")
+                return
+            except sqlite3.OperationalError:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the stored value of the key, or None"""
+        try:
+            connection = self._connection()
+            row = connection.execute(
+                "SELECT value FROM predictions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            connection.execute(
+                "UPDATE predictions SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+            return row[0]
+        except sqlite3.Error:
+            logger.warning("Reading from the shared prediction cache failed", exc_info=True)
+            return None
+
+    def put(self, key: str, value: bytes):
+        """Stores the value of the key and evicts the least recently used values if needed"""
+        try:
+            connection = self._connection()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute("DELETE FROM predictions WHERE key = ?", (key,))
+                connection.execute(
+                    "INSERT INTO predictions (key, value, size, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, len(value), time.time()),
+                )
+                self._evict(connection)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            logger.warning("Writing to the shared prediction cache failed", exc_info=True)
+
+    def _evict(self, connection: sqlite3.Connection):
+        (total_size,) = connection.execute("SELECT total_size FROM usage WHERE id = 0").fetchone()
+
+        excess = total_size - self.max_bytes
+        if excess <= 0:
+            return
+
+        evicted = []
+        for key, size in connection.execute(
+            "SELECT key, size FROM predictions ORDER BY accessed_at"
+        ):
+            evicted.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+
+        connection.executemany("DELETE FROM predictions WHERE key = ?", evicted)
+
+    def stats(self):
+        query = "SELECT (SELECT total_size FROM usage WHERE id = 0), COUNT(*) FROM predictions"
+        try:
+            size, entries = self._connection().execute(query).fetchone()
+        except sqlite3.Error:
+            logger.warning("Reading from the shared prediction cache failed", exc_info=True)
+            size, entries = None, None
+
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes}
+
+
+def open_shared_cache(directory: str, max_bytes: int) -> Optional[SharedResultCache]:
+    """Opens the shared prediction cache, or returns None if its database cannot be set up
+
+    Arguments:
+        directory {str} -- Directory of the cache database
+        max_bytes {int} -- Maximum total size of the stored predictions
+
+    Returns:
+        Optional[SharedResultCache] -- Shared cache, or None to run without it
+    """
+    try:
+        return SharedResultCache(directory, max_bytes)
+    except (OSError, sqlite3.Error):
+        logger.warning("Opening the shared prediction cache failed, disabling it", exc_info=True)
+        return None
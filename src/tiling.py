@@ -0,0 +1,210 @@
+from typing import List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from src.models import Detections
+
+
+class Tiles(NamedTuple):
+    """Overlapping model inputs cut from a sketch
+
+    Arguments:
+        images {np.ndarray} -- Tiles of shape [tiles, tile_size, tile_size, 3], without the
+            nearly blank ones
+        origins {np.ndarray} -- Top left corner (y, x) of each tile in the scaled sketch
+        ratio {float} -- Resize ratio from the sketch to the scaled sketch
+        shape {Tuple[int, int]} -- Height and width of the scaled sketch
+    """
+
+    images: np.ndarray
+    origins: np.ndarray
+    ratio: float
+    shape: Tuple[int, int]
+
+
+def tile_origins(length: int, tile_size: int, overlap: int) -> np.ndarray:
+    """Evenly spread tile positions covering a side, overlapping by at least ``overlap``"""
+    if length <= tile_size:
+        return np.zeros(1, dtype=np.int64)
+
+    count = int(np.ceil((length - overlap) / (tile_size - overlap)))
+    return np.round(np.linspace(0, length - tile_size, count)).astype(np.int64)
+
+
+def tile_sketch(
+    image: np.ndarray,
+    old_size: Tuple[int, int],
+    tile_size: int = 640,
+    max_size: int = 1920,
+    overlap: int = 128,
+    min_ink: float = 0.002,
+    binary: bool = False,
+) -> Tiles:
+    """Binarize a sketch and cut it into overlapping square model inputs
+
+    The sketch is scaled so that its longer side is at most ``max_size``. Sketches that fit into
+    one tile at that scale give no tiles, as the letterboxed input of ``preprocess`` already
+    holds them at full detail.
+
+    Arguments:
+        image {np.ndarray} -- CV2 image object in grayscale, or a binary image
+        old_size {Tuple[int, int]} -- Height and width of the sketch, if the image was decoded
+                                      at a reduced size
+        tile_size {int} -- Side length of the model input (default: 640)
+        max_size {int} -- Longer side of the scaled sketch in pixels (default: 1920)
+        overlap {int} -- Minimum overlap of neighbouring tiles in pixels (default: 128)
+        min_ink {float} -- Fraction of ink pixels below which tiles are skipped (default: 0.002)
+        binary {bool} -- The image is already binarized, with ink as 255 (default: False)
+
+    Returns:
+        Tiles -- Tiles of the sketch and their position
+    """
+    ratio = min(1.0, float(max_size) / max(old_size))
+    height, width = [int(side * ratio) for side in old_size]
+
+    if max(height, width) <= tile_size:
+        empty = np.empty((0, tile_size, tile_size, 3), dtype=np.uint8)
+        return Tiles(empty, np.empty((0, 2), dtype=np.int64), ratio, (height, width))
+
+    binary_image = image
+    if not binary:
+        # Thresholds and inverts in one pass, like preprocess
+        _, binary_image = cv2.threshold(image, 220, 255, cv2.THRESH_BINARY_INV)
+    binary_image = cv2.resize(binary_image, (width, height))
+
+    # Sides shorter than a tile are padded with background
+    canvas = np.zeros((max(height, tile_size), max(width, tile_size)), dtype=np.uint8)
+    canvas[:height, :width] = binary_image
+
+    tops = tile_origins(height, tile_size, overlap)
+    lefts = tile_origins(width, tile_size, overlap)
+    origins = np.stack(np.meshgrid(tops, lefts, indexing="ij"), axis=-1).reshape(-1, 2)
+
+    tiles = np.stack([canvas[y : y + tile_size, x : x + tile_size] for y, x in origins])
+
+    # Nearly blank tiles hold no elements worth running the detector for
+    ink = np.count_nonzero(tiles.reshape(len(tiles), -1) > 127, axis=1)
+    inked = ink >= min_ink * tile_size * tile_size
+    tiles, origins = tiles[inked], origins[inked]
+
+    images = np.repeat(tiles[..., np.newaxis], 3, axis=-1)
+    return Tiles(images, origins, ratio, (height, width))
+
+
+def box_iou_matrix(boxes: np.ndarray, other: Optional[np.ndarray] = None) -> np.ndarray:
+    """Pairwise intersection over union of (xmin, ymin, xmax, ymax) boxes, or of the boxes with
+    the ``other`` boxes"""
+    boxes = boxes.astype(np.float64).reshape(-1, 4)
+    other = boxes if other is None else other.astype(np.float64).reshape(-1, 4)
+    areas = np.prod(np.clip(boxes[:, 2:] - boxes[:, :2], 0, None), axis=1)
+    other_areas = np.prod(np.clip(other[:, 2:] - other[:, :2], 0, None), axis=1)
+
+    top_left = np.maximum(boxes[:, np.newaxis, :2], other[np.newaxis, :, :2])
+    bottom_right = np.minimum(boxes[:, np.newaxis, 2:], other[np.newaxis, :, 2:])
+    intersections = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+
+    unions = areas[:, np.newaxis] + other_areas[np.newaxis, :] - intersections
+    return np.divide(intersections, unions, out=np.zeros_like(intersections), where=unions > 0)
+
+
+def non_max_suppression(
+    boxes: np.ndarray, scores: np.ndarray, classes: np.ndarray, iou_threshold: float
+) -> np.ndarray:
+    """Class-aware non-maximum suppression of all boxes at once
+
+    A box is dropped if a higher scoring box of the same class overlaps it by more than
+    ``iou_threshold``, even if that box is dropped itself. Unlike greedy NMS this needs no loop
+    over the boxes, and it only differs on chains of overlapping boxes.
+
+    Arguments:
+        boxes {np.ndarray} -- Boxes (xmin, ymin, xmax, ymax)
+        scores {np.ndarray} -- Score of each box
+        classes {np.ndarray} -- Class of each box
+        iou_threshold {float} -- Maximum overlap of kept boxes of the same class
+
+    Returns:
+        np.ndarray -- Indices of the kept boxes, by descending score
+    """
+    order = np.argsort(-np.asarray(scores), kind="stable")
+    boxes, classes = np.asarray(boxes)[order], np.asarray(classes)[order]
+
+    overlaps = box_iou_matrix(boxes)
+    overlaps[classes[:, np.newaxis] != classes[np.newaxis, :]] = 0
+
+    # Only the overlaps with higher scoring boxes count
+    suppressed = np.triu(overlaps, k=1).max(axis=0, initial=0) > iou_threshold
+
+    return order[~suppressed]
+
+
+def merge_tiles(
+    detections: List[Detections], tiles: Tiles, iou_threshold: float = 0.5, margin: int = 4
+) -> Detections:
+    """Merge the detections of the letterboxed sketch and its tiles
+
+    Tiles cut elements at their inner edges, so detections touching an inner tile edge are
+    dropped. Elements smaller than the tile overlap are then still found whole by a
+    neighbouring tile, and larger ones by the letterboxed sketch. Duplicates of the same element
+    found by several inputs are removed with class-aware NMS.
+
+    Arguments:
+        detections {List[Detections]} -- Detections of the letterboxed sketch, then of each tile,
+            in sketch coordinates
+        tiles {Tiles} -- Tiles the detections were made on
+        iou_threshold {float} -- Maximum overlap of kept elements of the same class
+            (default: 0.5)
+        margin {int} -- Distance in scaled pixels from a tile edge that counts as touching it
+            (default: 4)
+
+    Returns:
+        Detections -- Detected UI elements of the sketch
+    """
+    sketch_detections, *tile_detections = detections
+    if not tile_detections:
+        return sketch_detections
+
+    height, width = tiles.shape
+    tile_size = tiles.images.shape[1]
+
+    merged = [sketch_detections]
+    for (top, left), tile_detection in zip(tiles.origins.tolist(), tile_detections):
+        xmin, ymin, xmax, ymax = np.moveaxis(tile_detection.boxes * tiles.ratio, -1, 0)
+
+        touching = np.zeros(len(tile_detection.boxes), dtype=bool)
+        if left > 0:
+            touching |= xmin <= left + margin
+        if top > 0:
+            touching |= ymin <= top + margin
+        if left + tile_size < width:
+            touching |= xmax >= left + tile_size - margin
+        if top + tile_size < height:
+            touching |= ymax >= top + tile_size - margin
+
+        merged.append(select_detections(tile_detection, np.flatnonzero(~touching)))
+
+    has_masks = sketch_detections.masks is not None
+    combined = Detections(
+        np.concatenate([detection.names for detection in merged]),
+        np.concatenate([detection.boxes for detection in merged]),
+        np.concatenate([detection.probabilities for detection in merged]),
+        [mask for detection in merged for mask in detection.masks] if has_masks else None,
+    )
+
+    _, classes = np.unique(combined.names, return_inverse=True)
+    kept = non_max_suppression(combined.boxes, combined.probabilities, classes, iou_threshold)
+
+    return select_detections(combined, kept)
+
+
+def select_detections(detections: Detections, indices: np.ndarray) -> Detections:
+    masks = detections.masks
+    if masks is not None:
+        masks = [masks[index] for index in indices.tolist()]
+
+    return Detections(
+        detections.names[indices],
+        detections.boxes[indices],
+        detections.probabilities[indices],
+        masks,
+    )
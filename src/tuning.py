@@ -0,0 +1,105 @@
+import logging
+import os
+from typing import List, Optional
+
+import cv2
+
+from src.settings import SETTINGS
+
+logger = logging.getLogger(__name__)
+
+
+def parse_cpu_list(cpu_list: str) -> List[int]:
+    """Parses a CPU list like "0-3,8" as used by taskset and /sys/devices/system/cpu
+
+    Arguments:
+        cpu_list {str} -- Comma-separated CPUs and inclusive CPU ranges
+
+    Raises:
+        ValueError: If the list is malformed or empty
+
+    Returns:
+        List[int] -- Sorted CPU numbers
+    """
+    cpus = set()
+    for part in cpu_list.split(","):
+        part = part.strip()
+        if not part:
+            continue
+
+        first, _, last = part.partition("-")
+        first, last = int(first), int(last or first)
+        if first < 0 or last < first:
+            raise ValueError(f"Invalid CPU range {part!r}")
+        cpus.update(range(first, last + 1))
+
+    if not cpus:
+        raise ValueError(f"No CPUs in {cpu_list!r}")
+
+    return sorted(cpus)
+
+
+def format_cpu_list(cpus: List[int]) -> str:
+    """Formats CPU numbers as a CPU list like "0-3,8" """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+
+    return ",".join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+
+def worker_cpus(cpus: List[int], index: int, workers: int) -> List[int]:
+    """Share of the CPUs of one of several workers
+
+    The CPUs are split into contiguous, equally sized shares. With fewer CPUs than workers,
+    workers share CPUs round robin.
+
+    Arguments:
+        cpus {List[int]} -- CPUs of all workers
+        index {int} -- Index of the worker, wrapped around the number of workers
+        workers {int} -- Number of workers
+
+    Returns:
+        List[int] -- CPUs of the worker
+    """
+    workers = max(1, workers)
+    index %= workers
+    if len(cpus) < workers:
+        return [cpus[index % len(cpus)]]
+
+    share = len(cpus) // workers
+    return cpus[index * share : (index + 1) * share]
+
+
+def pin_cpus(cpus: List[int]):
+    """Restricts the current process, and the threads it starts from now on, to the CPUs"""
+    if not hasattr(os, "sched_setaffinity"):
+        logger.warning("CPU affinity is not supported on this platform, ignoring it")
+        return
+
+    os.sched_setaffinity(0, cpus)
+    logger.info("Pinned process %d to CPUs %s", os.getpid(), format_cpu_list(cpus))
+
+
+def apply_cpu_settings(cpu_affinity: Optional[str] = None, opencv_threads: Optional[int] = None):
+    """Applies the CPU affinity and OpenCV thread count of the settings to this process
+
+    Call it before the model is loaded, so that the threads of the inference engine start on
+    the pinned CPUs.
+
+    Arguments:
+        cpu_affinity {str} -- CPU list to pin the process to (default: the cpu_affinity setting)
+        opencv_threads {int} -- Threads of OpenCV (default: the opencv_threads setting)
+    """
+    cpu_affinity = cpu_affinity or SETTINGS.cpu_affinity
+    if opencv_threads is None:
+        opencv_threads = SETTINGS.opencv_threads
+
+    if cpu_affinity:
+        pin_cpus(parse_cpu_list(cpu_affinity))
+
+    if opencv_threads is not None:
+        cv2.setNumThreads(opencv_threads)
@@ -1,124 +1,333 @@
-import shutil
-from typing import List
-from uuid import uuid1
+import os
+import re
+import struct
+import threading
+from typing import List, Optional, Sequence, Tuple
 
 import cv2
 import numpy as np
-import tensorflow as tf
-from fastapi import UploadFile
 
-from src.models import ObjectsSchema
+from src.models import Detections
 
 
-def preprocess(image: np.ndarray):
-    grayscale_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    _, thresh_binary_image = cv2.threshold(grayscale_image, 220, 255, cv2.THRESH_BINARY)
-    image = cv2.bitwise_not(thresh_binary_image)
+class InvalidSketchError(ValueError):
+    """Raised when an uploaded sketch cannot be decoded"""
 
-    desired_size = 640
-    old_size = image.shape[:2]
+
+# Reduced-size grayscale decoding flags by their downscaling factor, largest first
+REDUCED_GRAYSCALE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+]
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# JPEG start-of-frame markers, which hold the image size
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# Header of a raw 1-bit PBM image: magic number, width, and height, separated by whitespace or
+# comments, and a single whitespace before the bit-packed rows
+BITMAP_HEADER = re.compile(rb"P4(?:\s|#[^\n]*\n)+(\d+)(?:\s|#[^\n]*\n)+(\d+)\s")
+
+# Reusable preprocessing buffers of each thread
+_THREAD_BUFFERS = threading.local()
+
+
+def read_image_size(data: bytes) -> Optional[Tuple[int, int]]:
+    """Read the size of a JPG or PNG image from its header, without decoding it
+
+    Arguments:
+        data {bytes} -- Encoded image
+
+    Returns:
+        Optional[Tuple[int, int]] -- Height and width of the image, or None if unknown
+    """
+    if data[:8] == PNG_SIGNATURE and len(data) >= 24:
+        width, height = struct.unpack(">II", data[16:24])
+        return height, width
+
+    if data[:2] != b"\xff\xd8":
+        return None
+
+    offset = 2
+    while offset + 9 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+
+        marker = data[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            offset += 1
+            continue
+
+        (length,) = struct.unpack(">H", data[offset + 2 : offset + 4])
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", data[offset + 5 : offset + 9])
+            return height, width
+
+        offset += 2 + length
+
+    return None
+
+
+def decode_sketch(data: bytes, desired_size: int = 640):
+    """Decode an uploaded sketch from memory, straight to grayscale
+
+    Sketches far larger than the model input are decoded at a reduced size, which skips most of
+    the decoding work of large JPG images.
+
+    Arguments:
+        data {bytes} -- Encoded image (jpg or png)
+        desired_size {int} -- Side length of the model input (default: 640)
+
+    Returns:
+        Tuple[np.ndarray, int, int] -- Grayscale image, and height and width of the sketch
+    """
+    size = read_image_size(data)
+
+    flag, factor = cv2.IMREAD_GRAYSCALE, 1
+    if size is not None:
+        for reduced_factor, reduced_flag in REDUCED_GRAYSCALE_FLAGS:
+            if max(size) // reduced_factor >= desired_size:
+                flag, factor = reduced_flag, reduced_factor
+                break
+
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+
+    if image is None:
+        raise InvalidSketchError("Uploaded file is not a valid JPG or PNG image")
+
+    if factor == 1:
+        height, width = image.shape[:2]
+    else:
+        height, width = size
+        # The decoder applies the EXIF orientation, which can swap both sides
+        if (image.shape[0] > image.shape[1]) != (height > width):
+            height, width = width, height
+
+    return image, height, width
+
+
+def is_bitmap(data: bytes) -> bool:
+    """Whether an upload is a 1-bit PBM image instead of a JPG or PNG"""
+    return data[:2] == b"P4"
+
+
+def decode_bitmap(data: bytes):
+    """Unpack an already binarized sketch from a raw 1-bit PBM (P4) image
+
+    Each row of the image is packed into whole bytes, most significant bit first, and set bits
+    are ink. A 640x640 sketch takes 51 KB, and needs no image codec or thresholding.
+
+    Arguments:
+        data {bytes} -- PBM image
+
+    Returns:
+        Tuple[np.ndarray, int, int] -- Binary image with ink as 255 on 0, and its height and
+            width
+    """
+    header = BITMAP_HEADER.match(data)
+    if header is None:
+        raise InvalidSketchError("Uploaded file is not a valid PBM image")
+
+    width, height = int(header.group(1)), int(header.group(2))
+    row_bytes = (width + 7) // 8
+    offset = header.end()
+
+    if width == 0 or height == 0 or len(data) - offset < height * row_bytes:
+        raise InvalidSketchError("Uploaded PBM image is empty or truncated")
+
+    rows = np.frombuffer(data, dtype=np.uint8, count=height * row_bytes, offset=offset)
+    bits = np.unpackbits(rows.reshape(height, row_bytes), axis=1)[:, :width]
+
+    # Set bits become 255, like the thresholded ink of preprocess
+    return np.multiply(bits, 255, out=bits), height, width
+
+
+def letterbox_buffer(desired_size: int = 640) -> np.ndarray:
+    """Returns the reusable ``preprocess`` output buffer of the calling thread
+
+    The buffer is overwritten by the next ``preprocess`` call of the thread, so it may only be
+    passed on to work the thread waits for.
+
+    Arguments:
+        desired_size {int} -- Side length of the model input (default: 640)
+
+    Returns:
+        np.ndarray -- Buffer of shape [desired_size, desired_size, 3]
+    """
+    buffers = _THREAD_BUFFERS.__dict__.setdefault("letterbox", {})
+
+    buffer = buffers.get(desired_size)
+    if buffer is None:
+        buffer = buffers[desired_size] = np.empty((desired_size, desired_size, 3), np.uint8)
+
+    return buffer
+
+
+def preprocess(
+    image: np.ndarray,
+    old_size: Optional[Tuple[int, int]] = None,
+    desired_size: int = 640,
+    out: Optional[np.ndarray] = None,
+    binary: bool = False,
+):
+    """Binarize a sketch and letterbox it into the square model input
+
+    Arguments:
+        image {np.ndarray} -- CV2 image object, in color or grayscale, or a binary image
+        old_size {Tuple[int, int]} -- Height and width of the sketch, if the image was decoded
+                                      at a reduced size (default: size of the image)
+        desired_size {int} -- Side length of the model input (default: 640)
+        out {np.ndarray} -- Buffer of shape [desired_size, desired_size, 3] to write the model
+                            input to (default: new array)
+        binary {bool} -- The image is already binarized, with ink as 255 (default: False)
+
+    Returns:
+        Tuple[np.ndarray, int, int, float] -- Model input, top and left padding, and resize ratio
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    if old_size is None:
+        old_size = image.shape[:2]
 
     ratio = float(desired_size) / max(old_size)
     new_size = tuple([int(x * ratio) for x in old_size])
 
-    im = cv2.resize(image, (new_size[1], new_size[0]))
+    if binary:
+        thresh_binary_image = image
+    else:
+        # Thresholds and inverts in one pass
+        _, thresh_binary_image = cv2.threshold(image, 220, 255, cv2.THRESH_BINARY_INV)
+
+    if thresh_binary_image.shape[:2] == new_size:
+        im = thresh_binary_image
+    else:
+        im = cv2.resize(thresh_binary_image, (new_size[1], new_size[0]))
 
     delta_w = desired_size - new_size[1]
     delta_h = desired_size - new_size[0]
-    top, bottom = delta_h // 2, delta_h - (delta_h // 2)
-    left, right = delta_w // 2, delta_w - (delta_w // 2)
+    top, left = delta_h // 2, delta_w // 2
+
+    if out is None:
+        out = np.empty((desired_size, desired_size, 3), dtype=np.uint8)
+
+    # Black borders, and the sketch copied to all three channels
+    out[:top] = 0
+    out[top + new_size[0] :] = 0
+    out[top : top + new_size[0], :left] = 0
+    out[top : top + new_size[0], left + new_size[1] :] = 0
+    out[top : top + new_size[0], left : left + new_size[1]] = im[..., np.newaxis]
+
+    return out, top, left, ratio
+
+
+def postprocess(
+    output_dict: dict,
+    min_prob: float,
+    tops: Sequence[int],
+    lefts: Sequence[int],
+    ratios: Sequence[float],
+    category_names: np.ndarray,
+    input_shape: Tuple[int, int] = (640, 640),
+) -> List[Detections]:
+    """Select the detections of a batch above a probability and map them onto the sketches
+
+    All detections of the batch are filtered, converted to pixels, and moved out of the
+    letterbox of ``preprocess`` at once. If the output dictionary holds box masks, the masks of
+    the selected detections are fit to their boxes and run-length encoded.
+
+    Arguments:
+        output_dict {dict} -- Batched output dictionary of the detection graph
+        min_prob {float} -- Minimum probability of predictions
+        tops {Sequence[int]} -- Top letterbox padding of each image
+        lefts {Sequence[int]} -- Left letterbox padding of each image
+        ratios {Sequence[float]} -- Resize ratio of each image
+        category_names {np.ndarray} -- Class names indexed by class ID
+        input_shape {Tuple[int, int]} -- Height and width of the preprocessed images
 
-    color = [0, 0, 0]
-    new_im = cv2.copyMakeBorder(im, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+    Returns:
+        List[Detections] -- Detected UI elements of each image
+    """
+    boxes = output_dict["detection_boxes"]
+    scores = output_dict["detection_scores"]
+    classes = output_dict["detection_classes"]
+    num_detections = output_dict["num_detections"]
 
-    image_np = cv2.cvtColor(new_im, cv2.COLOR_GRAY2BGR)
+    keep = np.arange(scores.shape[1]) < np.reshape(num_detections, (-1, 1))
+    keep &= scores.astype(np.float64) >= min_prob
+    image_index, _ = np.nonzero(keep)
 
-    return image_np, top, left, ratio
+    # Get real coordinates from normalized coordinates
+    height, width = input_shape
+    ymin, xmin, ymax, xmax = np.moveaxis(boxes[keep], -1, 0)
+    pixels = np.stack([xmin * width, ymin * height, xmax * width, ymax * height], axis=-1)
+    pixels = pixels.astype(np.int64)
 
+    # Undo the letterbox padding and resizing
+    offsets = np.stack([lefts, tops, lefts, tops], axis=-1).astype(np.float64)[image_index]
+    ratio = np.asarray(ratios, dtype=np.float64)[image_index, np.newaxis]
+    pixels = np.trunc((pixels - offsets) / ratio).astype(np.int64)
 
-def postprocess(result: List[ObjectsSchema], top: int, left: int, ratio: float):
+    names = category_names[classes[keep]]
+    probabilities = np.round(scores[keep] * 100, 4)
 
-    for annotation in result:
-        xmin = annotation["position"]["y"] - left
-        ymin = annotation["position"]["x"] - top
-        w = annotation["dimension"]["height"]
-        h = annotation["dimension"]["width"]
+    splits = np.cumsum(np.count_nonzero(keep, axis=1))[:-1]
+    arrays = [np.split(names, splits), np.split(pixels, splits), np.split(probabilities, splits)]
 
-        xmax = xmin + w
-        ymax = ymin + h
+    if "detection_masks" in output_dict:
+        masks = [
+            encode_mask(box_mask, xmax - xmin, ymax - ymin)
+            for box_mask, (xmin, ymin, xmax, ymax) in zip(
+                output_dict["detection_masks"][keep], pixels.tolist()
+            )
+        ]
+        bounds = [0] + splits.tolist() + [len(masks)]
+        arrays.append([masks[start:end] for start, end in zip(bounds, bounds[1:])])
 
-        xmin = int(xmin / ratio)
-        ymin = int(ymin / ratio)
-        xmax = int(xmax / ratio)
-        ymax = int(ymax / ratio)
+    return [Detections(*fields) for fields in zip(*arrays)]
 
-        annotation["position"]["x"] = xmin
-        annotation["position"]["y"] = ymin
-        annotation["dimension"]["width"] = xmax - xmin
-        annotation["dimension"]["height"] = ymax - ymin
 
-    return result
+def encode_mask(box_mask: np.ndarray, width: int, height: int) -> dict:
+    """Fit the mask of a detection to the size of its box and run-length encode it
 
+    The mask is thresholded at 0.5 and read row by row. ``counts`` holds the lengths of the
+    alternating runs of background and element pixels, starting with background.
 
-def store_sketch(image: UploadFile):
-    id_ = str(uuid1())
-    image_path = f"./sketches/{id_}.jpg"
+    Arguments:
+        box_mask {np.ndarray} -- Mask probabilities in box coordinates
+        width {int} -- Width of the box in pixels
+        height {int} -- Height of the box in pixels
 
-    with open(image_path, "wb") as buffer:
-        shutil.copyfileobj(image.file, buffer)
+    Returns:
+        dict -- MaskSchema dictionary of the mask
+    """
+    if width <= 0 or height <= 0:
+        return {"width": max(width, 0), "height": max(height, 0), "counts": []}
 
-    return id_, image_path
+    mask = cv2.resize(box_mask.astype(np.float32), (width, height)) > 0.5
+    pixels = mask.ravel()
 
+    changes = np.flatnonzero(pixels[1:] != pixels[:-1]) + 1
+    counts = np.diff(np.concatenate([[0], changes, [pixels.size]]))
+    if pixels[0]:
+        counts = np.concatenate([[0], counts])
 
-# Utility function copied from TensorFlow Object Detection API
-# Original filepath: objection_detection/utils/ops
-def reframe_box_masks_to_image_masks(box_masks, boxes, image_height, image_width):
-    """Transforms the box masks back to full image masks.
+    return {"width": width, "height": height, "counts": counts.tolist()}
 
-    Embeds masks in bounding boxes of larger masks whose shapes correspond to
-    image shape.
 
-    Args:
-      box_masks: A tf.float32 tensor of size [num_masks, mask_height, mask_width].
-      boxes: A tf.float32 tensor of size [num_masks, 4] containing the box
-             corners. Row i contains [ymin, xmin, ymax, xmax] of the box
-             corresponding to mask i. Note that the box corners are in
-             normalized coordinates.
-      image_height: Image height. The output mask will have the same height as
-                    the image height.
-      image_width: Image width. The output mask will have the same width as the
-                   image width.
+def archive_sketch(directory: str, id_: str, data: bytes, extension: str = "jpg"):
+    """Store an uploaded sketch for later inspection
 
-    Returns:
-      A tf.float32 tensor of size [num_masks, image_height, image_width].
+    Arguments:
+        directory {str} -- Directory to store the sketch in
+        id_ {str} -- ID of the sketch
+        data {bytes} -- Encoded image
+        extension {str} -- File extension of the image (default: "jpg")
     """
+    image_path = os.path.join(directory, f"{id_}.{extension}")
 
-    def reframe_box_masks_to_image_masks_default():
-        """The default function when there are more than 0 box masks."""
-
-        def transform_boxes_relative_to_boxes(boxes, reference_boxes):
-            boxes = tf.reshape(boxes, [-1, 2, 2])
-            min_corner = tf.expand_dims(reference_boxes[:, 0:2], 1)
-            max_corner = tf.expand_dims(reference_boxes[:, 2:4], 1)
-            transformed_boxes = (boxes - min_corner) / (max_corner - min_corner)
-            return tf.reshape(transformed_boxes, [-1, 4])
-
-        box_masks_expanded = tf.expand_dims(box_masks, axis=3)
-        num_boxes = tf.shape(box_masks_expanded)[0]
-        unit_boxes = tf.concat([tf.zeros([num_boxes, 2]), tf.ones([num_boxes, 2])], axis=1)
-        reverse_boxes = transform_boxes_relative_to_boxes(unit_boxes, boxes)
-        return tf.image.crop_and_resize(
-            image=box_masks_expanded,
-            boxes=reverse_boxes,
-            box_ind=tf.range(num_boxes),
-            crop_size=[image_height, image_width],
-            extrapolation_value=0.0,
-        )
-
-    image_masks = tf.cond(
-        tf.shape(box_masks)[0] > 0,
-        reframe_box_masks_to_image_masks_default,
-        lambda: tf.zeros([0, image_height, image_width, 1], dtype=tf.float32),
-    )
-
-    return tf.squeeze(image_masks, axis=3)
+    with open(image_path, "wb") as buffer:
+        buffer.write(data)
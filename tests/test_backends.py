@@ -0,0 +1,74 @@
+"""Parity of the detections of the inference backends with the Tensorflow session backend.
+
+Runs the same synthetic sketches through the Tensorflow backend, as the reference, and through
+the OpenCV DNN and ONNX Runtime backends, and checks that each of them detects the same
+elements. A backend is skipped unless it is installed and its model files are available: the
+frozen graph for Tensorflow, with its text graph description for OpenCV, and the graph
+converted to ONNX next to it for ONNX Runtime.
+"""
+
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmarks.backends import compare, load_images
+from src.backends import create_engine
+from src.settings import SETTINGS
+
+pytest.importorskip("tensorflow")
+
+MODEL_NAME = os.path.splitext(SETTINGS.model_path)[0]
+
+# Model files of each backend, the first one being the model file of the backend
+MODEL_FILES = {
+    "tensorflow": [SETTINGS.model_path],
+    "opencv": [SETTINGS.model_path, MODEL_NAME + ".pbtxt"],
+    "onnxruntime": [MODEL_NAME + ".onnx"],
+}
+
+MIN_PROB = 0.5
+MIN_IOU = 0.9
+MAX_SCORE_DIFFERENCE = 0.05
+
+
+def run_backend(backend: str, images: np.ndarray) -> list:
+    """Output dictionaries of a backend for each image, skipping if its model files are missing"""
+    missing = [path for path in MODEL_FILES[backend] if not os.path.exists(path)]
+    if missing:
+        pytest.skip(f"Model files of the {backend} backend are missing: {', '.join(missing)}")
+
+    engine = create_engine(backend, MODEL_FILES[backend][0])
+    try:
+        return [engine.run_single(image) for image in images]
+    finally:
+        engine.close()
+
+
+@pytest.fixture(scope="module")
+def images():
+    return load_images(None, 4)
+
+
+@pytest.fixture(scope="module")
+def reference_outputs(images):
+    return run_backend("tensorflow", images)
+
+
+@pytest.mark.parametrize("backend", ["opencv", "onnxruntime"])
+def test_backend_detects_the_same_elements_as_tensorflow(backend, images, reference_outputs):
+    if backend == "opencv" and not hasattr(cv2, "dnn"):
+        pytest.skip("OpenCV is built without the DNN module")
+    if backend == "onnxruntime":
+        pytest.importorskip("onnxruntime")
+
+    for reference, output in zip(reference_outputs, run_backend(backend, images)):
+        reference_count, count, matches, ious, score_differences = compare(
+            reference, output, MIN_PROB, MIN_IOU
+        )
+
+        # Matches are of the same class, so every element has the same class and a close box
+        assert reference_count == count == matches
+        assert np.all(np.array(ious) >= MIN_IOU)
+        assert np.all(np.array(score_differences) <= MAX_SCORE_DIFFERENCE)